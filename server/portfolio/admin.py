@@ -4,12 +4,21 @@ from .models import (
     CustomizedTemplate,
     PortfolioProject,
     DeletedPortfolioProject,
+    DeploymentJob,
 )
 
 admin.site.register(Template)
 admin.site.register(CustomizedTemplate)
 
 
+class DeploymentJobAdmin(admin.ModelAdmin):
+    list_display = ["id", "portfolio_project", "status", "current_stage", "attempts"]
+    list_filter = ["status"]
+
+
+admin.site.register(DeploymentJob, DeploymentJobAdmin)
+
+
 class PortfolioProjectAdmin(admin.ModelAdmin):
     list_display = ["project_name", "is_deleted"]
 
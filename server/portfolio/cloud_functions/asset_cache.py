@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+from django.conf import settings
+
+
+class CachedAsset:
+    __slots__ = ("content", "etag", "validated_at")
+
+    def __init__(self, content, etag, validated_at):
+        self.content = content
+        self.etag = etag
+        self.validated_at = validated_at
+
+
+class TemplateAssetCache:
+    """
+    Two tier cache of the template static files read from s3: an in process LRU
+    limited by the total size of the files, backed by a cache directory on disk.
+    An entry is trusted for `revalidate_after` seconds, after that it is checked
+    against the s3 ETag with a conditional get, which doesn't transfer the file
+    again while it is unchanged.
+    """
+
+    def __init__(self, max_bytes, cache_dir, revalidate_after):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.revalidate_after = revalidate_after
+        self.entries = OrderedDict()  # (bucket, key) -> CachedAsset
+        self.size = 0
+        self.lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "revalidated": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            entries, size = len(self.entries), self.size
+
+        hits = counters["memory_hits"] + counters["disk_hits"] + counters["revalidated"]
+        requests = hits + counters["misses"]
+        return {
+            **counters,
+            "hit_rate": round(hits / requests, 4) if requests else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def is_fresh(self, asset):
+        return time.time() - asset.validated_at < self.revalidate_after
+
+    def disk_path(self, bucket, key):
+        path = os.path.normpath(os.path.join(self.cache_dir, bucket, key))
+        if not path.startswith(os.path.join(os.path.normpath(self.cache_dir), "")):
+            raise ValueError(f"Invalid asset key {key}")
+        return path
+
+    def read_disk(self, bucket, key):
+        path = self.disk_path(bucket, key)
+        try:
+            with open(f"{path}.meta", "r") as meta_file:
+                meta = json.load(meta_file)
+            with open(path, "rb") as content_file:
+                content = content_file.read()
+        except (OSError, ValueError):
+            return None
+        return CachedAsset(content, meta.get("etag"), meta.get("validated_at", 0))
+
+    def write_temporary_file(self, path, data):
+        # Written to a temporary file first, so readers never see partial files
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(file_descriptor, "wb") as temporary_file:
+            temporary_file.write(data)
+        os.replace(temporary_path, path)
+
+    def write_disk(self, bucket, key, asset, write_content=True):
+        path = self.disk_path(bucket, key)
+        meta = {"etag": asset.etag, "validated_at": asset.validated_at}
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if write_content:
+                self.write_temporary_file(path, asset.content)
+            self.write_temporary_file(f"{path}.meta", json.dumps(meta).encode("utf-8"))
+        except OSError as error:
+            print("Error occurred while writing the template asset cache -> ", error)
+
+    def remember(self, bucket, key, asset):
+        if len(asset.content) > self.max_bytes:
+            return
+
+        with self.lock:
+            previous = self.entries.pop((bucket, key), None)
+            if previous:
+                self.size -= len(previous.content)
+
+            self.entries[(bucket, key)] = asset
+            self.size += len(asset.content)
+
+            # Least recently used files are evicted until the cache fits
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.content)
+                self.counters["evictions"] += 1
+
+    def fetch(self, s3_client, bucket, key, cached):
+        request = {"Bucket": bucket, "Key": key}
+        if cached and cached.etag:
+            request["IfNoneMatch"] = cached.etag
+
+        try:
+            response = s3_client.get_object(**request)
+        except ClientError as error:
+            if cached and error.response.get("Error", {}).get("Code") in (
+                "304",
+                "NotModified",
+            ):
+                self.count("revalidated")
+                return CachedAsset(cached.content, cached.etag, time.time()), False
+            raise
+
+        self.count("misses")
+        asset = CachedAsset(response["Body"].read(), response.get("ETag"), time.time())
+        return asset, True
+
+    def get(self, s3_client, bucket, key):
+        with self.lock:
+            cached = self.entries.get((bucket, key))
+            if cached:
+                self.entries.move_to_end((bucket, key))
+
+        if cached and self.is_fresh(cached):
+            self.count("memory_hits")
+            return cached.content
+
+        if not cached:
+            cached = self.read_disk(bucket, key)
+            if cached and self.is_fresh(cached):
+                self.count("disk_hits")
+                self.remember(bucket, key, cached)
+                return cached.content
+
+        asset, changed = self.fetch(s3_client, bucket, key, cached)
+        self.remember(bucket, key, asset)
+        self.write_disk(bucket, key, asset, write_content=changed)
+        return asset.content
+
+    def invalidate(self, bucket, prefix):
+        if not bucket:
+            return
+
+        with self.lock:
+            for cache_key in [
+                cache_key
+                for cache_key in self.entries
+                if cache_key[0] == bucket and cache_key[1].startswith(prefix)
+            ]:
+                self.size -= len(self.entries.pop(cache_key).content)
+
+        shutil.rmtree(self.disk_path(bucket, prefix), ignore_errors=True)
+
+
+_template_asset_cache = None
+_template_asset_cache_lock = threading.Lock()
+
+
+def get_template_asset_cache():
+    global _template_asset_cache
+
+    if _template_asset_cache is None:
+        with _template_asset_cache_lock:
+            if _template_asset_cache is None:
+                _template_asset_cache = TemplateAssetCache(
+                    max_bytes=settings.TEMPLATE_ASSET_CACHE_MAX_BYTES,
+                    cache_dir=settings.TEMPLATE_ASSET_CACHE_DIR,
+                    revalidate_after=settings.TEMPLATE_ASSET_CACHE_REVALIDATE_AFTER,
+                )
+    return _template_asset_cache
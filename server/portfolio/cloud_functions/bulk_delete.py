@@ -0,0 +1,147 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from server.utils.s3 import s3_config
+from portfolio.constants import (
+    BULK_DELETE_BATCH_SIZE,
+    BULK_DELETE_WORKERS,
+    BULK_DELETE_MAX_ATTEMPTS,
+    BULK_DELETE_RETRY_DELAY,
+)
+
+_bulk_delete_executors = None
+_bulk_delete_lock = threading.Lock()
+
+
+def get_bulk_delete_executors():
+    # Deletions and their batches have pools of their own, so a deletion never
+    # waits for a batch queued behind other deletions
+    global _bulk_delete_executors
+
+    if _bulk_delete_executors is None:
+        with _bulk_delete_lock:
+            if _bulk_delete_executors is None:
+                _bulk_delete_executors = (
+                    ThreadPoolExecutor(
+                        max_workers=2, thread_name_prefix="prefix-deletion"
+                    ),
+                    ThreadPoolExecutor(
+                        max_workers=BULK_DELETE_WORKERS,
+                        thread_name_prefix="prefix-deletion-batch",
+                    ),
+                )
+    return _bulk_delete_executors
+
+
+class PrefixDeletion:
+    """
+    Deletes every object under a prefix. Keys are listed page by page and each
+    page is deleted with delete_objects (at most 1000 keys per call) while the
+    next page is listed, with a bounded number of batches in flight. Keys
+    reported in the Errors of a batch are retried with a backoff, up to
+    BULK_DELETE_MAX_ATTEMPTS times.
+    """
+
+    def __init__(self, bucket_name, prefix, s3_client=None, executor=None, on_progress=None):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.s3_client = s3_client or s3_config()
+        self.executor = executor or get_bulk_delete_executors()[1]
+        self.on_progress = on_progress
+        self.lock = threading.Lock()
+        self.progress = {"listed": 0, "deleted": 0, "retried": 0, "failed": 0, "batches": 0}
+        self.failed_keys = []
+
+    def delete_batch(self, keys):
+        failed = []
+        for attempt in range(BULK_DELETE_MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(BULK_DELETE_RETRY_DELAY * 2 ** (attempt - 1))
+                with self.lock:
+                    self.progress["retried"] += len(keys)
+
+            try:
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+                )
+            except Exception as error:
+                print("Error occurred while deleting the objects on s3 -> ", error)
+                failed = keys
+                continue
+
+            # Quiet responses only list the keys which were not deleted
+            failed = [error["Key"] for error in response.get("Errors", [])]
+            self.count(deleted=len(keys) - len(failed))
+            if not failed:
+                break
+            keys = failed
+
+        self.count(failed=len(failed), batches=1)
+        with self.lock:
+            self.failed_keys.extend(failed)
+
+    def count(self, **counters):
+        with self.lock:
+            for counter, value in counters.items():
+                self.progress[counter] += value
+            progress = dict(self.progress)
+
+        if self.on_progress and "batches" in counters:
+            self.on_progress(progress)
+
+    def keys(self):
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=self.bucket_name,
+            Prefix=self.prefix,
+            PaginationConfig={"PageSize": BULK_DELETE_BATCH_SIZE},
+        ):
+            keys = [obj["Key"] for obj in page.get("Contents", [])]
+            if keys:
+                yield keys
+
+    def run(self):
+        if not self.bucket_name or not self.prefix:
+            # An empty prefix would delete the whole bucket
+            raise ValueError("A bucket and a prefix are required to delete objects")
+
+        start = time.perf_counter()
+        in_flight = set()
+        try:
+            for keys in self.keys():
+                self.count(listed=len(keys))
+                in_flight.add(self.executor.submit(self.delete_batch, keys))
+                if len(in_flight) >= BULK_DELETE_WORKERS * 2:
+                    _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        finally:
+            wait(in_flight)
+
+        with self.lock:
+            return {
+                "bucket": self.bucket_name,
+                "prefix": self.prefix,
+                **self.progress,
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+
+
+def delete_prefix(bucket_name, prefix, s3_client=None, on_progress=None):
+    return PrefixDeletion(
+        bucket_name, prefix, s3_client=s3_client, on_progress=on_progress
+    ).run()
+
+
+def delete_prefix_in_background(bucket_name, prefix):
+    def run():
+        try:
+            report = delete_prefix(bucket_name, prefix)
+        except Exception as error:
+            print(f"Error occurred while deleting {bucket_name}/{prefix} on s3 -> ", error)
+            return None
+
+        if report["failed"]:
+            print(f"Objects left under {bucket_name}/{prefix} on s3 -> ", report)
+        return report
+
+    return get_bulk_delete_executors()[0].submit(run)
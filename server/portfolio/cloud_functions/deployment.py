@@ -0,0 +1,381 @@
+import json
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from server.utils.s3 import s3_config
+from server.compression import CODECS, compress
+from portfolio.exceptions.exceptions import DeploymentError
+from portfolio.constants import (
+    INDEX_FILE,
+    DEPLOY_UPLOAD_WORKERS,
+    DEPLOY_BACKUP_FOLDER_NAME,
+    DEPLOY_MANIFEST_FILE,
+    DEPLOY_COMPRESSION_LEVELS,
+    DEPLOY_COMPRESSED_EXTENSIONS,
+    DEPLOY_COMPRESSED_CONTENT_TYPES,
+)
+
+_deployment_executor = None
+_deployment_lock = threading.Lock()
+
+
+def get_deployment_executor():
+    # One bounded pool for all deploys, the client is the shared s3 client
+    global _deployment_executor
+
+    if _deployment_executor is None:
+        with _deployment_lock:
+            if _deployment_executor is None:
+                _deployment_executor = ThreadPoolExecutor(
+                    max_workers=DEPLOY_UPLOAD_WORKERS,
+                    thread_name_prefix="deployment-upload",
+                )
+    return _deployment_executor, s3_config()
+
+
+def encode_content(file_content):
+    return file_content if isinstance(file_content, bytes) else str(file_content).encode(
+        "utf-8"
+    )
+
+
+def deploy_codings(content_type):
+    if content_type not in DEPLOY_COMPRESSED_CONTENT_TYPES:
+        return []
+    return [coding for coding in DEPLOY_COMPRESSION_LEVELS if coding in CODECS]
+
+
+def manifest_entry(content):
+    return {
+        "sha256": hashlib.sha256(content["body"]).hexdigest(),
+        "size": len(content["body"]),
+        "content_type": content["content_type"],
+        "codings": deploy_codings(content["content_type"]),
+        "cache_control": content.get("cache_control"),
+    }
+
+
+def is_unchanged(previous_entry, entry):
+    # Sizes of the compressed variants follow from the other fields
+    return bool(previous_entry) and all(
+        previous_entry.get(key) == value for key, value in entry.items()
+    )
+
+
+def compressed_variants(content, codings):
+    # Variants which are not smaller than the file itself are not worth storing
+    variants = []
+    for coding in codings:
+        body = compress(content["body"], coding, DEPLOY_COMPRESSION_LEVELS[coding])
+        if len(body) < len(content["body"]):
+            variants.append(
+                {
+                    "file_name": content["file_name"]
+                    + DEPLOY_COMPRESSED_EXTENSIONS[coding],
+                    "source_file": content["file_name"],
+                    "content_type": content["content_type"],
+                    "content_encoding": coding,
+                    "cache_control": content.get("cache_control"),
+                    "body": body,
+                }
+            )
+    return variants
+
+
+def is_missing_object(error):
+    return isinstance(error, ClientError) and error.response.get("Error", {}).get(
+        "Code"
+    ) in ("404", "NoSuchKey")
+
+
+def compression_report(files):
+    # {file: {"identity": size, coding: size}} and the totals of every coding
+    report = {
+        name: {"identity": entry["size"], **entry.get("encoded_sizes", {})}
+        for name, entry in files.items()
+    }
+    totals = {}
+    for sizes in report.values():
+        for coding in ["identity", *DEPLOY_COMPRESSION_LEVELS]:
+            # Files without a variant are served as they are
+            totals[coding] = totals.get(coding, 0) + sizes.get(
+                coding, sizes["identity"]
+            )
+    return {"files": report, "total": totals}
+
+
+class DeploymentUploader:
+    """
+    Publishes the files of a deployment under the project prefix in parallel.
+
+    Only the files whose content hash differs from the manifest of the previous
+    deploy are published. Their live versions are first copied to a backup folder
+    (server side copies), then every file except index.html is uploaded, and
+    index.html is uploaded last. When any upload fails the backups are copied
+    back, so a failed deploy leaves the previously published site in place.
+
+    Text files are published together with brotli and gzip variants, compressed
+    once at deploy time and stored with their Content-Encoding. Files which are
+    not part of the deploy anymore are deleted by the deploy after it.
+    """
+
+    def __init__(self, bucket_name, project_prefix, s3_client=None, executor=None):
+        if executor is None or s3_client is None:
+            shared_executor, shared_client = get_deployment_executor()
+            executor = executor or shared_executor
+            s3_client = s3_client or shared_client
+
+        self.executor = executor
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.project_prefix = project_prefix
+        self.backup_prefix = (
+            f"{project_prefix}/{DEPLOY_BACKUP_FOLDER_NAME}/{uuid.uuid4().hex}"
+        )
+
+    def live_key(self, file_name):
+        return f"{self.project_prefix}/{file_name}"
+
+    def backup_key(self, file_name):
+        return f"{self.backup_prefix}/{file_name}"
+
+    def run_all(self, function, items):
+        # Returns {item: error} of the calls which failed, after all of them finished
+        futures = {item: self.executor.submit(function, item) for item in items}
+        failures = {}
+        for item, future in futures.items():
+            error = future.exception()
+            if error is not None:
+                failures[item] = error
+        return failures
+
+    def copy(self, source_key, key):
+        self.s3_client.copy_object(
+            Bucket=self.bucket_name,
+            CopySource={"Bucket": self.bucket_name, "Key": source_key},
+            Key=key,
+        )
+
+    def backup(self, file_name):
+        # Returns False when there is nothing published under the file name yet
+        try:
+            self.copy(self.live_key(file_name), self.backup_key(file_name))
+            return True
+        except Exception as error:
+            if is_missing_object(error):
+                return False
+            raise
+
+    def read_manifest(self):
+        try:
+            response = self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=self.live_key(DEPLOY_MANIFEST_FILE)
+            )
+            return json.loads(response["Body"].read())
+        except Exception as error:
+            # Without a readable manifest every file is published
+            if not is_missing_object(error):
+                print("Error occurred while reading the deployment manifest -> ", error)
+            return {}
+
+    def write_manifest(self, files, retired):
+        key = self.live_key(DEPLOY_MANIFEST_FILE)
+        try:
+            self.s3_client.put_object(
+                Body=json.dumps({"files": files, "retired": retired}).encode("utf-8"),
+                Bucket=self.bucket_name,
+                Key=key,
+                ContentType="application/json",
+            )
+        except Exception as error:
+            print("Error occurred while writing the deployment manifest -> ", error)
+            # An outdated manifest could skip files which are not live, so drop it
+            try:
+                self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+            except Exception as error:
+                print("Error occurred while deleting the deployment manifest -> ", error)
+
+    def put(self, content):
+        extra_args = {}
+        if content.get("content_encoding"):
+            extra_args["ContentEncoding"] = content["content_encoding"]
+        if content.get("cache_control"):
+            extra_args["CacheControl"] = content["cache_control"]
+
+        self.s3_client.put_object(
+            Body=content["body"],
+            Bucket=self.bucket_name,
+            Key=self.live_key(content["file_name"]),
+            ContentType=content["content_type"],
+            **extra_args,
+        )
+
+    def restore(self, file_name, backed_up):
+        if backed_up:
+            self.copy(self.backup_key(file_name), self.live_key(file_name))
+        else:
+            self.s3_client.delete_object(
+                Bucket=self.bucket_name, Key=self.live_key(file_name)
+            )
+
+    def delete_objects(self, file_names):
+        keys = [{"Key": self.live_key(file_name)} for file_name in file_names]
+        try:
+            for start in range(0, len(keys), 1000):
+                self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": keys[start : start + 1000], "Quiet": True},
+                )
+        except Exception as error:
+            print("Error occurred while deleting the deployment files -> ", error)
+
+    def delete_files(self, file_names):
+        # Files are deleted together with their compressed variants
+        self.delete_objects(
+            [
+                file_name + extension
+                for file_name in file_names
+                for extension in ["", *DEPLOY_COMPRESSED_EXTENSIONS.values()]
+            ]
+        )
+
+    def delete_backups(self, backed_up):
+        keys = [
+            {"Key": self.backup_key(file_name)}
+            for file_name, is_backed_up in backed_up.items()
+            if is_backed_up
+        ]
+        if not keys:
+            return
+
+        try:
+            self.s3_client.delete_objects(
+                Bucket=self.bucket_name, Delete={"Objects": keys, "Quiet": True}
+            )
+        except Exception as error:
+            print("Error occurred while deleting the deployment backups -> ", error)
+
+    def publish(self, contents):
+        backed_up = {}
+
+        def backup(file_name):
+            backed_up[file_name] = self.backup(file_name)
+
+        failures = self.run_all(backup, contents)
+        if failures:
+            self.executor.submit(self.delete_backups, dict(backed_up))
+            raise DeploymentError(
+                "Error occurred while preparing the deployment",
+                {name: str(error) for name, error in failures.items()},
+            )
+
+        # index.html is published only when all the files it refers to are
+        index_files = [
+            name
+            for name, content in contents.items()
+            if content.get("source_file", name) == INDEX_FILE
+        ]
+        published = [name for name in contents if name not in index_files]
+        failures = self.run_all(lambda name: self.put(contents[name]), published)
+        if not failures and index_files:
+            published.extend(index_files)
+            failures = self.run_all(lambda name: self.put(contents[name]), index_files)
+
+        if failures:
+            restore_failures = self.run_all(
+                lambda name: self.restore(name, backed_up[name]), published
+            )
+            if restore_failures:
+                print(
+                    "Error occurred while restoring the previous deployment -> ",
+                    restore_failures,
+                )
+            else:
+                self.executor.submit(self.delete_backups, dict(backed_up))
+
+            raise DeploymentError(
+                "Error occurred while deploying the project",
+                {name: str(error) for name, error in failures.items()},
+            )
+
+        # Backups are not needed once everything is published
+        self.executor.submit(self.delete_backups, dict(backed_up))
+
+    def upload(self, content_to_upload):
+        contents = {
+            content["file_name"]: {
+                **content,
+                "body": encode_content(content["file_content"]),
+            }
+            for content in content_to_upload
+        }
+        files = {name: manifest_entry(content) for name, content in contents.items()}
+
+        manifest = self.read_manifest()
+        previous_files = manifest.get("files") or {}
+        changed = [
+            name
+            for name in contents
+            if not is_unchanged(previous_files.get(name), files[name])
+        ]
+        skipped = [name for name in contents if name not in changed]
+
+        for name in skipped:
+            files[name]["encoded_sizes"] = previous_files[name].get("encoded_sizes", {})
+
+        # Only the changed files are compressed, the levels used are slow
+        variants = {}
+
+        def compress_file(name):
+            variants[name] = compressed_variants(contents[name], files[name]["codings"])
+
+        failures = self.run_all(compress_file, changed)
+        if failures:
+            # Files are still published, served without the missing variants
+            print("Error occurred while compressing the deployment files -> ", failures)
+
+        published = {name: contents[name] for name in changed}
+        for name in changed:
+            files[name]["encoded_sizes"] = {
+                variant["content_encoding"]: len(variant["body"])
+                for variant in variants.get(name, [])
+            }
+            published.update(
+                {variant["file_name"]: variant for variant in variants.get(name, [])}
+            )
+
+        if published:
+            self.publish(published)
+
+        # Variants a changed file does not get anymore would serve its old content
+        stale_variants = [
+            name + DEPLOY_COMPRESSED_EXTENSIONS[coding]
+            for name in changed
+            for coding in (previous_files.get(name) or {}).get("encoded_sizes", {})
+            if coding in DEPLOY_COMPRESSED_EXTENSIONS
+            and coding not in files[name]["encoded_sizes"]
+        ]
+        if stale_variants:
+            self.delete_objects(stale_variants)
+
+        # Files left out of a deploy are deleted by the next one, until then they
+        # are still there for index.html copies cached before the deploy
+        retired = [name for name in previous_files if name not in files]
+        expired = [name for name in manifest.get("retired") or [] if name not in files]
+        if files != previous_files or expired:
+            self.write_manifest(files, retired)
+        if expired:
+            self.executor.submit(self.delete_files, expired)
+
+        return {
+            "uploaded": list(published),
+            "skipped": skipped,
+            "deleted_variants": stale_variants,
+            "uploaded_objects": len(published),
+            "uploaded_bytes": sum(len(content["body"]) for content in published.values()),
+            "skipped_objects": len(skipped),
+            "skipped_bytes": sum(files[name]["size"] for name in skipped),
+            "compressed_sizes": compression_report(files),
+        }
@@ -1,17 +1,19 @@
 import os
-from server.utils.s3 import get_cloudfront_domain, S3CLientSingleton, s3_name_format
+from server.utils.s3 import S3CLientSingleton, s3_name_format
+from server.utils.cloudfront import get_cloudfront_domain
 from portfolio.constants import (
     S3_ASSETS_FOLDER_NAME,
     S3_CSS_FOLDER_NAME,
     S3_JS_FOLDER_NAME,
     INDEX_FILE,
     TEMPLATE_PREVIEW_IMAGE,
-    EMAIL_JS_FILE,
 )
 from portfolio.exceptions.exceptions import TemplateRetrievalError, GeneralError
 from django.conf import settings
-import mimetypes
 from portfolio.dom_manipulation.handle_dom import build_html_using_json
+from portfolio.cloud_functions.asset_cache import get_template_asset_cache
+from portfolio.cloud_functions.bulk_delete import delete_prefix
+from portfolio.cloud_functions.template_upload import TemplateUploader, template_files
 
 
 class S3_Template:
@@ -86,51 +88,26 @@ class S3_Template:
         local_folder_path = os.path.join(self.local_template_path, self.template_name)
 
         try:
-            for root, _, files in os.walk(local_folder_path):
-                # Don't upload .git folder and index file on s3
-                if ".git" in root or INDEX_FILE in files:
-                    continue
-
-                for file_name in files:
-                    local_file_path = os.path.join(root, file_name)
-                    s3_key = s3_folder_key + os.path.relpath(
-                        local_file_path, local_folder_path
-                    )
-                    s3_key = s3_key.replace(
-                        "\\", "/"
-                    )  # Ensure forward slashes in S3 key
-
-                    content_type, _ = mimetypes.guess_type(local_file_path)
-                    if not content_type:
-                        content_type = "application/octet-stream"
-
-                    try:
-                        with open(local_file_path, "rb") as file_data:
-                            self.s3_client.upload_fileobj(
-                                file_data,
-                                self.bucket_name,
-                                s3_key,
-                                ExtraArgs={"ContentType": content_type},
-                            )
-                    except Exception as error:
-                        print(
-                            "Error occurred while reading or uploading the object -> ",
-                            error,
-                        )
-                        raise GeneralError(
-                            "Error occurred while uploading the content to storage"
-                        )
-
+            files = list(template_files(local_folder_path, s3_folder_key))
         except Exception as error:
             print("Template is not present in the local directory -> ", error)
             raise GeneralError("Template is not present in the local directory")
 
+        try:
+            upload_summary = TemplateUploader(self.bucket_name).upload(files)
+        except Exception as error:
+            print("Error occurred while reading or uploading the object -> ", error)
+            raise GeneralError("Error occurred while uploading the content to storage")
+
         try:
             self.upload_index_file_to_s3()
         except Exception as error:
             print("Error occurred while uploading the html file on s3 -> ", error)
             raise GeneralError("Error occurred while uploading the html file")
-        return
+
+        # Files cached under the same template name belong to the previous upload
+        get_template_asset_cache().invalidate(self.bucket_name, s3_folder_key)
+        return upload_summary
 
     def create_template_url(self):
         domain_name = os.environ.get("DOMAIN_NAME")
@@ -149,19 +126,19 @@ class S3_Template:
 
     def delete_template_from_s3(self):
         s3_folder_key = f"{self.template_name}/"
+        get_template_asset_cache().invalidate(self.bucket_name, s3_folder_key)
 
+        # Rolled back before responding, so the template name can be used again
         try:
-            response = self.s3_client.list_objects_v2(
-                Bucket=self.bucket_name, Prefix=s3_folder_key
+            report = delete_prefix(
+                self.bucket_name, s3_folder_key, s3_client=self.s3_client
             )
-            if "Contents" in response:
-                for obj in response["Contents"]:
-                    self.s3_client.delete_object(
-                        Bucket=self.bucket_name, Key=obj["Key"]
-                    )
         except Exception as error:
             print("Error occurred while deleting from S3:", error)
             raise GeneralError("Error occurred while roll back")
+        if report["failed"]:
+            print("Error occurred while deleting from S3:", report)
+            raise GeneralError("Error occurred while roll back")
 
     def upload_index_file_to_s3(self):
         s3_key = f"{self.template_name}/{INDEX_FILE}"
@@ -200,32 +177,3 @@ class S3_Project:
                 error,
             )
             raise GeneralError("Error occurred while creating the project assets")
-
-    def configure_user_contact_form(self, user_email, template_name):
-        s3_formatted_template_name = s3_name_format(template_name)
-        s3_formatted_project_name = s3_name_format(self.project_name)
-        
-        TEMPLATE_JS_OBJECT_KEY = (
-            f"{s3_formatted_template_name}/{S3_JS_FOLDER_NAME}/{EMAIL_JS_FILE}"
-        )
-        PROJECT_JS_OBJECT_KEY = (
-            f"{s3_formatted_project_name}/{S3_JS_FOLDER_NAME}/{EMAIL_JS_FILE}"
-        )
-
-        response = self.s3_client.get_object(
-            Bucket=settings.AWS_STORAGE_TEMPLATE_BUCKET_NAME, Key=TEMPLATE_JS_OBJECT_KEY
-        )
-        js_code = (
-            response["Body"].read().decode("utf-8")
-        )  # Read and decode the JS content
-
-        # Step 2: Replace the placeholder with the actual email
-        modified_js_code = js_code.replace("{{USER_EMAIL}}", user_email, 1)
-
-        # Step 3: Upload the modified JS file back to S3
-        self.s3_client.put_object(
-            Bucket=settings.AWS_DEPLOYED_PORTFOLIO_BUCKET_NAME,
-            Key=PROJECT_JS_OBJECT_KEY,
-            Body=modified_js_code,
-            ContentType="application/javascript",
-        )
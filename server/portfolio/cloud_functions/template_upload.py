@@ -0,0 +1,110 @@
+import os
+import time
+import threading
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from server.utils.s3 import s3_config
+from portfolio.constants import (
+    INDEX_FILE,
+    TEMPLATE_UPLOAD_WORKERS,
+    TEMPLATE_UPLOAD_MULTIPART_THRESHOLD,
+    TEMPLATE_UPLOAD_CHUNK_SIZE,
+    TEMPLATE_UPLOAD_FILE_CONCURRENCY,
+)
+
+
+def template_files(local_folder_path, s3_folder_key):
+    # (local path, s3 key) of the files of a template, .git folder and index file excluded
+    for root, _, files in os.walk(local_folder_path):
+        if ".git" in root or INDEX_FILE in files:
+            continue
+
+        for file_name in files:
+            local_file_path = os.path.join(root, file_name)
+            s3_key = s3_folder_key + os.path.relpath(local_file_path, local_folder_path)
+            yield local_file_path, s3_key.replace("\\", "/")  # Forward slashes in S3 key
+
+
+class FileProgress:
+    # Transfer callback of one file, called from the transfer threads
+    def __init__(self, uploader, s3_key, size):
+        self.uploader = uploader
+        self.s3_key = s3_key
+        self.size = size
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, bytes_sent):
+        with self.lock:
+            self.sent += bytes_sent
+            sent = self.sent
+        self.uploader.report(self.s3_key, sent, self.size)
+
+
+class TemplateUploader:
+    """
+    Uploads the files of a template with TEMPLATE_UPLOAD_WORKERS files at a time.
+    Files over the multipart threshold are sent in parts, at most
+    TEMPLATE_UPLOAD_FILE_CONCURRENCY at a time. The uploader has a client of its
+    own with a pool for all of its connections, so an upload doesn't take the
+    connections of the shared client from deploys and deletions. The first
+    failed file cancels the files not started yet and is raised.
+    """
+
+    def __init__(self, bucket_name, s3_client=None, on_progress=None):
+        self.bucket_name = bucket_name
+        self.s3_client = s3_client or s3_config(
+            Config(
+                max_pool_connections=TEMPLATE_UPLOAD_WORKERS
+                * TEMPLATE_UPLOAD_FILE_CONCURRENCY
+            )
+        )
+        self.on_progress = on_progress
+        self.transfer_config = TransferConfig(
+            multipart_threshold=TEMPLATE_UPLOAD_MULTIPART_THRESHOLD,
+            multipart_chunksize=TEMPLATE_UPLOAD_CHUNK_SIZE,
+            max_concurrency=TEMPLATE_UPLOAD_FILE_CONCURRENCY,
+        )
+
+    def report(self, s3_key, sent, size):
+        if self.on_progress:
+            self.on_progress(s3_key, sent, size)
+
+    def upload_file(self, local_file_path, s3_key):
+        content_type, _ = mimetypes.guess_type(local_file_path)
+        size = os.path.getsize(local_file_path)
+        self.s3_client.upload_file(
+            local_file_path,
+            self.bucket_name,
+            s3_key,
+            ExtraArgs={"ContentType": content_type or "application/octet-stream"},
+            Config=self.transfer_config,
+            Callback=FileProgress(self, s3_key, size),
+        )
+        return size
+
+    def upload(self, files):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(
+            max_workers=TEMPLATE_UPLOAD_WORKERS, thread_name_prefix="template-upload"
+        ) as executor:
+            futures = [
+                executor.submit(self.upload_file, local_file_path, s3_key)
+                for local_file_path, s3_key in files
+            ]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in not_done:
+                future.cancel()
+            for future in done:
+                future.result()  # Raises the error of a failed file
+
+        seconds = time.perf_counter() - start
+        uploaded = sum(future.result() for future in futures)
+        return {
+            "files": len(futures),
+            "bytes": uploaded,
+            "seconds": round(seconds, 3),
+            "bytes_per_second": round(uploaded / seconds) if seconds else 0,
+        }
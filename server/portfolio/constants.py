@@ -23,6 +23,7 @@ UNIVERSAL_STYLE_FILE = "universal-style.css"
 RESPONSIVE_STYLE_FILE = "responsive.css"
 ROOT_JS_FILE = "script.js"
 EMAIL_JS_FILE = "email.js"
+EMAIL_JS_PLACEHOLDER = "{{USER_EMAIL}}"  # Replaced with the contact email of the project
 TEMPLATE_PREVIEW_IMAGE = "preview.png"
 
 
@@ -51,3 +52,91 @@ ELEMENT_CATEGORY = {
     "ORDERED_LIST": {"type": "container", "sub_type": "", "tag": "ol"},
     "SPAN": {"type": "container", "sub_type": "", "tag": "span"},
 }
+
+
+# Elements collected from the template index file, in the order they are stored
+DOCUMENT_TREE_ELEMENTS = ["meta", "link", "title", "style", "body", "script"]
+
+# Elements which never have a closing tag
+VOID_ELEMENTS = {
+    "area",
+    "base",
+    "basefont",
+    "bgsound",
+    "br",
+    "col",
+    "command",
+    "embed",
+    "frame",
+    "hr",
+    "image",
+    "img",
+    "input",
+    "isindex",
+    "keygen",
+    "link",
+    "menuitem",
+    "meta",
+    "nextid",
+    "param",
+    "source",
+    "spacer",
+    "track",
+    "wbr",
+}
+
+# Attributes whose value is stored as a list of space separated values
+MULTI_VALUED_ATTRIBUTES = {
+    "*": {"class", "accesskey", "dropzone"},
+    "a": {"rel", "rev"},
+    "link": {"rel", "rev"},
+    "td": {"headers"},
+    "th": {"headers"},
+    "form": {"accept-charset"},
+    "object": {"archive"},
+    "area": {"rel"},
+    "icon": {"sizes"},
+    "iframe": {"sandbox"},
+    "output": {"for"},
+}
+
+# Copy on write customized templates
+BODY_OVERRIDE_KEY = "*"  # Override key when the whole body is replaced
+ADDED_ELEMENTS_KEY = "+"  # Override key of the elements not present in the template
+MATERIALIZED_TEMPLATE_CACHE = "templates"  # Cache alias shared by all the processes
+MATERIALIZED_TEMPLATE_CACHE_TIMEOUT = 60 * 15
+
+# Deployment
+COMPILED_CSS_CACHE_TIMEOUT = 60 * 60 * 24
+MINIFIED_ASSET_CACHE_TIMEOUT = 60 * 60 * 24
+DEPLOY_UPLOAD_WORKERS = 8  # Shared by all the deployments of a server process
+DEPLOY_BACKUP_FOLDER_NAME = ".deploy-backup"
+DEPLOY_MANIFEST_FILE = ".deploy-manifest.json"  # Content hashes of the deployed files
+# Pre-compressed variants are stored next to the file, e.g. index.html.br
+DEPLOY_COMPRESSION_LEVELS = {"br": 11, "gzip": 9}
+DEPLOY_COMPRESSED_EXTENSIONS = {"br": ".br", "gzip": ".gz"}
+DEPLOY_COMPRESSED_CONTENT_TYPES = {"text/html", "text/css", "application/javascript"}
+# Files under content hashed keys never change, so they are cached for good
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+FINGERPRINT_LENGTH = 12  # Hex characters of the content sha256 in the key
+
+# Deployment jobs
+DEPLOY_JOB_MAX_ATTEMPTS = 3
+DEPLOY_JOB_RETRY_DELAY = 30  # Seconds before the first retry, doubled for each next one
+DEPLOY_JOB_USER_CONCURRENCY = 2  # Running deployments allowed per user
+DEPLOY_JOB_STALE_AFTER = 60 * 10  # Running jobs without a heartbeat for this long are requeued
+DEPLOY_JOB_HEARTBEAT_INTERVAL = 60  # Seconds between heartbeats of a running job
+DEPLOY_WORKER_THREADS = 2
+DEPLOY_WORKER_POLL_INTERVAL = 2
+
+# Deletion of every object under a template or project prefix
+BULK_DELETE_BATCH_SIZE = 1000  # Limit of keys per delete_objects call
+BULK_DELETE_WORKERS = 4  # Batches deleted at the same time
+BULK_DELETE_MAX_ATTEMPTS = 3
+BULK_DELETE_RETRY_DELAY = 0.5  # Seconds before retrying failed keys, doubled each time
+
+# Upload of the template files to the templates bucket
+TEMPLATE_UPLOAD_WORKERS = 8  # Files uploaded at the same time
+TEMPLATE_UPLOAD_MULTIPART_THRESHOLD = 8 * 1024 * 1024  # Larger files are sent in parts
+TEMPLATE_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+TEMPLATE_UPLOAD_FILE_CONCURRENCY = 2  # Parts per file, workers x parts is the uploader's pool
@@ -0,0 +1,525 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction, IntegrityError
+from django.utils import timezone
+from server.utils.s3 import s3_name_format
+from server.utils.cloudfront import get_invalidation_batcher
+from portfolio.models import DeploymentJob, CustomizedTemplate
+from portfolio.serializers import CustomizedTemplateSerializer
+from portfolio.cloud_functions.asset_cache import get_template_asset_cache
+from portfolio.cloud_functions.deployment import (
+    DeploymentUploader,
+    get_deployment_executor,
+)
+from portfolio.dom_manipulation.css_compiler import compile_css_cached
+from portfolio.dom_manipulation.minify import minify, minification_report
+from portfolio.dom_manipulation.tree_walker import copy_dom_tree
+from portfolio.utils import fingerprint_file_name
+from portfolio.dom_manipulation.html_emitter import (
+    HTMLEmitter,
+    substitute_meta_charset,
+)
+from portfolio.exceptions.exceptions import (
+    DataNotPresent,
+    DeploymentError,
+    DeploymentJobLost,
+)
+from portfolio.constants import (
+    INDEX_FILE,
+    RESPONSIVE_STYLE_FILE,
+    UNIVERSAL_STYLE_FILE,
+    ROOT_JS_FILE,
+    EMAIL_JS_FILE,
+    EMAIL_JS_PLACEHOLDER,
+    S3_JS_FOLDER_NAME,
+    S3_CSS_FOLDER_NAME,
+    ROOT_STYLE_FILE,
+    DEPLOY_JOB_MAX_ATTEMPTS,
+    DEPLOY_JOB_RETRY_DELAY,
+    DEPLOY_JOB_USER_CONCURRENCY,
+    DEPLOY_JOB_STALE_AFTER,
+    DEPLOY_JOB_HEARTBEAT_INTERVAL,
+    IMMUTABLE_CACHE_CONTROL,
+)
+
+
+# Relative references of deployed files, e.g. "css/style.css" or "./css/style.css"
+ASSET_REFERENCE_RE = re.compile(r"^(\./|/|)(.*)$", re.S)
+
+
+def build_html(meta, body, links, title, description):
+    emitter = HTMLEmitter()
+    emitter.start_tag("html")
+
+    for element in meta:
+        emitter.element(
+            {
+                "tag": element.get("tag"),
+                "attributes": substitute_meta_charset(
+                    element.get("tag"), element.get("attributes", {})
+                ),
+                "text": element.get("text"),
+            }
+        )
+    emitter.element(
+        {
+            "tag": "meta",
+            "attributes": {"name": "description", "content": description},
+        }
+    )
+
+    emitter.start_tag("head")
+    emitter.element({"tag": "title", "text": title})
+    emitter.elements(links)
+    emitter.end_tag("head")
+    emitter.element(body[0])
+    emitter.end_tag("html")
+    return emitter.getvalue()
+
+
+def extract_template_files(s3_client, template_name, folder_name, files):
+    asset_cache = get_template_asset_cache()
+    return {
+        file: asset_cache.get(
+            s3_client,
+            settings.AWS_STORAGE_TEMPLATE_BUCKET_NAME,
+            f"{template_name}/{folder_name}/{file}",
+        ).decode("utf-8")
+        for file in files
+    }
+
+
+def rewrite_asset_references(elements, fingerprints):
+    # Copies of the elements with src and href of deployed files fingerprinted
+    def rewrite(element):
+        attributes = element["attributes"]
+        for name in ("src", "href"):
+            value = attributes.get(name)
+            if not isinstance(value, str):
+                continue
+
+            prefix, path = ASSET_REFERENCE_RE.match(value).groups()
+            if path in fingerprints:
+                attributes[name] = prefix + fingerprints[path]
+
+    return [copy_dom_tree(element, enter=rewrite) for element in elements or []]
+
+
+def claimed_job(job):
+    # The job as long as it is still run by this attempt, i.e. not requeued or claimed again
+    return DeploymentJob.objects.filter(
+        pk=job.pk,
+        status=DeploymentJob.RUNNING,
+        worker=job.worker,
+        attempts=job.attempts,
+    )
+
+
+class DeploymentHeartbeat:
+    """
+    Refreshes the heartbeat of a running job from a thread every
+    DEPLOY_JOB_HEARTBEAT_INTERVAL seconds, so a long stage is not taken for a
+    dead worker and requeued. Stops once the job is no longer claimed.
+    """
+
+    def __init__(self, job, interval=DEPLOY_JOB_HEARTBEAT_INTERVAL):
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = False
+        self.thread = None
+
+    def beat(self):
+        if not claimed_job(self.job).update(heartbeat_at=timezone.now()):
+            self.lost = True
+        return not self.lost
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.interval):
+                try:
+                    if not self.beat():
+                        break
+                except Exception as error:
+                    print("Error occurred while saving the deployment heartbeat -> ", error)
+        finally:
+            connection.close()  # Connection of the heartbeat thread
+
+    def __enter__(self):
+        self.thread = threading.Thread(
+            target=self.run, name=f"deployment-heartbeat-{self.job.pk}", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+
+class DeploymentPipeline:
+    """
+    Deploys the customized template of a job in stages. The current stage is saved
+    when a stage starts, a heartbeat is saved while the stages run, and the time
+    taken by every stage is recorded in the job's stage timings.
+    """
+
+    stages = [
+        "fetch_assets",
+        "minify",
+        "fingerprint",
+        "render",
+        "upload",
+        "invalidate",
+        "update_project",
+    ]
+
+    def __init__(self, job, s3_client=None):
+        self.job = job
+        self.s3_client = s3_client or get_deployment_executor()[1]
+        self.customized_template = CustomizedTemplate.objects.select_related(
+            "template", "portfolio_project"
+        ).get(id=job.customized_template_id)
+        self.portfolio_project = self.customized_template.portfolio_project
+        self.project_name = s3_name_format(str(job.payload.get("project_name")))
+        self.template_data = CustomizedTemplateSerializer(self.customized_template).data
+        self.minified_sizes = {}
+        self.result = {}
+
+    def save_stage(self, stage):
+        self.job.current_stage = stage
+        self.job.heartbeat_at = timezone.now()
+        if not claimed_job(self.job).update(
+            current_stage=stage,
+            heartbeat_at=self.job.heartbeat_at,
+            stage_timings=self.job.stage_timings,
+        ):
+            raise DeploymentJobLost(f"Deployment job {self.job.pk} is no longer claimed")
+
+    def run(self):
+        self.job.stage_timings = {}
+        with DeploymentHeartbeat(self.job):
+            for stage in self.stages:
+                self.save_stage(stage)
+                started = time.perf_counter()
+                getattr(self, stage)()
+                self.job.stage_timings[stage] = round(time.perf_counter() - started, 4)
+        return self.result
+
+    def fetch_assets(self):
+        template_name = self.customized_template.template.template_name
+        try:
+            self.css = extract_template_files(
+                self.s3_client,
+                template_name,
+                S3_CSS_FOLDER_NAME,
+                [ROOT_STYLE_FILE, RESPONSIVE_STYLE_FILE, UNIVERSAL_STYLE_FILE],
+            )
+            self.js = extract_template_files(
+                self.s3_client,
+                template_name,
+                S3_JS_FOLDER_NAME,
+                [ROOT_JS_FILE, EMAIL_JS_FILE],
+            )
+        except Exception as error:
+            raise DeploymentError(
+                f"Error occurred while getting the template files -> {error}"
+            )
+
+        # Filled in before fingerprinting, the contact form sends to the project email
+        self.js[EMAIL_JS_FILE] = self.js[EMAIL_JS_FILE].replace(
+            EMAIL_JS_PLACEHOLDER,
+            self.portfolio_project.portfolio_contact_configured_email,
+            1,
+        )
+
+    def minified(self, file_name, content, content_type, cached=True):
+        # Template files are the same for every deploy, so their results are cached
+        result = minify(content, content_type, cached=cached)
+        self.minified_sizes[file_name] = (len(content.encode()), len(result.encode()))
+        return result
+
+    def minify(self):
+        style = self.template_data.get("style")
+        custom_css = "" if isinstance(style, dict) else compile_css_cached(style[0])
+
+        css = {
+            f"{S3_CSS_FOLDER_NAME}/{file}": self.minified(
+                f"{S3_CSS_FOLDER_NAME}/{file}", content, "text/css"
+            )
+            for file, content in self.css.items()
+        }
+        css[f"{S3_CSS_FOLDER_NAME}/{ROOT_STYLE_FILE}"] += "\n" + custom_css
+        js = {
+            f"{S3_JS_FOLDER_NAME}/{file}": self.minified(
+                f"{S3_JS_FOLDER_NAME}/{file}",
+                content,
+                "application/javascript",
+                cached=file != EMAIL_JS_FILE,  # Differs for every project
+            )
+            for file, content in self.js.items()
+        }
+
+        self.assets = [
+            {"file_name": name, "content_type": "text/css", "file_content": content}
+            for name, content in css.items()
+        ] + [
+            {
+                "file_name": name,
+                "content_type": "application/javascript",
+                "file_content": content,
+            }
+            for name, content in js.items()
+        ]
+
+    def fingerprint(self):
+        # css/style.css -> css/style.<hash>.css, so the files are cached for good
+        self.fingerprints = {}
+        for asset in self.assets:
+            fingerprinted_name = fingerprint_file_name(
+                asset["file_name"],
+                hashlib.sha256(asset["file_content"].encode("utf-8")).hexdigest(),
+            )
+            self.fingerprints[asset["file_name"]] = fingerprinted_name
+            asset["file_name"] = fingerprinted_name
+            asset["cache_control"] = IMMUTABLE_CACHE_CONTROL
+
+    def render(self):
+        self.title = self.job.payload.get("title")
+        self.description = self.job.payload.get("description")
+        if not self.title and not self.description:
+            self.title = self.portfolio_project.portfolio_title
+            self.description = self.portfolio_project.portfolio_description
+
+        html = build_html(
+            meta=self.template_data.get("meta"),
+            body=rewrite_asset_references(
+                [self.template_data.get("body")], self.fingerprints
+            ),
+            links=rewrite_asset_references(
+                self.template_data.get("links"), self.fingerprints
+            ),
+            title=self.title,
+            description=self.description,
+        )
+        self.html = self.minified(INDEX_FILE, html, "text/html", cached=False)
+
+    def upload(self):
+        content_to_upload = [
+            {
+                "file_name": INDEX_FILE,
+                "content_type": "text/html",
+                "file_content": self.html,
+            },
+            *self.assets,
+        ]
+
+        self.deployment = DeploymentUploader(
+            bucket_name=settings.AWS_DEPLOYED_PORTFOLIO_BUCKET_NAME,
+            project_prefix=self.project_name,
+            s3_client=self.s3_client,
+        ).upload(content_to_upload)
+
+    def invalidate(self):
+        # Fingerprinted files are new keys, only index.html can be stale in CloudFront
+        immutable_files = set(self.fingerprints.values())
+        paths = [
+            f"/{self.project_name}/{file_name}"
+            for file_name in [
+                *self.deployment["uploaded"],
+                *self.deployment["deleted_variants"],
+            ]
+            if file_name not in immutable_files
+            and os.path.splitext(file_name)[0] not in immutable_files
+        ]
+        if paths:
+            # Sent with the paths of other deploys after a short window
+            get_invalidation_batcher().submit(paths)
+
+    def update_project(self):
+        domain_name = os.environ.get("DOMAIN_NAME")
+        deployed_url = f"{self.portfolio_project.project_slug}.{domain_name}"
+
+        self.portfolio_project.deployed_url = deployed_url
+        self.portfolio_project.is_deployed = True
+        self.portfolio_project.portfolio_title = self.title
+        self.portfolio_project.portfolio_description = self.description
+        self.portfolio_project.save()
+
+        self.result = {
+            "deployed_url": deployed_url,
+            "uploaded_objects": self.deployment["uploaded_objects"],
+            "uploaded_bytes": self.deployment["uploaded_bytes"],
+            "skipped_objects": self.deployment["skipped_objects"],
+            "skipped_bytes": self.deployment["skipped_bytes"],
+            "minified_sizes": minification_report(self.minified_sizes),
+            "compressed_sizes": self.deployment["compressed_sizes"],
+        }
+
+
+def enqueue_deployment_job(customized_template, user, payload):
+    """
+    Queues a deployment of the customized template. A deployment which is still
+    waiting in the queue for the same project is updated instead, so repeated
+    deploy requests are coalesced into one job.
+    """
+    with transaction.atomic():
+        job = (
+            DeploymentJob.objects.select_for_update()
+            .filter(
+                portfolio_project_id=customized_template.portfolio_project_id,
+                status=DeploymentJob.QUEUED,
+            )
+            .order_by("created_at")
+            .first()
+        )
+        if job:
+            # A new request is not held back by the retry backoff of the queued one
+            job.payload = payload
+            job.attempts = 0
+            job.available_at = timezone.now()
+            job.save(update_fields=["payload", "attempts", "available_at"])
+            return job
+
+        return DeploymentJob.objects.create(
+            customized_template=customized_template,
+            portfolio_project_id=customized_template.portfolio_project_id,
+            created_by=user,
+            payload=payload,
+        )
+
+
+def claim_deployment_job(worker):
+    """
+    Marks the oldest runnable queued job as running and returns it, or None.
+    Jobs of a project with a running deployment, and of users already running
+    DEPLOY_JOB_USER_CONCURRENCY deployments, wait for those to finish.
+    """
+    now = timezone.now()
+    candidates = DeploymentJob.objects.filter(
+        status=DeploymentJob.QUEUED, available_at__lte=now
+    ).order_by("created_at")
+
+    for job in candidates.iterator():
+        try:
+            with transaction.atomic():
+                # Claims of the same user are serialized by the lock on the user row
+                get_user_model().objects.select_for_update().filter(
+                    pk=job.created_by_id
+                ).exists()
+
+                running = DeploymentJob.objects.filter(status=DeploymentJob.RUNNING)
+                if running.filter(portfolio_project_id=job.portfolio_project_id).exists():
+                    continue
+                if (
+                    running.filter(created_by_id=job.created_by_id).count()
+                    >= DEPLOY_JOB_USER_CONCURRENCY
+                ):
+                    continue
+
+                claimed = DeploymentJob.objects.filter(
+                    pk=job.pk, status=DeploymentJob.QUEUED
+                ).update(
+                    status=DeploymentJob.RUNNING,
+                    attempts=job.attempts + 1,
+                    worker=worker,
+                    started_at=now,
+                    heartbeat_at=now,
+                    current_stage="",
+                    error="",
+                )
+        except IntegrityError:
+            # Another worker started a deployment of the project meanwhile
+            continue
+
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+    return None
+
+
+def finish_deployment_job(job, result=None, error=None, retry=False):
+    job.finished_at = timezone.now()
+    job.heartbeat_at = job.finished_at
+
+    if error is None:
+        job.status = DeploymentJob.SUCCEEDED
+        job.current_stage = ""
+        job.result = result or {}
+    elif retry and job.attempts < DEPLOY_JOB_MAX_ATTEMPTS:
+        # Retried with an exponential backoff, the failed stage is kept for the status
+        job.status = DeploymentJob.QUEUED
+        job.available_at = job.finished_at + timedelta(
+            seconds=DEPLOY_JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        )
+        job.error = str(error)
+    else:
+        job.status = DeploymentJob.FAILED
+        job.error = str(error)
+
+    # A requeued job may be run by another worker meanwhile, which owns it now
+    finished = claimed_job(job).update(
+        **{
+            field: getattr(job, field)
+            for field in [
+                "status",
+                "current_stage",
+                "stage_timings",
+                "result",
+                "error",
+                "available_at",
+                "heartbeat_at",
+                "finished_at",
+            ]
+        }
+    )
+    if not finished:
+        print(f"Deployment job {job.pk} is no longer claimed, its outcome is dropped")
+        job.refresh_from_db()
+    return job
+
+
+def run_deployment_job(job, s3_client=None):
+    try:
+        result = DeploymentPipeline(job, s3_client=s3_client).run()
+    except DeploymentJobLost as error:
+        print("Error occurred while deploying the project -> ", error)
+        job.refresh_from_db()
+        return job
+    except (DataNotPresent, ObjectDoesNotExist) as error:
+        print("Error occurred while deploying the project -> ", error)
+        return finish_deployment_job(job, error=error)
+    except DeploymentError as error:
+        print("Error occurred while deploying the project -> ", error, error.failures)
+        failures = ", ".join(error.failures)
+        return finish_deployment_job(
+            job, error=f"{error}: {failures}" if failures else error, retry=True
+        )
+    except Exception as error:
+        print("Error occurred while deploying the project -> ", error)
+        return finish_deployment_job(job, error=error, retry=True)
+
+    return finish_deployment_job(job, result=result)
+
+
+def requeue_stale_deployment_jobs():
+    # Jobs of workers which stopped without finishing them are run again
+    now = timezone.now()
+    stale = DeploymentJob.objects.filter(
+        status=DeploymentJob.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=DEPLOY_JOB_STALE_AFTER),
+    )
+    stale.filter(attempts__gte=DEPLOY_JOB_MAX_ATTEMPTS).update(
+        status=DeploymentJob.FAILED,
+        error="Deployment stopped responding",
+        finished_at=now,
+    )
+    return stale.update(status=DeploymentJob.QUEUED, available_at=now)
@@ -0,0 +1,63 @@
+import hashlib
+from django.core.cache import cache
+from server.renderers import encode_json
+from portfolio.constants import COMPILED_CSS_CACHE_TIMEOUT
+
+
+def collect_declarations(properties):
+    # Last value of a property wins, same as it would in the stylesheet
+    declarations = {}
+    for prop in properties or []:
+        if prop.get("value"):
+            declarations[prop.get("property")] = f"{prop.get('value')}".lower()
+    return tuple(declarations.items())
+
+
+def group_css_rules(css_json):
+    """
+    Returns [selectors, declarations] groups of the style JSON without empty
+    rules. Rules with identical declarations share a group unless a rule in
+    between declares one of their properties, so the cascade is unchanged.
+    """
+    groups = []
+    group_by_declarations = {}
+    last_declared_in = {}  # Property -> index of the last group declaring it
+
+    for class_name, properties in css_json.items():
+        declarations = collect_declarations(properties)
+        if not declarations:
+            continue
+
+        position = group_by_declarations.get(declarations)
+        if position is None or any(
+            last_declared_in[name] > position for name, _ in declarations
+        ):
+            position = len(groups)
+            groups.append([[], declarations])
+            group_by_declarations[declarations] = position
+
+        groups[position][0].append(f".{class_name}")
+        for name, _ in declarations:
+            last_declared_in[name] = max(last_declared_in.get(name, -1), position)
+
+    return groups
+
+
+def compile_css(css_json):
+    css_rules = []
+    for selectors, declarations in group_css_rules(css_json):
+        body = ";".join(f"{name}:{value}!important" for name, value in declarations)
+        css_rules.append(f"{','.join(selectors)}{{{body}}}")
+    return "".join(css_rules)
+
+
+def compile_css_cached(css_json):
+    # Compiled css is cached by the hash of the style JSON, in the same order
+    digest = hashlib.sha256(encode_json(css_json)).hexdigest()
+    cache_key = f"compiled-css-{digest}"
+
+    css = cache.get(cache_key)
+    if css is None:
+        css = compile_css(css_json)
+        cache.set(cache_key, css, COMPILED_CSS_CACHE_TIMEOUT)
+    return css
@@ -0,0 +1,177 @@
+import re
+from html.parser import HTMLParser
+from portfolio.constants import (
+    DOCUMENT_TREE_ELEMENTS,
+    VOID_ELEMENTS,
+    MULTI_VALUED_ATTRIBUTES,
+)
+from portfolio.dom_manipulation.tree_walker import copy_dom_tree
+
+PARSER_CHUNK_SIZE = 64 * 1024
+nonwhitespace_re = re.compile(r"\S+")
+
+
+class OpenElement:
+    __slots__ = ("node", "content_count", "only_string", "first_text", "collected")
+
+    def __init__(self, node, collected):
+        self.node = node
+        self.content_count = 0
+        self.only_string = None  # Value of the element's single child as a string
+        self.first_text = ""  # First non empty direct text of the element
+        self.collected = collected
+
+
+class DOMTreeParser(HTMLParser):
+    """
+    Tokenizer driven parser that builds the DOM JSON of the collected elements
+    ({"tag", "attributes", "text", "children"}) in a single pass over the html.
+    The produced JSON matches the one built from a BeautifulSoup "html.parser" tree.
+    """
+
+    def __init__(self, collect=DOCUMENT_TREE_ELEMENTS, on_start_tag=None):
+        super().__init__(convert_charrefs=True)
+        self.collect = collect
+        self.on_start_tag = on_start_tag
+        self.stack = []
+        self.pending_data = []
+        self.collected_elements = []
+        self.collected_depth = 0
+
+    def feed_source(self, source):
+        # Source can be a string or a file like object which is read in chunks
+        if hasattr(source, "read"):
+            while True:
+                chunk = source.read(PARSER_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.feed(chunk)
+        else:
+            self.feed(source)
+        self.close()
+        return self.dom_tree()
+
+    def dom_tree(self):
+        dom_tree_json = {}
+        for tag in self.collect:
+            elements = [
+                copy_dom_tree(node) if nested else node
+                for element_tag, node, nested in self.collected_elements
+                if element_tag == tag
+            ]
+            if elements:
+                dom_tree_json[tag] = elements
+        return dom_tree_json
+
+    def build_attributes(self, tag, attrs):
+        attributes = {}
+        for name, value in attrs:
+            attributes[name] = "" if value is None else value
+
+        for name in MULTI_VALUED_ATTRIBUTES["*"] | MULTI_VALUED_ATTRIBUTES.get(
+            tag, set()
+        ):
+            if name in attributes:
+                attributes[name] = nonwhitespace_re.findall(attributes[name])
+        return attributes
+
+    def flush_data(self):
+        if self.pending_data:
+            data = "".join(self.pending_data)
+            self.pending_data = []
+            self.add_string(data)
+
+    def add_string(self, data):
+        if not self.stack:
+            return
+
+        parent = self.stack[-1]
+        parent.content_count += 1
+        if parent.content_count == 1:
+            parent.only_string = data
+        if not parent.first_text:
+            parent.first_text = data.strip()
+
+    def handle_starttag(self, tag, attrs):
+        self.start_element(tag, attrs)
+        if tag in VOID_ELEMENTS:
+            self.close_elements(len(self.stack) - 1)
+
+    def handle_startendtag(self, tag, attrs):
+        self.start_element(tag, attrs)
+        self.close_elements(len(self.stack) - 1)
+
+    def start_element(self, tag, attrs):
+        self.flush_data()
+        attributes = self.build_attributes(tag, attrs)
+
+        if self.on_start_tag:
+            self.on_start_tag(tag, attributes)
+
+        node = {"tag": tag, "attributes": attributes, "text": "", "children": []}
+        collected = tag in self.collect
+
+        if self.stack:
+            parent = self.stack[-1]
+            parent.node["children"].append(node)
+            parent.content_count += 1
+
+        if collected:
+            self.collected_elements.append((tag, node, self.collected_depth > 0))
+            self.collected_depth += 1
+
+        self.stack.append(OpenElement(node, collected))
+
+    def handle_endtag(self, tag):
+        self.flush_data()
+
+        # End tags without any matching open element are ignored
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index].node["tag"] == tag:
+                self.close_elements(index)
+                return
+
+    def close_elements(self, index):
+        while len(self.stack) > index:
+            element = self.stack.pop()
+            string = element.only_string if element.content_count == 1 else None
+
+            text = string.strip() if string else ""
+            element.node["text"] = text or element.first_text
+
+            if element.collected:
+                self.collected_depth -= 1
+
+            # A single child element passes its string up to the parent
+            if self.stack:
+                parent = self.stack[-1]
+                if parent.content_count == 1:
+                    parent.only_string = string
+
+    def handle_data(self, data):
+        self.pending_data.append(data)
+
+    def handle_comment(self, data):
+        self.flush_data()
+        self.add_string(data)
+
+    # Comments, declarations and processing instructions are strings of their
+    # parent, with the prefixes BeautifulSoup drops removed
+    def handle_decl(self, decl):
+        self.flush_data()
+        self.add_string(decl[len("DOCTYPE ") :])
+
+    def handle_pi(self, data):
+        self.flush_data()
+        self.add_string(data)
+
+    def unknown_decl(self, data):
+        self.flush_data()
+        if data.upper().startswith("CDATA["):
+            data = data[len("CDATA[") :]
+        self.add_string(data)
+
+    def close(self):
+        super().close()
+        self.flush_data()
+        self.close_elements(0)
@@ -0,0 +1,228 @@
+from portfolio.exceptions.exceptions import PatchError
+from portfolio.dom_manipulation.handle_dom import assign_element_identity
+from portfolio.dom_manipulation.tree_walker import copy_dom_tree, copy_attributes
+from portfolio.dom_manipulation.template_overrides import element_id
+from portfolio.constants import (
+    ELEMENT_IDENTIFIER_PREFIX,
+    ELEMENT_IDENTIFIER_VALUE,
+    ADDED_ELEMENTS_KEY,
+)
+
+
+def index_dom_tree(element, path=None, index=None):
+    # Maps data-element-id of every element to its path of child positions
+    index = {} if index is None else index
+    stack = [(element, path or [])]
+
+    while stack:
+        current, current_path = stack.pop()
+        identifier = element_id(current)
+        if identifier:
+            index[identifier] = current_path
+
+        for position, child in enumerate(current.get("children") or []):
+            stack.append((child, current_path + [position]))
+
+    return index
+
+
+class DOMPatcher:
+    """
+    Applies editor operations addressed by data-element-id to a DOM tree:
+
+        {"op": "set_text", "id": ..., "text": ...}
+        {"op": "set_attribute", "id": ..., "name": ..., "value": ...}
+        {"op": "insert", "parent": ..., "index": ..., "element": {...}}
+        {"op": "remove", "id": ...}
+        {"op": "move", "id": ..., "parent": ..., "index": ...}
+
+    Elements are found through the id to path index, which is kept up to date
+    for the subtrees changed by insert, remove and move.
+    """
+
+    def __init__(self, body, index, allocator):
+        self.body = body
+        self.index = index
+        self.allocator = allocator
+        self.index_changed = False
+        self.changed = {}  # Element id -> changed keys of the element
+        self.inserted = set()
+        self.removed = set()
+
+        self.allocator.reserve(self.index)
+
+    def resolve(self, path):
+        element = self.body
+        for position in path:
+            children = element.get("children") or []
+            if position >= len(children):
+                return None
+            element = children[position]
+        return element
+
+    def find(self, identifier):
+        path = self.index.get(identifier)
+        element = self.resolve(path) if path is not None else None
+
+        if element is None or element_id(element) != identifier:
+            # Index is out of date with the tree, rebuilding it once
+            self.index.clear()
+            index_dom_tree(self.body, index=self.index)
+            self.index_changed = True
+
+            path = self.index.get(identifier)
+            if path is None:
+                raise PatchError(f"Element {identifier} does not exist.")
+            element = self.resolve(path)
+
+        return element, path
+
+    def mark_changed(self, element, key):
+        self.changed.setdefault(element_id(element), set()).add(key)
+
+    def reindex(self, element, path):
+        index_dom_tree(element, path=path, index=self.index)
+        self.index_changed = True
+
+    def apply(self, operation):
+        handlers = {
+            "set_text": self.set_text,
+            "set_attribute": self.set_attribute,
+            "insert": self.insert,
+            "remove": self.remove,
+            "move": self.move,
+        }
+        handler = None
+        if isinstance(operation, dict):
+            handler = handlers.get(operation.get("op"))
+
+        if not handler:
+            raise PatchError(f"Invalid patch operation {operation}")
+
+        handler(operation)
+
+    def set_text(self, operation):
+        element, _ = self.find(operation.get("id"))
+        element["text"] = operation.get("text") or ""
+        self.mark_changed(element, "text")
+
+    def set_attribute(self, operation):
+        element, _ = self.find(operation.get("id"))
+        name = operation.get("name")
+        if not name or name == ELEMENT_IDENTIFIER_PREFIX:
+            raise PatchError(f"Attribute {name} cannot be changed.")
+
+        # A null value removes the attribute
+        if operation.get("value") is None:
+            element["attributes"].pop(name, None)
+        else:
+            element["attributes"][name] = operation.get("value")
+        self.mark_changed(element, "attributes")
+
+    def new_element(self, element):
+        if not isinstance(element, dict) or not element.get("tag"):
+            raise PatchError("Element to insert is not valid.")
+
+        def prepare(elem):
+            elem.setdefault("text", "")
+            identifier = elem["attributes"].get(ELEMENT_IDENTIFIER_PREFIX)
+
+            if not identifier:
+                assign_element_identity(elem, self.allocator)
+            elif identifier in self.allocator.allocated:
+                elem["attributes"][ELEMENT_IDENTIFIER_PREFIX] = (
+                    self.allocator.allocate(ELEMENT_IDENTIFIER_VALUE)
+                )
+            else:
+                self.allocator.reserve([identifier])
+
+        try:
+            return copy_dom_tree(element, enter=prepare)
+        except (AttributeError, KeyError, TypeError):
+            raise PatchError("Element to insert is not valid.")
+
+    def insert_child(self, parent, parent_path, element, position):
+        children = parent.setdefault("children", [])
+        if not isinstance(position, int) or not 0 <= position <= len(children):
+            position = len(children)
+
+        children.insert(position, element)
+        self.reindex(parent, parent_path)
+        self.mark_changed(parent, "children")
+
+    def detach(self, element, path):
+        if not path:
+            raise PatchError("Root element cannot be removed or moved.")
+
+        parent_path = path[:-1]
+        parent = self.resolve(parent_path)
+        parent["children"].pop(path[-1])
+        self.reindex(parent, parent_path)
+        self.mark_changed(parent, "children")
+
+    def insert(self, operation):
+        parent, parent_path = self.find(operation.get("parent"))
+        element = self.new_element(operation.get("element"))
+        self.inserted.add(element_id(element))
+        self.insert_child(parent, parent_path, element, operation.get("index"))
+
+    def remove(self, operation):
+        element, path = self.find(operation.get("id"))
+        self.detach(element, path)
+
+        for identifier in index_dom_tree(element):
+            self.index.pop(identifier, None)
+            self.removed.add(identifier)
+
+    def move(self, operation):
+        element, path = self.find(operation.get("id"))
+        if operation.get("parent") in index_dom_tree(element):
+            raise PatchError("Element cannot be moved inside itself.")
+
+        self.detach(element, path)
+        parent, parent_path = self.find(operation.get("parent"))
+        self.insert_child(parent, parent_path, element, operation.get("index"))
+
+    def update_overrides(self, overrides):
+        # Changed values of the patched elements become their overrides
+        added_elements = overrides.setdefault(ADDED_ELEMENTS_KEY, {})
+        for identifier in self.removed:
+            overrides.pop(identifier, None)
+            added_elements.pop(identifier, None)
+
+        for identifier, keys in self.changed.items():
+            if identifier not in self.index:
+                continue
+
+            element, _ = self.find(identifier)
+            override = overrides.setdefault(identifier, {})
+            for key in keys:
+                if key == "attributes":
+                    override[key] = copy_attributes(element[key])
+                elif key == "children":
+                    # Children are stored as ids, resolved when the tree is materialized
+                    override[key] = [
+                        element_id(child) or copy_dom_tree(child)
+                        for child in element[key]
+                    ]
+                else:
+                    override[key] = element[key]
+
+        # Inserted elements are stored as a whole, unless they are inside another one
+        inserted_paths = {
+            tuple(self.index[identifier])
+            for identifier in self.inserted
+            if identifier in self.index
+        }
+        for identifier in self.inserted:
+            path = self.index.get(identifier)
+            if path is None or any(
+                tuple(path[:depth]) in inserted_paths for depth in range(len(path))
+            ):
+                continue
+            added_elements[identifier] = copy_dom_tree(self.find(identifier)[0])
+
+        if not added_elements:
+            overrides.pop(ADDED_ELEMENTS_KEY)
+
+        return overrides
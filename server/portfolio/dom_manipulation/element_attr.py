@@ -1,4 +1,4 @@
-from portfolio.utils import generate_random_characters
+from portfolio.utils import allocate_identifier
 from portfolio.constants import (
     ELEMENT_DEFAULT_CLASS_NAME,
     ASSET_ID_VALUE,
@@ -8,9 +8,9 @@ from portfolio.constants import (
 )
 
 
-def assign_class_name(elem):
+def assign_class_name(elem, allocator=None):
     if elem:
-        created_class_name = f"{ELEMENT_DEFAULT_CLASS_NAME}-{generate_random_characters(digits=8)}".lower()
+        created_class_name = allocate_identifier(ELEMENT_DEFAULT_CLASS_NAME, allocator)
 
         # Check if the element has a "class" attribute
         if elem.has_attr("class"):
@@ -22,20 +22,18 @@ def assign_class_name(elem):
         return elem
 
 
-def assign_asset_id(elem):
+def assign_asset_id(elem, allocator=None):
     if elem:
-        created_asset_id = (
-            f"{ASSET_ID_VALUE}-{generate_random_characters(digits=8)}".lower()
-        )
+        created_asset_id = allocate_identifier(ASSET_ID_VALUE, allocator)
 
         elem[ASSET_ID_PREFIX] = created_asset_id
         return elem
 
 
-def assign_identifier(elem):
+def assign_identifier(elem, allocator=None):
     if elem:
-        created_element_identifier = (
-            f"{ELEMENT_IDENTIFIER_VALUE}-{generate_random_characters(digits=8)}".lower()
+        created_element_identifier = allocate_identifier(
+            ELEMENT_IDENTIFIER_VALUE, allocator
         )
 
         elem[ELEMENT_IDENTIFIER_PREFIX] = created_element_identifier
@@ -0,0 +1,27 @@
+from portfolio.constants import ELEMENT_CATEGORY, ELEMENT_TYPE, ELEMENT_SUB_TYPE
+
+
+def compile_element_labels(element_category):
+    """
+    Builds a tag -> attributes lookup table from the element categories, so an
+    element is labelled with one exact dictionary lookup. Tags listed in more
+    than one category keep the first category, same as the category order.
+    """
+    element_labels = {}
+
+    for category_value in element_category.values():
+        tags = category_value["tag"]
+        if isinstance(tags, str):
+            tags = [tags]
+
+        labels = {ELEMENT_TYPE: category_value["type"]}
+        if category_value["sub_type"]:
+            labels[ELEMENT_SUB_TYPE] = category_value["sub_type"]
+
+        for tag in tags:
+            element_labels.setdefault(tag, labels)
+
+    return element_labels
+
+
+ELEMENT_LABELS = compile_element_labels(ELEMENT_CATEGORY)
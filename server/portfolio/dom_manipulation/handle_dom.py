@@ -1,125 +1,94 @@
-from bs4 import BeautifulSoup
 from portfolio.dom_manipulation.element_attr import assign_asset_id
+from portfolio.dom_manipulation.dom_parser import DOMTreeParser
+from portfolio.dom_manipulation.html_emitter import HTMLEmitter
+from portfolio.dom_manipulation.tree_walker import walk_dom_tree, copy_dom_tree
+from portfolio.dom_manipulation.element_classifier import ELEMENT_LABELS
 from portfolio.constants import (
     S3_ASSETS_FOLDER_NAME,
     ASSET_ID_PREFIX,
-    DOCUMENT_META_ELEMENTS,
+    DOCUMENT_TREE_ELEMENTS,
     INDEX_FILE,
     ELEMENT_DEFAULT_CLASS_NAME,
     ELEMENT_IDENTIFIER_PREFIX,
     ELEMENT_IDENTIFIER_VALUE,
-    ELEMENT_CATEGORY,
     ELEMENT_TYPE,
     UPLOADABLE_ELEMENT,
     ELEMENT_SUB_TYPE,
 )
 import os
-from server.utils.s3 import AWS_S3_Operations, get_cloudfront_domain, download_assets
+from server.utils.s3 import AWS_S3_Operations, download_assets
+from server.utils.cloudfront import get_cloudfront_domain
 from django.conf import settings
 from portfolio.exceptions.exceptions import GeneralError
-from portfolio.utils import generate_random_characters
-
-empty_html_template = """
-                        <!DOCTYPE html>
-                        <html lang="en">
-                        <head>
-                            <meta charset="UTF-8">
-                            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                            <title></title>
-                        </head>
-                        <body>
-                        </body>
-                        </html>
-                    """
-
-
-def extract_element(dom, tag_name):
-    tag = dom.find_all(tag_name)
-    if tag:
-        return tag
-    else:
-        return ""
+from portfolio.utils import IdentifierAllocator
+
+# Markup of the empty document the template elements are placed in
+EMPTY_DOCUMENT_HEAD = (
+    "\n<!DOCTYPE html>\n\n"
+    '<html lang="en">\n'
+    "<head>\n"
+    '<meta charset="utf-8"/>\n'
+    '<meta content="width=device-width, initial-scale=1.0" name="viewport"/>\n'
+)
 
 
 class HTML_Document:
-    def __init__(self):
-        self.inital_html = empty_html_template
-        self.soup = BeautifulSoup(self.inital_html, "html.parser")
+    def __init__(self, stream=None):
+        self.emitter = HTMLEmitter(stream)
+        self.title = None
+        self.head_elements = []
+        self.body = None
+        self.scripts = []
 
     def update_head_content(self, element_json=[]):
-        head_tag = self.soup.head
         for element in element_json:
-            tag = self.soup.new_tag(element["tag"])
-            if element["tag"] == "title":
-                title_tag = self.soup.title
-
-                if not title_tag.get_text():
-                    tag.string = element["text"]
-                    title_tag.replace_with(tag)
-                    return
+            if element["tag"] == "title" and not self.title:
+                self.title = element["text"]
+                return
 
-            for attr, value in element["attributes"].items():
-                tag[attr] = " ".join(value) if isinstance(value, list) else value
-
-            head_tag.append(tag)
+            # Head elements are added without their text content
+            self.head_elements.append(
+                {"tag": element["tag"], "attributes": element["attributes"]}
+            )
 
         return
 
     def update_body_content(self, body_json=[]):
-        body_tag = self.soup.body
-        parsed_body = self.parse_body_element(body_json)[0]
-        body_tag.replace_with(parsed_body)
-
+        self.body = body_json[0]
         return
 
-    def parse_body_element(self, elements, parent=None):
-        top_level_elements = []
-        for element in elements:
-            tag_name = element.get("tag").lower()
-            new_tag = self.soup.new_tag(tag_name)
-
-            if "attributes" in element and len(element.get("attributes")):
-                for attr, value in element.get("attributes").items():
-                    if isinstance(value, list):
-                        new_tag[attr] = " ".join(value)  # Join classes with space
-                    else:
-                        new_tag[attr] = value
-            if "text" in element and element.get("text"):
-                new_tag.string = element.get("text")
-
-            if "children" in element and element.get("children"):
-                self.parse_body_element(element.get("children"), new_tag)
-
-            if parent:
-                parent.append(new_tag)
-            else:
-                top_level_elements.append(new_tag)
-
-        if parent is None:
-            return top_level_elements
-
-        return parent
-
     def add_script_to_body(self, scripts_json=[]):
-        body_tag = self.soup.body
-
         for script in scripts_json:
-            script_tag = self.soup.new_tag("script")
+            self.scripts.append({"tag": "script", "attributes": script["attributes"]})
 
-            for key, value in script["attributes"].items():
-                script_tag[key] = value
+        return
 
-            body_tag.append(script_tag)
+    def render(self):
+        emitter = self.emitter
+        emitter.raw(EMPTY_DOCUMENT_HEAD)
+        emitter.element({"tag": "title", "text": self.title})
+        emitter.raw("\n")
+        emitter.elements(self.head_elements)
+        emitter.raw("</head>\n")
+
+        if self.body:
+            children = self.body.get("children") or []
+            emitter.element({**self.body, "children": children + self.scripts})
+        else:
+            emitter.raw("<body>\n")
+            emitter.elements(self.scripts)
+            emitter.raw("</body>")
 
-        return
+        emitter.raw("\n</html>\n")
+        return emitter.getvalue()
 
 
-def handle_anchor_element(anchor_tag, template_name):
+def handle_anchor_element(anchor_tag, template_name, allocator=None):
     if anchor_tag:
         # If download attribute is present in anchor, then it is asset
         if anchor_tag.get("download"):
             href = anchor_tag.get("href")
-            anchor_tag = assign_asset_id(anchor_tag)
+            anchor_tag = assign_asset_id(anchor_tag, allocator=allocator)
             asset_name = anchor_tag.get(ASSET_ID_PREFIX)
             old_s3_asset_key = (
                 f'{template_name}/{S3_ASSETS_FOLDER_NAME}/{href.split("/")[-1]}'
@@ -193,54 +162,31 @@ def handle_image_source(img_tag, template_name):
     return img_tag
 
 
-def build_dom_tree(elem, template_name):
-    if not elem:
-        return None
-
-    if not elem.name in DOCUMENT_META_ELEMENTS:
-        # add asset id to image and update the src
-        if elem.name == "img":
-            elem = assign_asset_id(elem=elem)
-            elem = handle_image_source(img_tag=elem, template_name=template_name)
+def handle_element_assets(tag, attributes, template_name, allocator=None):
+    # add asset id to image and update the src, images without a src are left as they are
+    if tag == "img" and attributes.get("src"):
+        assign_asset_id(elem=attributes, allocator=allocator)
+        handle_image_source(img_tag=attributes, template_name=template_name)
 
-        # add asset id to image and update the href
-        if elem.name == "a" and elem.get("download"):
-            elem = assign_asset_id(elem=elem)
-            elem = handle_anchor_element(
-                anchor_tag=elem,
-                template_name=template_name,
-            )
-
-    dom_tree = {
-        "tag": elem.name,
-        "attributes": elem.attrs if elem.attrs else {},
-        "text": elem.string.strip() if elem.string else "",
-        "children": [],
-    }
-
-    for child in elem.contents:
-        if isinstance(child, str):
-            if dom_tree["text"] == "":
-                dom_tree["text"] += child.strip()
-        elif child.name is not None:
-            dom_tree["children"].append(build_dom_tree(child, template_name))
-    return dom_tree
+    # add asset id to anchor and update the href
+    if tag == "a" and attributes.get("download"):
+        handle_anchor_element(
+            anchor_tag=attributes, template_name=template_name, allocator=allocator
+        )
 
 
 def parse_html_content(html_content, template_name):
-    soup = BeautifulSoup(html_content, "html.parser")
-    tags = ["meta", "link", "title", "style", "body", "script"]
-    dom_tree_json = {}
-
-    for tag in tags:
-        elements = extract_element(soup, tag)
-        if elements:
-            if tag not in dom_tree_json:
-                dom_tree_json[tag] = []
-            for element in elements:
-                dom_tree_json[tag].append(build_dom_tree(element, template_name))
-
-    return dom_tree_json
+    allocator = IdentifierAllocator()
+    parser = DOMTreeParser(
+        collect=DOCUMENT_TREE_ELEMENTS,
+        on_start_tag=lambda tag, attributes: handle_element_assets(
+            tag=tag,
+            attributes=attributes,
+            template_name=template_name,
+            allocator=allocator,
+        ),
+    )
+    return parser.feed_source(html_content)
 
 
 def build_html_using_json(template_name):
@@ -258,7 +204,7 @@ def build_html_using_json(template_name):
     document.update_body_content(body)
     document.add_script_to_body(script)
 
-    return {"html": document.soup, "html_json": parsed_content}
+    return {"html": document.render(), "html_json": parsed_content}
 
 
 def parse_local_index_file(template_name):
@@ -279,44 +225,93 @@ def parse_local_index_file(template_name):
         raise GeneralError("Error occurred while reading the html file on local")
 
 
-def parse_dom_tree(dom_tree):
-    if not dom_tree:
-        raise GeneralError("DOM tree is not provided.")
+def assign_element_identity(elem, allocator, label=True):
+    if elem["tag"] == "body":
+        return
 
     # Assign classname and unique identifier
-    class_name = (
-        f"{ELEMENT_DEFAULT_CLASS_NAME}-{generate_random_characters(digits=8)}".lower()
-    )
-    unique_identifier = (
-        f"{ELEMENT_IDENTIFIER_VALUE}-{generate_random_characters(digits=8)}".lower()
+    class_name = allocator.allocate(ELEMENT_DEFAULT_CLASS_NAME)
+    unique_identifier = allocator.allocate(ELEMENT_IDENTIFIER_VALUE)
+
+    if "class" in elem["attributes"]:
+        elem["attributes"]["class"].append(class_name)
+    else:
+        elem["attributes"]["class"] = [class_name]
+
+    elem["attributes"][ELEMENT_IDENTIFIER_PREFIX] = unique_identifier
+
+    if label:
+        label_html_elements(elem)
+
+
+def get_sections(body):
+    sections = []
+    for elem in body["children"]:
+        if elem["tag"] == "section":
+            sections.append({elem["tag"]: elem["attributes"]["id"]})
+    return sections
+
+
+def compile_template_skeleton(template_dom_tree):
+    """
+    Does the per template work of project creation once: labels the type and
+    sub type of every element, gives it its class name and identifier and
+    extracts the sections. Projects read their body from the skeleton, so the
+    identifier of an element never depends on its position in the tree.
+    """
+    if not template_dom_tree or not template_dom_tree.get("body"):
+        raise GeneralError("DOM tree is not provided.")
+
+    allocator = IdentifierAllocator()
+    body = copy_dom_tree(
+        template_dom_tree["body"][0],
+        enter=lambda elem: assign_element_identity(elem, allocator),
     )
 
-    if not dom_tree["tag"] == "body":
-        if "class" in dom_tree["attributes"]:
-            dom_tree["attributes"]["class"].append(class_name)
-        else:
-            dom_tree["attributes"]["class"] = [class_name]
+    return {
+        "body": body["children"][0] if body["children"] else None,
+        "sections": get_sections(body),
+    }
 
-        dom_tree["attributes"][ELEMENT_IDENTIFIER_PREFIX] = unique_identifier
-        dom_tree = label_html_elements(dom_tree)
 
-    for child in dom_tree["children"]:
-        parse_dom_tree(dom_tree=child)
+def dom_tree_identifiers(element):
+    # Identifiers and class names used in the tree, reserved before allocating new ones
+    identifiers = set()
 
-    return dom_tree
+    def collect(elem):
+        attributes = elem.get("attributes") or {}
+        if attributes.get(ELEMENT_IDENTIFIER_PREFIX):
+            identifiers.add(attributes[ELEMENT_IDENTIFIER_PREFIX])
+        class_names = attributes.get("class") or []
+        identifiers.update(
+            class_names if isinstance(class_names, list) else class_names.split()
+        )
 
+    walk_dom_tree([element], enter=collect)
+    return identifiers
 
-def label_html_elements(elem):
-    for _, category_value in ELEMENT_CATEGORY.items():
 
-        if elem["tag"] in category_value["tag"]:
-            elem["attributes"][ELEMENT_TYPE] = category_value["type"]
+def stamp_dom_tree(skeleton_body):
+    # Elements added to the skeleton get their identity, the others keep theirs
+    if not skeleton_body:
+        return skeleton_body
+
+    allocator = IdentifierAllocator()
+    allocator.reserve(dom_tree_identifiers(skeleton_body))
+
+    def stamp(elem):
+        if not (elem.get("attributes") or {}).get(ELEMENT_IDENTIFIER_PREFIX):
+            elem.setdefault("attributes", {})
+            assign_element_identity(elem, allocator)
 
-            # Assignin sub type of the element
-            if category_value["sub_type"]:
-                elem["attributes"][ELEMENT_SUB_TYPE] = category_value["sub_type"]
+    walk_dom_tree([skeleton_body], enter=stamp)
+    return skeleton_body
 
-            break
+
+def label_html_elements(elem):
+    labels = ELEMENT_LABELS.get(elem["tag"])
+    if labels:
+        elem["attributes"].update(labels)
 
     # Check for any uploadable element
     if ASSET_ID_PREFIX in elem["attributes"]:
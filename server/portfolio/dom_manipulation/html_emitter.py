@@ -0,0 +1,120 @@
+import io
+import re
+from portfolio.constants import VOID_ELEMENTS
+from portfolio.dom_manipulation.tree_walker import walk_dom_tree
+
+# Text of these elements is written as it is, without escaping
+RAW_TEXT_ELEMENTS = {"script", "style"}
+
+TEXT_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+CHARSET_RE = re.compile(r"((^|;)\s*charset=)([^;]*)", re.M)
+
+
+def escape_text(text):
+    return text.translate(TEXT_ESCAPE_TABLE)
+
+
+def quote_attribute_value(value):
+    value = escape_text(value)
+    if '"' in value:
+        if "'" in value:
+            return '"' + value.replace('"', "&quot;") + '"'
+        return "'" + value + "'"
+    return '"' + value + '"'
+
+
+def substitute_meta_charset(tag, attributes, encoding="utf-8"):
+    # Declared charset of a meta tag is written as the encoding of the output
+    if tag != "meta":
+        return attributes
+
+    if attributes.get("charset") is not None:
+        return {**attributes, "charset": encoding}
+
+    http_equiv = attributes.get("http-equiv")
+    content = attributes.get("content")
+    if content is not None and http_equiv and http_equiv.lower() == "content-type":
+        content = CHARSET_RE.sub(lambda match: match.group(1) + encoding, content)
+        return {**attributes, "content": content}
+
+    return attributes
+
+
+def format_attributes(attributes):
+    formatted = []
+    # Attributes are written in sorted order, same as BeautifulSoup does
+    for name, value in sorted(attributes.items()):
+        if value is None:
+            formatted.append(f" {name}")
+            continue
+
+        if isinstance(value, (list, tuple)):
+            value = " ".join(value)
+        elif not isinstance(value, str):
+            value = str(value)
+        formatted.append(f" {name}={quote_attribute_value(value)}")
+    return "".join(formatted)
+
+
+class HTMLEmitter:
+    """
+    Writes html directly from the DOM JSON into a string buffer or any file like
+    stream. The markup is the same as BeautifulSoup's default (minimal) output.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else io.StringIO()
+        self.write = self.stream.write
+
+    def raw(self, content):
+        self.write(content)
+
+    def start_tag(self, tag, attributes=None, self_closing=False):
+        attrs = format_attributes(attributes) if attributes else ""
+        self.write(f"<{tag}{attrs}/>" if self_closing else f"<{tag}{attrs}>")
+
+    def end_tag(self, tag):
+        self.write(f"</{tag}>")
+
+    def text(self, text, tag):
+        self.write(text if tag in RAW_TEXT_ELEMENTS else escape_text(text))
+
+    def is_self_closing(self, element):
+        return (
+            element.get("tag").lower() in VOID_ELEMENTS
+            and not element.get("text")
+            and not element.get("children")
+        )
+
+    def enter_element(self, element):
+        tag = element.get("tag").lower()
+
+        if self.is_self_closing(element):
+            self.start_tag(tag, element.get("attributes"), self_closing=True)
+            return
+
+        self.start_tag(tag, element.get("attributes"))
+        if element.get("text"):
+            self.text(element.get("text"), tag)
+
+    def leave_element(self, element):
+        if not self.is_self_closing(element):
+            self.end_tag(element.get("tag").lower())
+
+    def element(self, element):
+        self.elements([element])
+
+    def elements(self, elements):
+        walk_dom_tree(elements, enter=self.enter_element, leave=self.leave_element)
+
+    def getvalue(self):
+        # Only available when writing into an in memory buffer
+        if hasattr(self.stream, "getvalue"):
+            return self.stream.getvalue()
+        return None
+
+
+def render_elements(elements):
+    emitter = HTMLEmitter()
+    emitter.elements(elements)
+    return emitter.getvalue()
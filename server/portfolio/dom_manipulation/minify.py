@@ -0,0 +1,215 @@
+import re
+import hashlib
+from functools import lru_cache
+from html.parser import HTMLParser
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from portfolio.constants import MINIFIED_ASSET_CACHE_TIMEOUT
+
+try:
+    import rcssmin
+except ImportError:  # rcssmin is optional, a conservative minifier is used without it
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:  # rjsmin is optional, scripts are not minified without it
+    rjsmin = None
+
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+# Whitespace next to these elements is never rendered, so it can be dropped
+BLOCK_ELEMENTS = set(
+    "html head body title meta link base script style div p main section article "
+    "aside header footer nav ul ol li dl dt dd h1 h2 h3 h4 h5 h6 table caption "
+    "colgroup col thead tbody tfoot tr td th form fieldset legend figure "
+    "figcaption blockquote address details summary hr br".split()
+)
+# Text of these elements is written as it is
+PRESERVED_ELEMENTS = {"pre", "textarea", "script", "style"}
+
+
+class HTMLMinifier(HTMLParser):
+    """
+    Re-emits html with the whitespace of text collapsed to single spaces and the
+    comments removed. Whitespace next to block elements is dropped, tags are
+    written as they were, and pre, textarea, script and style are untouched.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.output = []
+        self.preserved_depth = 0
+        self.pending_space = False
+        self.after_block = True
+
+    def flush_space(self, before_block):
+        if self.pending_space and not before_block and not self.after_block:
+            self.output.append(" ")
+        self.pending_space = False
+
+    def tag(self, tag, text):
+        is_block = tag in BLOCK_ELEMENTS
+        self.flush_space(is_block)
+        self.output.append(text)
+        self.after_block = is_block
+
+    def text(self, text):
+        self.flush_space(False)
+        self.output.append(text)
+        self.after_block = False
+
+    def handle_starttag(self, tag, attrs):
+        self.tag(tag, self.get_starttag_text())
+        if tag in PRESERVED_ELEMENTS:
+            self.preserved_depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        self.tag(tag, self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if tag in PRESERVED_ELEMENTS and self.preserved_depth:
+            self.preserved_depth -= 1
+        self.tag(tag, f"</{tag}>")
+
+    def handle_data(self, data):
+        if self.preserved_depth:
+            self.output.append(data)
+            return
+
+        collapsed = WHITESPACE_RE.sub(" ", data)
+        if collapsed.startswith(" "):
+            self.pending_space = True
+        if collapsed.strip():
+            self.text(collapsed.strip())
+            self.pending_space = collapsed.endswith(" ")
+
+    def handle_entityref(self, name):
+        self.handle_reference(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_reference(f"&#{name};")
+
+    def handle_reference(self, reference):
+        if self.preserved_depth:
+            self.output.append(reference)
+        else:
+            self.text(reference)
+
+    def handle_comment(self, data):
+        # Conditional comments are markup for old browsers, not comments
+        if data.startswith("[if") or data.startswith("<![endif"):
+            self.output.append(f"<!--{data}-->")
+
+    def handle_decl(self, decl):
+        self.output.append(f"<!{decl}>")
+
+    def unknown_decl(self, data):
+        self.output.append(f"<![{data}]>")
+
+    def handle_pi(self, data):
+        self.output.append(f"<?{data}>")
+
+    def minify(self, html):
+        self.feed(html)
+        self.close()
+        return "".join(self.output)
+
+
+def minify_html(html):
+    return HTMLMinifier().minify(html)
+
+
+CSS_TOKEN_RE = re.compile(
+    r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(/\*!.*?\*/)|/\*.*?\*/', re.S
+)
+CSS_SPACE_RE = re.compile(r"\s*([{};,>])\s*")
+
+
+def minify_css_fallback(css):
+    # Strings and /*! comments are kept, spaces around ( + - are significant
+    minified = []
+    unquoted = []
+    position = 0
+    for match in CSS_TOKEN_RE.finditer(css):
+        unquoted.append(css[position : match.start()])
+        position = match.end()
+        if match.group(1) or match.group(2):
+            minified.append(compact_css("".join(unquoted)))
+            minified.append(match.group(1) or match.group(2))
+            unquoted = []
+        else:
+            unquoted.append(" ")  # A comment separates tokens like a space
+    unquoted.append(css[position:])
+    minified.append(compact_css("".join(unquoted)))
+    return "".join(minified).strip()
+
+
+def compact_css(css):
+    css = CSS_SPACE_RE.sub(r"\1", WHITESPACE_RE.sub(" ", css))
+    return css.replace(";}", "}").replace(": ", ":")
+
+
+def minify_css(css):
+    if rcssmin is not None:
+        return rcssmin.cssmin(css, keep_bang_comments=True)
+    return minify_css_fallback(css)
+
+
+def minify_js(script):
+    # Scripts can't be minified safely without a tokenizer, so rjsmin is required
+    if rjsmin is not None:
+        return rjsmin.jsmin(script, keep_bang_comments=True)
+    return script
+
+
+@lru_cache(maxsize=None)
+def get_minifier(path):
+    return import_string(path)
+
+
+def minify(content, content_type, cached=False):
+    """
+    Minifies content with the minifier configured for the content type in
+    DEPLOY_MINIFIERS. Cached results are keyed by the hash of the content and
+    the minifier, so the template files are minified once.
+    """
+    path = settings.DEPLOY_MINIFIERS.get(content_type)
+    if not path or not content:
+        return content
+
+    cache_key = None
+    if cached:
+        digest = hashlib.sha256(f"{path}\n{content}".encode("utf-8")).hexdigest()
+        cache_key = f"minified-asset-{digest}"
+        minified = cache.get(cache_key)
+        if minified is not None:
+            return minified
+
+    try:
+        minified = get_minifier(path)(content)
+    except Exception as error:
+        # The file is deployed as it is rather than failing the deployment
+        print("Error occurred while minifying the deployment file -> ", error)
+        return content
+
+    if cache_key:
+        cache.set(cache_key, minified, MINIFIED_ASSET_CACHE_TIMEOUT)
+    return minified
+
+
+def minification_report(sizes):
+    # sizes: {file: (before, after)} -> per file and total sizes
+    report = {
+        name: {"before": before, "after": after}
+        for name, (before, after) in sizes.items()
+    }
+    return {
+        "files": report,
+        "total": {
+            "before": sum(size["before"] for size in report.values()),
+            "after": sum(size["after"] for size in report.values()),
+        },
+    }
@@ -0,0 +1,127 @@
+from portfolio.constants import (
+    ELEMENT_IDENTIFIER_PREFIX,
+    BODY_OVERRIDE_KEY,
+    ADDED_ELEMENTS_KEY,
+)
+from portfolio.dom_manipulation.tree_walker import (
+    walk_dom_tree,
+    copy_dom_tree,
+    copy_attributes,
+)
+
+# Element keys which are overridden as a whole
+OVERRIDABLE_KEYS = ["tag", "text", "attributes"]
+
+
+def element_id(element):
+    return (element.get("attributes") or {}).get(ELEMENT_IDENTIFIER_PREFIX)
+
+
+def elements_by_id(element, elements=None):
+    elements = {} if elements is None else elements
+
+    def add_element(elem):
+        identifier = element_id(elem)
+        if identifier:
+            elements[identifier] = elem
+
+    walk_dom_tree([element], enter=add_element)
+    return elements
+
+
+def diff_dom_tree(base, edited):
+    """
+    Returns the overrides which turn the base DOM tree into the edited one, keyed
+    by data-element-id. When children are added, removed or reordered the parent
+    stores the ids of its new children, and the elements which are not part of
+    the base tree are stored as a whole under ADDED_ELEMENTS_KEY.
+    """
+    if not base or element_id(base) is None or element_id(base) != element_id(edited):
+        return {BODY_OVERRIDE_KEY: edited}
+
+    base_elements = elements_by_id(base)
+    overrides = {}
+    added_elements = {}
+    stack = [(base, edited)]
+
+    while stack:
+        base_element, edited_element = stack.pop()
+        override = {
+            key: edited_element.get(key)
+            for key in OVERRIDABLE_KEYS
+            if base_element.get(key) != edited_element.get(key)
+        }
+
+        base_children = base_element.get("children") or []
+        edited_children = edited_element.get("children") or []
+        base_ids = [element_id(child) for child in base_children]
+
+        if None not in base_ids and base_ids == [
+            element_id(child) for child in edited_children
+        ]:
+            stack.extend(zip(base_children, edited_children))
+        else:
+            children = []
+            for child in edited_children:
+                identifier = element_id(child)
+
+                # Elements without any id can only be stored in place
+                if not identifier:
+                    children.append(child)
+                    continue
+
+                if identifier in base_elements:
+                    stack.append((base_elements[identifier], child))
+                else:
+                    added_elements[identifier] = child
+                children.append(identifier)
+            override["children"] = children
+
+        if override:
+            overrides[element_id(base_element)] = override
+
+    if added_elements:
+        overrides[ADDED_ELEMENTS_KEY] = added_elements
+
+    return overrides
+
+
+def apply_overrides(body, overrides):
+    if not overrides:
+        return body
+
+    if BODY_OVERRIDE_KEY in overrides:
+        body = copy_dom_tree(overrides[BODY_OVERRIDE_KEY])
+
+    # Elements which children ids refer to, built on the first use
+    elements = {}
+
+    def resolve_children(children):
+        if not elements:
+            elements_by_id(body, elements)
+            for added_element in (overrides.get(ADDED_ELEMENTS_KEY) or {}).values():
+                elements_by_id(copy_dom_tree(added_element), elements)
+
+        resolved = []
+        for child in children:
+            if isinstance(child, dict):
+                resolved.append(copy_dom_tree(child))
+            elif child in elements:
+                resolved.append(elements[child])
+        return resolved
+
+    def apply_override(element):
+        override = overrides.get(element_id(element))
+        if not override:
+            return
+
+        for key, value in override.items():
+            if key == "children":
+                element["children"] = resolve_children(value)
+            elif key == "attributes":
+                element["attributes"] = copy_attributes(value)
+            else:
+                element[key] = value
+
+    walk_dom_tree([body], enter=apply_override)
+    return body
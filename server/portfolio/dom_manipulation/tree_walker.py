@@ -0,0 +1,51 @@
+def walk_dom_tree(elements, enter=None, leave=None):
+    """
+    Depth first walk over a list of DOM JSON elements using an explicit stack,
+    so the depth of the tree is not limited by the interpreter's recursion limit.
+    `enter` is called before the children of an element and `leave` after them.
+    """
+    stack = [(None, iter(elements))]
+
+    while stack:
+        parent, children = stack[-1]
+
+        for element in children:
+            if enter:
+                enter(element)
+
+            if element.get("children"):
+                stack.append((element, iter(element["children"])))
+                break
+
+            if leave:
+                leave(element)
+        else:
+            stack.pop()
+            if leave and parent is not None:
+                leave(parent)
+
+
+def copy_attributes(attributes):
+    return {
+        name: list(value) if isinstance(value, list) else value
+        for name, value in (attributes or {}).items()
+    }
+
+
+def copy_dom_tree(element, enter=None):
+    # `enter` is called with every copied element once its attributes are copied
+    copied_root = {**element, "attributes": {}, "children": []}
+    stack = [(element, copied_root)]
+
+    while stack:
+        source, copied = stack.pop()
+        copied["attributes"] = copy_attributes(source.get("attributes"))
+        if enter:
+            enter(copied)
+
+        for child in source.get("children") or []:
+            copied_child = {**child, "attributes": {}, "children": []}
+            copied["children"].append(copied_child)
+            stack.append((child, copied_child))
+
+    return copied_root
@@ -8,4 +8,19 @@ class DataNotPresent(Exception):
 
 class GeneralError(Exception):
     """Custom exception for any errors."""
-    pass
\ No newline at end of file
+    pass
+
+class PatchError(Exception):
+    """Custom exception for invalid dom patch operations."""
+    pass
+
+class DeploymentError(Exception):
+    """Custom exception for deployments which could not publish every file."""
+
+    def __init__(self, message, failures=None):
+        super().__init__(message)
+        self.failures = failures or {}
+
+class DeploymentJobLost(Exception):
+    """Custom exception for deployment jobs requeued or claimed by another worker."""
+    pass
@@ -0,0 +1,68 @@
+import time
+import boto3
+from django.core.management.base import BaseCommand
+from server.utils.aws import AWSClientRegistry
+
+SERVICES = ["s3", "cloudfront", "route53domains"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks creating an AWS client per request against the shared client "
+        "registry, optionally with a request to a local S3 stand-in (e.g. moto_server)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=50)
+        parser.add_argument(
+            "--endpoint-url",
+            default=None,
+            help="Also times a list_buckets call per client on this endpoint",
+        )
+
+    def services(self, endpoint_url=None):
+        credentials = {
+            "aws_access_key_id": "benchmark",
+            "aws_secret_access_key": "benchmark",
+            "region_name": "us-east-1",
+        }
+        services = {service: dict(credentials) for service in SERVICES}
+        if endpoint_url:
+            services["s3"]["endpoint_url"] = endpoint_url
+        return services
+
+    def time_per_call(self, function, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        return (time.perf_counter() - start) / repeat
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        services = self.services(options["endpoint_url"])
+        registry = AWSClientRegistry(services, max_pool_connections=16, max_attempts=5)
+
+        self.stdout.write(f"{repeat} calls per service, ms per call")
+        for service in SERVICES:
+            # What s3_config, cloudfront_config and the views did per request
+            per_request = self.time_per_call(
+                lambda: boto3.client(service, **services[service]), repeat
+            )
+            registry.get_client(service)
+            shared = self.time_per_call(lambda: registry.get_client(service), repeat)
+            self.stdout.write(
+                f"{service:<15} new client {per_request * 1000:8.2f}   "
+                f"registry {shared * 1000:8.4f}"
+            )
+
+        if options["endpoint_url"]:
+            per_request = self.time_per_call(
+                lambda: boto3.client("s3", **services["s3"]).list_buckets(), repeat
+            )
+            shared = self.time_per_call(
+                lambda: registry.get_client("s3").list_buckets(), repeat
+            )
+            self.stdout.write(
+                f"{'s3 request':<15} new client {per_request * 1000:8.2f}   "
+                f"registry {shared * 1000:8.4f}"
+            )
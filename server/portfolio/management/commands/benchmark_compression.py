@@ -0,0 +1,43 @@
+import time
+from server.compression import CODECS, compress, decompress
+from server.renderers import CustomJSONRenderer
+from portfolio.management.commands import benchmark_renderer
+
+BENCHMARK_LEVELS = {
+    "gzip": [1, 4, 6, 9],
+    "br": [1, 4, 5, 7, 11],
+    "zstd": [1, 3, 6, 12, 19],
+}
+
+
+class Command(benchmark_renderer.Command):
+    help = "Benchmarks wire size and CPU cost of compressing template responses"
+
+    def time_call(self, function, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
+
+    def handle(self, *args, **options):
+        data = self.get_response_data(options["template_id"], options["scale"])
+        content = CustomJSONRenderer().render(data)
+        repeat = options["repeat"]
+        self.stdout.write(f"{'uncompressed':<12} {len(content):>10} bytes")
+
+        for coding in CODECS:
+            for level in BENCHMARK_LEVELS[coding]:
+                compress_time, compressed = self.time_call(
+                    lambda: compress(content, coding, level), repeat
+                )
+                decompress_time, _ = self.time_call(
+                    lambda: decompress(compressed, coding, len(content)), repeat
+                )
+                self.stdout.write(
+                    f"{coding + ' ' + str(level):<12} {len(compressed):>10} bytes"
+                    f" {len(content) / len(compressed):6.1f}x"
+                    f" {compress_time * 1000:8.2f} ms compress"
+                    f" {decompress_time * 1000:7.2f} ms decompress"
+                )
@@ -0,0 +1,104 @@
+import time
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from django.core.management.base import BaseCommand
+from portfolio.cloud_functions.deployment import DeploymentUploader
+from portfolio.constants import (
+    INDEX_FILE,
+    S3_CSS_FOLDER_NAME,
+    S3_JS_FOLDER_NAME,
+    ROOT_STYLE_FILE,
+    RESPONSIVE_STYLE_FILE,
+    UNIVERSAL_STYLE_FILE,
+    ROOT_JS_FILE,
+    EMAIL_JS_FILE,
+    DEPLOY_UPLOAD_WORKERS,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks deployment uploads against a local S3 stand-in "
+        "(e.g. minio or moto_server), with an optional added latency per request"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoint-url", default="http://127.0.0.1:5000")
+        parser.add_argument("--bucket", default="deploy-benchmark")
+        parser.add_argument(
+            "--latency", type=float, default=0.03, help="Seconds added per request"
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def get_client(self, endpoint_url, latency):
+        client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id="benchmark",
+            aws_secret_access_key="benchmark",
+            region_name="us-east-1",
+            config=Config(max_pool_connections=DEPLOY_UPLOAD_WORKERS),
+        )
+        if latency:
+            client.meta.events.register(
+                "before-send.s3.*", lambda **kwargs: time.sleep(latency)
+            )
+        return client
+
+    def get_contents(self):
+        files = [
+            (INDEX_FILE, "text/html", 60 * 1024),
+            (f"{S3_CSS_FOLDER_NAME}/{ROOT_STYLE_FILE}", "text/css", 40 * 1024),
+            (f"{S3_CSS_FOLDER_NAME}/{RESPONSIVE_STYLE_FILE}", "text/css", 8 * 1024),
+            (f"{S3_CSS_FOLDER_NAME}/{UNIVERSAL_STYLE_FILE}", "text/css", 4 * 1024),
+            (f"{S3_JS_FOLDER_NAME}/{ROOT_JS_FILE}", "application/javascript", 12 * 1024),
+            (f"{S3_JS_FOLDER_NAME}/{EMAIL_JS_FILE}", "application/javascript", 2 * 1024),
+        ]
+        return [
+            {"file_name": name, "content_type": content_type, "file_content": "x" * size}
+            for name, content_type, size in files
+        ]
+
+    def upload_serially(self, client, bucket, contents):
+        # Upload loop Deployment.post used before the deployment uploader
+        for content in contents:
+            client.put_object(
+                Body=str(content["file_content"]),
+                Bucket=bucket,
+                Key=f'serial/{content["file_name"]}',
+                ContentType=content["content_type"],
+            )
+
+    def time_best(self, function, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def handle(self, *args, **options):
+        client = self.get_client(options["endpoint_url"], options["latency"])
+        bucket = options["bucket"]
+        try:
+            client.create_bucket(Bucket=bucket)
+        except client.exceptions.BucketAlreadyOwnedByYou:
+            pass
+
+        contents = self.get_contents()
+        executor = ThreadPoolExecutor(max_workers=DEPLOY_UPLOAD_WORKERS)
+        serial = self.time_best(
+            lambda: self.upload_serially(client, bucket, contents), options["repeat"]
+        )
+        parallel = self.time_best(
+            lambda: DeploymentUploader(
+                bucket, "parallel", s3_client=client, executor=executor
+            ).upload(contents),
+            options["repeat"],
+        )
+        executor.shutdown(wait=True)
+
+        self.stdout.write(f"{len(contents)} files, {options['latency'] * 1000:.0f} ms per request")
+        self.stdout.write(f"serial put_object      {serial * 1000:8.1f} ms")
+        self.stdout.write(f"DeploymentUploader     {parallel * 1000:8.1f} ms")
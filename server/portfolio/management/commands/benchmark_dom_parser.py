@@ -0,0 +1,166 @@
+import os
+import io
+import copy
+import time
+from bs4 import BeautifulSoup
+from django.core.management.base import BaseCommand, CommandError
+from portfolio.constants import DOCUMENT_TREE_ELEMENTS
+from portfolio.dom_manipulation.dom_parser import DOMTreeParser
+from portfolio.dom_manipulation.handle_dom import HTML_Document
+
+FIXTURE_INDEX_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "..", "fixtures", "template", "index.html"
+)
+
+# Empty document HTML_Document started from before the html emitter
+BS4_EMPTY_DOCUMENT = """
+                        <!DOCTYPE html>
+                        <html lang="en">
+                        <head>
+                            <meta charset="UTF-8">
+                            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                            <title></title>
+                        </head>
+                        <body>
+                        </body>
+                        </html>
+                    """
+
+
+def build_dom_tree_with_bs4(elem):
+    # DOM JSON built by parse_html_content before the streaming parser
+    dom_tree = {
+        "tag": elem.name,
+        "attributes": elem.attrs if elem.attrs else {},
+        "text": elem.string.strip() if elem.string else "",
+        "children": [],
+    }
+
+    for child in elem.contents:
+        if isinstance(child, str):
+            if dom_tree["text"] == "":
+                dom_tree["text"] += child.strip()
+        elif child.name is not None:
+            dom_tree["children"].append(build_dom_tree_with_bs4(child))
+    return dom_tree
+
+
+def parse_with_bs4(html_content):
+    soup = BeautifulSoup(html_content, "html.parser")
+    dom_tree_json = {}
+    for tag in DOCUMENT_TREE_ELEMENTS:
+        elements = soup.find_all(tag)
+        if elements:
+            dom_tree_json[tag] = [build_dom_tree_with_bs4(element) for element in elements]
+    return dom_tree_json
+
+
+def parse_with_dom_parser(html_content):
+    return DOMTreeParser(collect=DOCUMENT_TREE_ELEMENTS).feed_source(
+        io.StringIO(html_content)
+    )
+
+
+def build_bs4_tag(soup, element):
+    tag = soup.new_tag(element.get("tag").lower())
+    for attr, value in (element.get("attributes") or {}).items():
+        tag[attr] = " ".join(value) if isinstance(value, list) else value
+    if element.get("text"):
+        tag.string = element.get("text")
+    for child in element.get("children") or []:
+        tag.append(build_bs4_tag(soup, child))
+    return tag
+
+
+def render_with_bs4(dom_tree):
+    # Document built by HTML_Document before the html emitter
+    soup = BeautifulSoup(BS4_EMPTY_DOCUMENT, "html.parser")
+    for element in dom_tree.get("meta", []) + dom_tree.get("title", [])[:1] + dom_tree.get(
+        "link", []
+    ):
+        if element["tag"] == "title" and not soup.title.get_text():
+            title = soup.new_tag("title")
+            title.string = element["text"]
+            soup.title.replace_with(title)
+            continue
+
+        tag = soup.new_tag(element["tag"])
+        for attr, value in element["attributes"].items():
+            tag[attr] = " ".join(value) if isinstance(value, list) else value
+        soup.head.append(tag)
+
+    soup.body.replace_with(build_bs4_tag(soup, dom_tree["body"][0]))
+    for script in dom_tree.get("script", []):
+        tag = soup.new_tag("script")
+        for attr, value in script["attributes"].items():
+            tag[attr] = value
+        soup.body.append(tag)
+    return str(soup)
+
+
+def render_with_emitter(dom_tree):
+    document = HTML_Document()
+    document.update_head_content(dom_tree.get("meta", []))
+    document.update_head_content(dom_tree.get("title", []))
+    document.update_head_content(dom_tree.get("link", []))
+    document.update_body_content(dom_tree.get("body", []))
+    document.add_script_to_body(dom_tree.get("script", []))
+    return document.render()
+
+
+def scale_html(html_content, scale):
+    # Repeats the body content to benchmark larger index files
+    start = html_content.index(">", html_content.index("<body")) + 1
+    end = html_content.rindex("</body>")
+    return html_content[:start] + html_content[start:end] * scale + html_content[end:]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks parsing a template index file into DOM JSON and rendering it "
+        "back to html, BeautifulSoup against the streaming parser and html emitter"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", default=FIXTURE_INDEX_FILE, help="index.html to parse")
+        parser.add_argument(
+            "--scale",
+            type=int,
+            default=20,
+            help="Repeats the body content to benchmark larger files",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def time_best(self, function, argument, repeat):
+        timings = []
+        for _ in range(repeat):
+            argument_copy = copy.deepcopy(argument)
+            start = time.perf_counter()
+            result = function(argument_copy)
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["file"], "r") as index_file:
+                html_content = scale_html(index_file.read(), options["scale"])
+        except OSError as error:
+            raise CommandError(f"Can't read {options['file']}: {error}")
+
+        repeat = options["repeat"]
+        bs4_parse, bs4_tree = self.time_best(parse_with_bs4, html_content, repeat)
+        parse, tree = self.time_best(parse_with_dom_parser, html_content, repeat)
+        bs4_render, bs4_html = self.time_best(render_with_bs4, tree, repeat)
+        render, html = self.time_best(render_with_emitter, tree, repeat)
+
+        self.stdout.write(f"{len(html_content) / 1024:.0f} KB index file")
+        self.stdout.write(
+            f"parse   BeautifulSoup {bs4_parse * 1000:8.1f} ms   "
+            f"DOMTreeParser {parse * 1000:8.1f} ms   "
+            f"{'same json' if bs4_tree == tree else 'DIFFERENT JSON'}"
+        )
+        self.stdout.write(
+            f"render  BeautifulSoup {bs4_render * 1000:8.1f} ms   "
+            f"HTMLEmitter   {render * 1000:8.1f} ms   "
+            f"{'same html' if bs4_html == html else 'DIFFERENT HTML'}"
+        )
@@ -0,0 +1,68 @@
+import time
+from django.core.management.base import BaseCommand
+from portfolio.constants import ELEMENT_CATEGORY, ELEMENT_TYPE, ELEMENT_SUB_TYPE
+from portfolio.dom_manipulation.element_classifier import ELEMENT_LABELS
+
+# Tags of a typical template which are in no category, some look like category tags
+UNLABELLED_TAGS = ["b", "em", "strong", "u", "small", "header", "footer", "main", "br"]
+
+
+def labels_with_substring_match(tag):
+    # Lookup done by label_html_elements before ELEMENT_LABELS, `in` on a
+    # string category tag is a substring match ("b" in "button")
+    for category_value in ELEMENT_CATEGORY.values():
+        if tag in category_value["tag"]:
+            labels = {ELEMENT_TYPE: category_value["type"]}
+            if category_value["sub_type"]:
+                labels[ELEMENT_SUB_TYPE] = category_value["sub_type"]
+            return labels
+    return {}
+
+
+def labels_with_lookup(tag):
+    return ELEMENT_LABELS.get(tag) or {}
+
+
+def category_tags():
+    tags = []
+    for category_value in ELEMENT_CATEGORY.values():
+        category_tags = category_value["tag"]
+        tags.extend([category_tags] if isinstance(category_tags, str) else category_tags)
+    return tags
+
+
+class Command(BaseCommand):
+    help = "Benchmarks labelling elements by tag, category scan against ELEMENT_LABELS"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--elements", type=int, default=200000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def time_per_element(self, function, tags, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for tag in tags:
+                function(tag)
+            timings.append(time.perf_counter() - start)
+        return min(timings) / len(tags) * 1e9
+
+    def handle(self, *args, **options):
+        known_tags = category_tags() + UNLABELLED_TAGS
+        tags = (known_tags * (options["elements"] // len(known_tags) + 1))[
+            : options["elements"]
+        ]
+
+        self.stdout.write(f"{len(tags)} elements over {len(known_tags)} tags, ns per element")
+        for name, function in [
+            ("category scan", labels_with_substring_match),
+            ("ELEMENT_LABELS", labels_with_lookup),
+        ]:
+            self.stdout.write(
+                f"{name:<16} {self.time_per_element(function, tags, options['repeat']):8.1f}"
+            )
+
+        for tag in known_tags:
+            before, after = labels_with_substring_match(tag), labels_with_lookup(tag)
+            if before != after:
+                self.stdout.write(f"<{tag}> was labelled {before}, now {after}")
@@ -0,0 +1,81 @@
+import io
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from portfolio.models import CustomizedTemplate
+from portfolio.serializers import TemplateDataSerializer
+from server.renderers import CustomJSONRenderer, MessagePackRenderer, orjson, msgpack
+from server.parsers import MessagePackParser
+
+
+def render_with_string_scan(data):
+    # Rendering done by CustomJSONRenderer before errors were detected by type
+    if "ErrorDetail" in str(data):
+        data["message"] = str(data.get("message").get("detail"))
+    return json.dumps(data)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks rendering of get-custom-template-data responses"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--template-id", type=int, help="Customized template id")
+        parser.add_argument(
+            "--scale",
+            type=int,
+            default=1,
+            help="Repeats the body sections to benchmark larger payloads",
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def get_response_data(self, template_id, scale):
+        queryset = CustomizedTemplate.objects.order_by("-id")
+        if template_id:
+            queryset = queryset.filter(id=template_id)
+
+        customized_template = queryset.first()
+        if not customized_template:
+            raise CommandError("No customized template found to benchmark")
+
+        data = TemplateDataSerializer(customized_template).data
+        body = data.get("body") or {}
+        if scale > 1 and body.get("children"):
+            data["body"] = {**body, "children": body["children"] * scale}
+
+        return {"success": True, "data": data, "message": "Template found"}
+
+    def time_call(self, function, argument, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function(argument)
+            timings.append(time.perf_counter() - start)
+        return min(timings), result
+
+    def handle(self, *args, **options):
+        data = self.get_response_data(options["template_id"], options["scale"])
+        repeat = options["repeat"]
+
+        # Name -> (encode, decode) of every response format
+        formats = {
+            "str() scan + json.dumps": (render_with_string_scan, json.loads),
+            f"CustomJSONRenderer ({'orjson' if orjson else 'json'})": (
+                CustomJSONRenderer().render,
+                orjson.loads if orjson else json.loads,
+            ),
+        }
+        if msgpack is not None:
+            formats["MessagePackRenderer"] = (
+                MessagePackRenderer().render,
+                lambda content: MessagePackParser().parse(io.BytesIO(content)),
+            )
+
+        expected = json.loads(json.dumps(data))
+        for name, (encode, decode) in formats.items():
+            encode_time, content = self.time_call(encode, data, repeat)
+            decode_time, decoded = self.time_call(decode, content, repeat)
+            self.stdout.write(
+                f"{name:<32} {encode_time * 1000:8.2f} ms encode"
+                f" {decode_time * 1000:8.2f} ms decode {len(content):>10} bytes"
+                f" {'same data' if decoded == expected else 'DIFFERENT DATA'}"
+            )
@@ -0,0 +1,101 @@
+import sys
+import copy
+import time
+from django.core.management.base import BaseCommand
+from portfolio.dom_manipulation.tree_walker import walk_dom_tree, copy_dom_tree
+
+
+def make_element(tag="div"):
+    return {"tag": tag, "attributes": {"class": ["box"]}, "text": "", "children": []}
+
+
+def make_wide_tree(depth, fanout):
+    root = make_element("body")
+    level = [root]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            parent["children"] = [make_element() for _ in range(fanout)]
+            next_level.extend(parent["children"])
+        level = next_level
+    return root
+
+
+def make_deep_tree(depth):
+    root = element = make_element("body")
+    for _ in range(depth):
+        child = make_element()
+        element["children"].append(child)
+        element = child
+    return root
+
+
+def count_nodes(root):
+    counter = [0]
+
+    def count(element):
+        counter[0] += 1
+
+    walk_dom_tree([root], enter=count)
+    return counter[0]
+
+
+def walk_recursively(elements, enter=None, leave=None):
+    # Walk done by the recursive helpers before walk_dom_tree
+    for element in elements:
+        if enter:
+            enter(element)
+        walk_recursively(element.get("children") or [], enter, leave)
+        if leave:
+            leave(element)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the cost per node of walking and copying DOM JSON trees"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--depth", type=int, default=6, help="Depth of the wide tree")
+        parser.add_argument("--fanout", type=int, default=6)
+        parser.add_argument(
+            "--deep",
+            type=int,
+            default=sys.getrecursionlimit() * 50,
+            help="Depth of the single chain tree",
+        )
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def time_per_node(self, function, nodes, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return min(timings) / nodes * 1e9
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        noop = lambda element: None
+
+        wide = make_wide_tree(options["depth"], options["fanout"])
+        nodes = count_nodes(wide)
+        rows = [
+            ("recursive walk", lambda: walk_recursively([wide], noop, noop)),
+            ("walk_dom_tree", lambda: walk_dom_tree([wide], noop, noop)),
+            ("copy.deepcopy", lambda: copy.deepcopy(wide)),
+            ("copy_dom_tree", lambda: copy_dom_tree(wide)),
+        ]
+        self.stdout.write(f"wide tree, {nodes} nodes, ns per node")
+        for name, function in rows:
+            self.stdout.write(f"{name:<16} {self.time_per_node(function, nodes, repeat):8.1f}")
+
+        deep = make_deep_tree(options["deep"])
+        nodes = options["deep"] + 1
+        self.stdout.write(
+            f"deep tree, {nodes} nodes ({nodes // sys.getrecursionlimit()}x the "
+            "recursion limit), ns per node"
+        )
+        for name, function in [
+            ("walk_dom_tree", lambda: walk_dom_tree([deep], noop, noop)),
+            ("copy_dom_tree", lambda: copy_dom_tree(deep)),
+        ]:
+            self.stdout.write(f"{name:<16} {self.time_per_node(function, nodes, repeat):8.1f}")
@@ -0,0 +1,102 @@
+import os
+import time
+import signal
+import socket
+import threading
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from server.utils.cloudfront import get_invalidation_batcher
+from portfolio.deployment_jobs import (
+    claim_deployment_job,
+    run_deployment_job,
+    requeue_stale_deployment_jobs,
+)
+from portfolio.constants import (
+    DEPLOY_WORKER_THREADS,
+    DEPLOY_WORKER_POLL_INTERVAL,
+    DEPLOY_JOB_STALE_AFTER,
+)
+
+
+class Command(BaseCommand):
+    help = "Runs the queued portfolio deployments with a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=DEPLOY_WORKER_THREADS)
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=DEPLOY_WORKER_POLL_INTERVAL,
+            help="Seconds to wait when the queue is empty",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once there is no runnable job left",
+        )
+
+    def work(self, name, stop, poll_interval, once):
+        while not stop.is_set():
+            close_old_connections()
+            try:
+                job = claim_deployment_job(name)
+            except Exception as error:
+                print("Error occurred while claiming a deployment job -> ", error)
+                stop.wait(poll_interval)
+                continue
+
+            if job is None:
+                if once:
+                    break
+                stop.wait(poll_interval)
+                continue
+
+            job = run_deployment_job(job)
+            self.stdout.write(
+                f"{name}: job {job.id} {job.status} "
+                f"(attempt {job.attempts}) {job.stage_timings}"
+            )
+        close_old_connections()
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            # Running jobs are finished, no new job is claimed
+            self.stdout.write("Stopping the deployment workers")
+            stop.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+
+        requeued = requeue_stale_deployment_jobs()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale deployment jobs")
+
+        prefix = f"{socket.gethostname()}:{os.getpid()}"
+        workers = [
+            threading.Thread(
+                target=self.work,
+                args=(f"{prefix}:{number}", stop, options["poll_interval"], options["once"]),
+                name=f"deployment-worker-{number}",
+            )
+            for number in range(options["workers"])
+        ]
+        for worker in workers:
+            worker.start()
+
+        # The main thread keeps handling signals and requeues jobs of dead workers
+        requeued_at = time.monotonic()
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=options["poll_interval"])
+
+            if time.monotonic() - requeued_at >= DEPLOY_JOB_STALE_AFTER / 2:
+                requeued_at = time.monotonic()
+                close_old_connections()
+                requeue_stale_deployment_jobs()
+
+        close_old_connections()
+        invalidation_batcher = get_invalidation_batcher()
+        invalidation_batcher.flush_all()
+        self.stdout.write(f"CloudFront invalidations: {invalidation_batcher.stats()}")
@@ -1,7 +1,23 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils.text import slugify
+from django.utils import timezone
 from django.core.validators import EmailValidator
+from django.core.cache import caches
+from django.db.models import F
+from portfolio.constants import (
+    MATERIALIZED_TEMPLATE_CACHE,
+    MATERIALIZED_TEMPLATE_CACHE_TIMEOUT,
+)
+from portfolio.utils import IdentifierAllocator
+from portfolio.dom_manipulation.handle_dom import dom_tree_identifiers, stamp_dom_tree
+from portfolio.dom_manipulation.tree_walker import copy_dom_tree, walk_dom_tree
+from portfolio.dom_manipulation.template_overrides import (
+    apply_overrides,
+    diff_dom_tree,
+    element_id,
+)
+from portfolio.dom_manipulation.dom_patch import DOMPatcher, index_dom_tree
 
 
 User = settings.AUTH_USER_MODEL
@@ -17,6 +33,7 @@ class Template(models.Model):
     template_preview = models.URLField(blank=True, null=True)
     template_url = models.URLField(blank=True, null=True)
     template_dom_tree = models.JSONField(null=True)
+    template_skeleton = models.JSONField(null=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     liked = models.IntegerField(default=0, null=True)
@@ -24,9 +41,30 @@ class Template(models.Model):
     bucket_name = models.CharField(max_length=100, null=True)
     cloudfront_domain = models.CharField(max_length=50, null=True)
 
+    # Fields the customized templates of this template are materialized from
+    MATERIALIZED_FIELDS = {"template_dom_tree", "template_skeleton"}
+
     def __str__(self):
         return f"Template: { self.id}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        update_fields = kwargs.get("update_fields")
+        if self.template_skeleton and (
+            update_fields is None or "template_skeleton" in update_fields
+        ):
+            # Overrides of the customized templates are keyed by these identifiers
+            stamp_dom_tree(self.template_skeleton.get("body"))
+        super(Template, self).save(*args, **kwargs)
+
+        # Their version (ETag and materialized cache key) changes with the template
+        if not adding and (
+            update_fields is None or self.MATERIALIZED_FIELDS & set(update_fields)
+        ):
+            CustomizedTemplate.objects.filter(template=self).update(
+                content_version=F("content_version") + 1
+            )
+
 
 class PortfolioProject(models.Model):
     project_name = models.CharField(max_length=50, unique=True)
@@ -66,6 +104,11 @@ class PortfolioProject(models.Model):
                 customized_template.save()
         super(PortfolioProject, self).save(*args, **kwargs)
 
+        # Project is part of the customized template data returned to the editor
+        CustomizedTemplate.objects.filter(portfolio_project=self).update(
+            content_version=F("content_version") + 1
+        )
+
     def __str__(self):
         return f"Project id: {self.id} | Created by: {self.created_by.username} | Project Name: {self.project_name}"
 
@@ -86,10 +129,206 @@ class CustomizedTemplate(models.Model):
     assests = models.JSONField(default=dict, null=True)
     sections = models.JSONField(default=dict, null=True)
     is_deleted = models.BooleanField(default=False, null=True)
+    # Copy on write templates (the ones with a seed) keep only the overrides of
+    # the body, keyed by the identifiers stored in the template skeleton, and
+    # read everything else from the template
+    id_seed = models.BigIntegerField(null=True)
+    overrides = models.JSONField(default=dict, null=True)
+    # data-element-id -> path of child positions of the element in the body
+    element_index = models.JSONField(default=dict, null=True)
+    # Incremented on every write, used as the ETag of the template data
+    content_version = models.PositiveIntegerField(default=0)
+
+    TEMPLATE_FIELDS = {
+        "meta": "meta",
+        "links": "link",
+        "scripts": "script",
+        "style": "style",
+        "css": "css",
+        "js": "js",
+    }
 
     def __str__(self):
         return f"Custom Template Id: {self.id}"
 
+    @property
+    def is_copy_on_write(self):
+        return self.id_seed is not None
+
+    @staticmethod
+    def content_etag(pk, content_version, representation="json"):
+        # Every response format of the same version has its own ETag
+        return f'"{pk}-{content_version}-{representation}"'
+
+    @property
+    def cache_key(self):
+        # The version changes with every write of the row and of its template
+        return f"customized-template-{self.id}-{self.content_version}"
+
+    def base_body(self):
+        template_skeleton = self.template.template_skeleton or {}
+        body = template_skeleton.get("body")
+        return copy_dom_tree(body) if body else None
+
+    def materialize(self):
+        if not self.is_copy_on_write:
+            return {
+                field: getattr(self, field)
+                for field in [*self.TEMPLATE_FIELDS, "body", "sections"]
+            }
+
+        cache = caches[MATERIALIZED_TEMPLATE_CACHE]
+        materialized = cache.get(self.cache_key)
+        if materialized is None:
+            template_data = self.template.template_dom_tree or {}
+            template_skeleton = self.template.template_skeleton or {}
+
+            materialized = {
+                field: getattr(self, field) or template_data.get(key)
+                for field, key in self.TEMPLATE_FIELDS.items()
+            }
+            materialized["body"] = apply_overrides(self.base_body(), self.overrides)
+            materialized["sections"] = self.sections or template_skeleton.get(
+                "sections"
+            )
+            cache.set(
+                self.cache_key, materialized, MATERIALIZED_TEMPLATE_CACHE_TIMEOUT
+            )
+
+        return materialized
+
+    def set_body(self, body):
+        if self.is_copy_on_write:
+            self.overrides = diff_dom_tree(self.base_body(), body)
+        else:
+            self.body = body
+        self.element_index = {}
+
+    def apply_patch(self, operations):
+        # Returns the fields changed by the patch operations
+        materialized = self.materialize()
+        body = materialized["body"]
+        index = self.element_index or index_dom_tree(body)
+
+        # New elements must not reuse an identifier or class name of the body
+        allocator = IdentifierAllocator()
+        allocator.reserve(dom_tree_identifiers(body))
+        patcher = DOMPatcher(body, index, allocator=allocator)
+        for operation in operations:
+            patcher.apply(operation)
+
+        if self.is_copy_on_write:
+            self.overrides = patcher.update_overrides(self.overrides or {})
+            self.pending_materialized = materialized
+            update_fields = ["overrides"]
+        else:
+            self.body = body
+            update_fields = ["body"]
+
+        if patcher.index_changed or not self.element_index:
+            self.element_index = patcher.index
+            update_fields.append("element_index")
+
+        return update_fields
+
+    def replace_asset_url(self, pattern, url):
+        # Returns the fields changed by pointing the src and href matching pattern to url
+        operations = []
+
+        def collect(element):
+            identifier = element_id(element)
+            for name in ("src", "href"):
+                value = (element.get("attributes") or {}).get(name)
+                if identifier and isinstance(value, str) and value != url:
+                    if pattern.search(value):
+                        operations.append(
+                            {
+                                "op": "set_attribute",
+                                "id": identifier,
+                                "name": name,
+                                "value": url,
+                            }
+                        )
+
+        walk_dom_tree([self.materialize()["body"]], enter=collect)
+        return self.apply_patch(operations) if operations else []
+
+    def save(self, *args, **kwargs):
+        # Incremented in the database, so concurrent writes never share a version
+        adding = self._state.adding
+        if not adding:
+            self.content_version = F("content_version") + 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "content_version" not in update_fields:
+            kwargs["update_fields"] = [*update_fields, "content_version"]
+
+        super(CustomizedTemplate, self).save(*args, **kwargs)
+        if not adding:
+            self.refresh_from_db(fields=["content_version"])
+
+        # Patched templates already know their materialized data, cached once the
+        # version is committed (a rolled back version number is given out again)
+        pending_materialized = self.__dict__.pop("pending_materialized", None)
+        if pending_materialized is not None:
+            cache_key = self.cache_key
+            transaction.on_commit(
+                lambda: caches[MATERIALIZED_TEMPLATE_CACHE].set(
+                    cache_key,
+                    pending_materialized,
+                    MATERIALIZED_TEMPLATE_CACHE_TIMEOUT,
+                )
+            )
+
+
+class DeploymentJob(models.Model):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    customized_template = models.ForeignKey(
+        CustomizedTemplate, on_delete=models.CASCADE
+    )
+    portfolio_project = models.ForeignKey(PortfolioProject, on_delete=models.CASCADE)
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Deploy request data: project_name, title and description
+    payload = models.JSONField(default=dict)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=QUEUED, db_index=True
+    )
+    current_stage = models.CharField(max_length=30, blank=True, default="")
+    # Stage -> seconds taken by the stage in the last attempt
+    stage_timings = models.JSONField(default=dict)
+    attempts = models.PositiveIntegerField(default=0)
+    result = models.JSONField(default=dict)
+    error = models.TextField(blank=True, default="")
+    worker = models.CharField(max_length=100, blank=True, default="")
+    available_at = models.DateTimeField(default=timezone.now)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "available_at"])]
+        constraints = [
+            # At most one deployment of a project runs at a time
+            models.UniqueConstraint(
+                fields=["portfolio_project"],
+                condition=models.Q(status="running"),
+                name="unique_running_deployment_per_project",
+            )
+        ]
+
+    def __str__(self):
+        return f"Deployment job: {self.id} | Project id: {self.portfolio_project_id} | {self.status}"
+
 
 # Proxy model for deleted projects
 class DeletedPortfolioProject(PortfolioProject):
@@ -1,8 +1,8 @@
 from rest_framework import serializers
-from .models import PortfolioProject, Template, CustomizedTemplate
+from .models import PortfolioProject, Template, CustomizedTemplate, DeploymentJob
 from authentication.serializers import UserSerializer
 from server.utils.response import BaseResponse
-from server.utils.s3 import get_cloudfront_domain
+from server.utils.cloudfront import get_cloudfront_domain
 import os
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
@@ -33,7 +33,7 @@ class ListTemplatesSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Template
-        fields = "__all__"
+        exclude = ["template_skeleton"]
 
 
 class ListPortfolioProjectSerializer(serializers.ModelSerializer):
@@ -61,21 +61,33 @@ class ListPortfolioProjectSerializer(serializers.ModelSerializer):
             return None
 
 
-class CustomizedTemplateSerializer(serializers.ModelSerializer):
+class MaterializedTemplateSerializerMixin:
+    # Copy on write templates are returned with the template data filled in
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data.update(instance.materialize())
+        return data
+
+
+class CustomizedTemplateSerializer(
+    MaterializedTemplateSerializerMixin, serializers.ModelSerializer
+):
 
     class Meta:
         model = CustomizedTemplate
-        fields = "__all__"
+        exclude = ["id_seed", "overrides", "element_index", "content_version"]
 
 
-class TemplateDataSerializer(serializers.ModelSerializer):
+class TemplateDataSerializer(
+    MaterializedTemplateSerializerMixin, serializers.ModelSerializer
+):
     cloudfront_domain = serializers.SerializerMethodField()
     portfolio_project = ListPortfolioProjectSerializer()
     is_deployed = serializers.SerializerMethodField()
 
     class Meta:
         model = CustomizedTemplate
-        fields = "__all__"
+        exclude = ["id_seed", "overrides", "element_index", "content_version"]
 
     def get_cloudfront_domain(self, obj):
         return get_cloudfront_domain(
@@ -86,6 +98,12 @@ class TemplateDataSerializer(serializers.ModelSerializer):
         return obj.portfolio_project.is_deployed
 
 
+class DeploymentJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DeploymentJob
+        exclude = ["payload", "worker", "heartbeat_at", "created_by"]
+
+
 class PortfolioContactEmailSerializer(serializers.Serializer):
     portfolio_contact_configured_email = serializers.EmailField(required=True)
     is_verified_portfolio_contact_email = serializers.BooleanField(default=False)
@@ -1,3 +1,1947 @@
-from django.test import TestCase
+import gc
+import hashlib
+import io
+import os
+import json
+import sys
+import threading
+import time
+import tempfile
+import tracemalloc
+import weakref
+from datetime import timedelta
+from unittest import mock, skipUnless
+from bs4 import BeautifulSoup
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.test import APIClient
+from authentication.models import User
+from server.utils.aws import AWSClientRegistry
+from server.parsers import MessagePackParser
+from server.renderers import MessagePackRenderer, msgpack
+from server.utils.cloudfront import (
+    CloudFrontDomainResolver,
+    InvalidationBatcher,
+    collapse_paths,
+)
+from server.compression import (
+    CODECS,
+    DecompressionError,
+    brotli,
+    compress,
+    decompress,
+    zstandard,
+)
+from portfolio.models import (
+    Template,
+    PortfolioProject,
+    CustomizedTemplate,
+    DeploymentJob,
+)
+from portfolio.deployment_jobs import (
+    DeploymentHeartbeat,
+    DeploymentPipeline,
+    claim_deployment_job,
+    finish_deployment_job,
+    requeue_stale_deployment_jobs,
+    rewrite_asset_references,
+)
+from portfolio.exceptions.exceptions import DeploymentError, DeploymentJobLost
+from portfolio.cloud_functions.asset_cache import TemplateAssetCache
+from portfolio.cloud_functions.bulk_delete import PrefixDeletion
+from portfolio.cloud_functions.deployment import DeploymentUploader
+from portfolio.cloud_functions.template_upload import TemplateUploader
+from portfolio.constants import (
+    DOCUMENT_TREE_ELEMENTS,
+    ASSET_ID_PREFIX,
+    ELEMENT_IDENTIFIER_PREFIX,
+    ELEMENT_DEFAULT_CLASS_NAME,
+    ELEMENT_IDENTIFIER_VALUE,
+    ELEMENT_CATEGORY,
+    ELEMENT_TYPE,
+    ELEMENT_SUB_TYPE,
+    MATERIALIZED_TEMPLATE_CACHE,
+    EMAIL_JS_FILE,
+    EMAIL_JS_PLACEHOLDER,
+    S3_JS_FOLDER_NAME,
+    DEPLOY_MANIFEST_FILE,
+    BULK_DELETE_BATCH_SIZE,
+    BULK_DELETE_MAX_ATTEMPTS,
+    FINGERPRINT_LENGTH,
+    IMMUTABLE_CACHE_CONTROL,
+    INDEX_FILE,
+    S3_ASSETS_FOLDER_NAME,
+    DEPLOY_JOB_MAX_ATTEMPTS,
+    DEPLOY_JOB_RETRY_DELAY,
+    DEPLOY_JOB_STALE_AFTER,
+    DEPLOY_JOB_USER_CONCURRENCY,
+    TEMPLATE_UPLOAD_WORKERS,
+    TEMPLATE_UPLOAD_FILE_CONCURRENCY,
+)
+from portfolio.dom_manipulation import dom_parser
+from portfolio.dom_manipulation.css_compiler import compile_css, compile_css_cached
+from portfolio.dom_manipulation.element_classifier import (
+    ELEMENT_LABELS,
+    compile_element_labels,
+)
+from portfolio.dom_manipulation.handle_dom import (
+    HTML_Document,
+    compile_template_skeleton,
+    label_html_elements,
+    parse_html_content,
+)
+from portfolio.dom_manipulation.html_emitter import render_elements
+from portfolio.dom_manipulation.minify import (
+    get_minifier,
+    minification_report,
+    minify,
+    minify_css_fallback,
+    minify_html,
+)
+from portfolio.dom_manipulation.tree_walker import walk_dom_tree, copy_dom_tree
+from portfolio.dom_manipulation.template_overrides import element_id
+from portfolio.utils import (
+    fingerprint_file_name,
+    upload_project_file_on_s3_project,
+    IDENTIFIER_CHARACTERS,
+    IdentifierAllocator,
+    allocate_identifier,
+)
 
-# Create your tests here.
+FIXTURE_INDEX_FILE = os.path.join(
+    os.path.dirname(__file__), "fixtures", "template", "index.html"
+)
+
+# Empty document HTML_Document started from before the html emitter
+BS4_EMPTY_DOCUMENT = """
+                        <!DOCTYPE html>
+                        <html lang="en">
+                        <head>
+                            <meta charset="UTF-8">
+                            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+                            <title></title>
+                        </head>
+                        <body>
+                        </body>
+                        </html>
+                    """
+
+
+def build_dom_tree_with_bs4(elem):
+    # DOM JSON built by parse_html_content before the streaming parser
+    dom_tree = {
+        "tag": elem.name,
+        "attributes": elem.attrs if elem.attrs else {},
+        "text": elem.string.strip() if elem.string else "",
+        "children": [],
+    }
+
+    for child in elem.contents:
+        if isinstance(child, str):
+            if dom_tree["text"] == "":
+                dom_tree["text"] += child.strip()
+        elif child.name is not None:
+            dom_tree["children"].append(build_dom_tree_with_bs4(child))
+    return dom_tree
+
+
+def parse_with_bs4(html_content):
+    soup = BeautifulSoup(html_content, "html.parser")
+    dom_tree_json = {}
+    for tag in DOCUMENT_TREE_ELEMENTS:
+        elements = soup.find_all(tag)
+        if elements:
+            dom_tree_json[tag] = [build_dom_tree_with_bs4(element) for element in elements]
+    return dom_tree_json
+
+
+def parse_with_dom_parser(html_content):
+    return dom_parser.DOMTreeParser(collect=DOCUMENT_TREE_ELEMENTS).feed_source(
+        io.StringIO(html_content)
+    )
+
+
+def build_bs4_tag(soup, element):
+    tag = soup.new_tag(element.get("tag").lower())
+    for attr, value in (element.get("attributes") or {}).items():
+        tag[attr] = " ".join(value) if isinstance(value, list) else value
+    if element.get("text"):
+        tag.string = element.get("text")
+    for child in element.get("children") or []:
+        tag.append(build_bs4_tag(soup, child))
+    return tag
+
+
+def render_with_bs4(dom_tree):
+    # Document built by HTML_Document before the html emitter
+    soup = BeautifulSoup(BS4_EMPTY_DOCUMENT, "html.parser")
+    for element in dom_tree.get("meta", []) + dom_tree.get("title", [])[:1] + dom_tree.get(
+        "link", []
+    ):
+        if element["tag"] == "title" and not soup.title.get_text():
+            title = soup.new_tag("title")
+            title.string = element["text"]
+            soup.title.replace_with(title)
+            continue
+
+        tag = soup.new_tag(element["tag"])
+        for attr, value in element["attributes"].items():
+            tag[attr] = " ".join(value) if isinstance(value, list) else value
+        soup.head.append(tag)
+
+    soup.body.replace_with(build_bs4_tag(soup, dom_tree["body"][0]))
+    for script in dom_tree.get("script", []):
+        tag = soup.new_tag("script")
+        for attr, value in script["attributes"].items():
+            tag[attr] = value
+        soup.body.append(tag)
+    return str(soup)
+
+
+def render_with_emitter(dom_tree):
+    document = HTML_Document()
+    document.update_head_content(dom_tree.get("meta", []))
+    document.update_head_content(dom_tree.get("title", []))
+    document.update_head_content(dom_tree.get("link", []))
+    document.update_body_content(dom_tree.get("body", []))
+    document.add_script_to_body(dom_tree.get("script", []))
+    return document.render()
+
+
+def scale_html(html_content, scale):
+    # Repeats the body content to parse larger index files
+    start = html_content.index(">", html_content.index("<body")) + 1
+    end = html_content.rindex("</body>")
+    return html_content[:start] + html_content[start:end] * scale + html_content[end:]
+
+
+def make_element(tag="div"):
+    return {"tag": tag, "attributes": {"class": ["box"]}, "text": "", "children": []}
+
+
+def make_wide_tree(depth, fanout):
+    root = make_element("body")
+    level = [root]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            parent["children"] = [make_element() for _ in range(fanout)]
+            next_level.extend(parent["children"])
+        level = next_level
+    return root
+
+
+def make_deep_tree(depth):
+    root = element = make_element("body")
+    for _ in range(depth):
+        child = make_element()
+        element["children"].append(child)
+        element = child
+    return root
+
+
+def walk_recursively(elements, enter=None, leave=None):
+    # Walk done by the recursive helpers before walk_dom_tree
+    for element in elements:
+        if enter:
+            enter(element)
+        walk_recursively(element.get("children") or [], enter, leave)
+        if leave:
+            leave(element)
+
+
+def read_fixture_index_file():
+    with open(FIXTURE_INDEX_FILE, "r") as index_file:
+        return index_file.read()
+
+
+def create_customized_template(user, project_name="portfolio"):
+    # Copy on write customized template of a template built from the fixture
+    template_dom_tree = parse_with_dom_parser(read_fixture_index_file())
+    template, _ = Template.objects.get_or_create(
+        template_name="fixture",
+        defaults={
+            "template_dom_tree": template_dom_tree,
+            "template_skeleton": compile_template_skeleton(template_dom_tree),
+            "created_by": user,
+        },
+    )
+    project = PortfolioProject.objects.create(
+        project_name=project_name, created_by=user, pre_built_template=template
+    )
+    return CustomizedTemplate.objects.create(
+        template=template, portfolio_project=project, id_seed=1
+    )
+
+
+class DecompressionTests(SimpleTestCase):
+    max_size = 1024 * 1024
+    # Brotli and zstandard are optional, their cases are skipped when not installed
+    codings = ("zstd", "br", "gzip")
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Compression bombs of 64 MB of zeros, a few KB once compressed
+        bomb = bytes(64 * 1024 * 1024)
+        cls.bombs = {coding: compress(bomb, coding, 5) for coding in CODECS}
+
+    def skip_unless_installed(self, coding):
+        if coding not in CODECS:
+            self.skipTest(f"{coding} codec is not installed")
+
+    @skipUnless(zstandard, "zstandard is not installed")
+    def test_zstd_codec_is_registered(self):
+        self.assertIn("zstd", CODECS)
+
+    @skipUnless(brotli, "brotli is not installed")
+    def test_brotli_codec_is_registered(self):
+        self.assertIn("br", CODECS)
+
+    def test_bomb_is_rejected_without_decompressing_it(self):
+        for coding in self.codings:
+            with self.subTest(coding=coding):
+                self.skip_unless_installed(coding)
+                payload = self.bombs[coding]
+                tracemalloc.start()
+                try:
+                    with self.assertRaisesMessage(DecompressionError, "too large"):
+                        decompress(payload, coding, self.max_size)
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+                self.assertLess(peak, self.max_size * 4)
+
+    def test_data_up_to_max_size_is_decompressed(self):
+        data = b"<p>portfolio</p>" * 1024
+        for coding in self.codings:
+            with self.subTest(coding=coding):
+                self.skip_unless_installed(coding)
+                payload = compress(data, coding, 5)
+                self.assertEqual(decompress(payload, coding, len(data)), data)
+                with self.assertRaises(DecompressionError):
+                    decompress(payload, coding, len(data) - 1)
+
+    def test_truncated_data_is_rejected(self):
+        data = b"<p>portfolio</p>" * 1024
+        for coding in self.codings:
+            with self.subTest(coding=coding):
+                self.skip_unless_installed(coding)
+                payload = compress(data, coding, 5)
+                for truncated in (payload[:-4], payload[:4], b""):
+                    with self.assertRaises(DecompressionError):
+                        decompress(truncated, coding, self.max_size)
+
+    @skipUnless(zstandard, "zstandard is not installed")
+    def test_zstd_frames_are_all_decompressed(self):
+        # Each frame is compressed on its own, like the chunks of a streamed body
+        frames = [b"<p>first</p>" * 512, b"<p>second</p>" * 512, b"<p>third</p>"]
+        payload = b"".join(compress(frame, "zstd", 5) for frame in frames)
+        data = b"".join(frames)
+        self.assertEqual(decompress(payload, "zstd", len(data)), data)
+        with self.assertRaisesMessage(DecompressionError, "too large"):
+            decompress(payload, "zstd", len(data) - 1)
+        with self.assertRaisesMessage(DecompressionError, "incomplete"):
+            decompress(payload[:-4], "zstd", self.max_size)
+
+
+@skipUnless(msgpack, "msgpack is not installed")
+class MessagePackTests(SimpleTestCase):
+    def render(self, data):
+        return MessagePackRenderer().render(data)
+
+    def parse(self, content):
+        return MessagePackParser().parse(io.BytesIO(content))
+
+    def test_data_is_parsed_back_as_rendered(self):
+        data = {
+            "body": {"tag": "p", "attributes": {"class": ["a"]}, "children": []},
+            "values": [1, 2.5, None, True, "é"],
+        }
+        self.assertEqual(self.parse(self.render(data)), data)
+
+    def test_values_are_encoded_like_json_responses(self):
+        created_at = timezone.now()
+        rendered = self.parse(self.render({"created_at": created_at}))
+        self.assertEqual(
+            rendered, {"created_at": created_at.isoformat().replace("+00:00", "Z")}
+        )
+
+    def test_error_details_are_rendered_as_messages(self):
+        data = {
+            "success": False,
+            "message": {"detail": ErrorDetail("Not found.", "not_found")},
+        }
+        self.assertEqual(
+            self.parse(self.render(data)), {"success": False, "message": "Not found."}
+        )
+
+    def test_invalid_content_is_a_parse_error(self):
+        for content in [b"\xc1", self.render({"a": 1})[:-1]]:
+            with self.subTest(content=content):
+                with self.assertRaises(ParseError):
+                    self.parse(content)
+
+    def test_requests_are_refused_without_msgpack(self):
+        with mock.patch("server.parsers.msgpack", None):
+            with self.assertRaisesMessage(ParseError, "not supported"):
+                self.parse(self.render({"a": 1}))
+
+
+class DOMTreeParserTests(SimpleTestCase):
+    def test_template_fixture_matches_beautifulsoup(self):
+        html_content = read_fixture_index_file()
+        self.assertEqual(parse_with_dom_parser(html_content), parse_with_bs4(html_content))
+
+    def test_scaled_template_matches_beautifulsoup(self):
+        html_content = scale_html(read_fixture_index_file(), 5)
+        self.assertEqual(parse_with_dom_parser(html_content), parse_with_bs4(html_content))
+
+    def test_chunked_file_source_matches_string_source(self):
+        html_content = read_fixture_index_file()
+        with mock.patch.object(dom_parser, "PARSER_CHUNK_SIZE", 7):
+            chunked = dom_parser.DOMTreeParser().feed_source(io.StringIO(html_content))
+        self.assertEqual(chunked, dom_parser.DOMTreeParser().feed_source(html_content))
+
+    def test_declarations_match_beautifulsoup(self):
+        for html_content in [
+            "<body><p><![CDATA[ x ]]></p></body>",
+            "<body><div><![cdata[x]]><span>s</span></div></body>",
+            "<body><p><![if !IE]></p></body>",
+            "<body><p><!DOCTYPE html></p></body>",
+            "<body><p><?php echo 1 ?></p></body>",
+            "<body><p>a<![CDATA[ x ]]>b</p></body>",
+            "<body><p><!-- comment --></p></body>",
+            "<!DOCTYPE html><body><p>text</p></body>",
+        ]:
+            with self.subTest(html_content=html_content):
+                self.assertEqual(
+                    parse_with_dom_parser(html_content), parse_with_bs4(html_content)
+                )
+
+    def test_cdata_text_has_no_prefix(self):
+        body = parse_with_dom_parser("<body><p><![CDATA[ x ]]></p></body>")["body"][0]
+        self.assertEqual(body["children"][0]["text"], "x")
+
+    def test_images_without_src_are_left_as_they_are(self):
+        # They used to fail the template upload, now they get no asset id
+        dom_tree = parse_html_content(
+            '<body><img><img alt="no source"></body>', "template"
+        )
+        images = dom_tree["body"][0]["children"]
+        self.assertEqual([image["attributes"] for image in images], [{}, {"alt": "no source"}])
+        self.assertNotIn(ASSET_ID_PREFIX, images[1]["attributes"])
+
+
+class HTMLEmitterTests(SimpleTestCase):
+    def test_template_fixture_document_matches_beautifulsoup(self):
+        dom_tree = parse_with_dom_parser(read_fixture_index_file())
+        self.assertEqual(render_with_emitter(dom_tree), render_with_bs4(dom_tree))
+
+    def test_document_is_byte_identical(self):
+        dom_tree = parse_with_dom_parser(scale_html(read_fixture_index_file(), 3))
+        self.assertEqual(
+            render_with_emitter(dom_tree).encode("utf-8"),
+            render_with_bs4(dom_tree).encode("utf-8"),
+        )
+
+
+class TreeWalkerTests(SimpleTestCase):
+    def setUp(self):
+        self.depth = sys.getrecursionlimit() * 3
+
+    def record_order(self, walk, elements):
+        events = []
+        walk(
+            elements,
+            enter=lambda element: events.append(("enter", id(element))),
+            leave=lambda element: events.append(("leave", id(element))),
+        )
+        return events
+
+    def test_enter_and_leave_order_matches_recursive_walk(self):
+        tree = make_wide_tree(3, 3)
+        tree["children"][1]["children"] = []  # A leaf among the inner elements
+        elements = [tree, make_wide_tree(1, 2)]
+        self.assertEqual(
+            self.record_order(walk_dom_tree, elements),
+            self.record_order(walk_recursively, elements),
+        )
+
+    def test_enter_and_leave_order_of_a_small_tree(self):
+        leaf = {"tag": "span", "children": []}
+        inner = {"tag": "p", "children": [leaf]}
+        root = {"tag": "div", "children": [inner, {"tag": "br"}]}
+        events = []
+        walk_dom_tree(
+            [root],
+            enter=lambda element: events.append(("enter", element["tag"])),
+            leave=lambda element: events.append(("leave", element["tag"])),
+        )
+        self.assertEqual(
+            events,
+            [
+                ("enter", "div"),
+                ("enter", "p"),
+                ("enter", "span"),
+                ("leave", "span"),
+                ("leave", "p"),
+                ("enter", "br"),
+                ("leave", "br"),
+                ("leave", "div"),
+            ],
+        )
+
+    def test_walk_beyond_recursion_limit(self):
+        events = []
+        walk_dom_tree(
+            [make_deep_tree(self.depth)],
+            enter=lambda element: events.append(1),
+            leave=lambda element: events.append(-1),
+        )
+        self.assertEqual(len(events), 2 * (self.depth + 1))
+        # Every element is entered before any element is left
+        self.assertEqual(events, [1] * (self.depth + 1) + [-1] * (self.depth + 1))
+
+    def test_copy_beyond_recursion_limit(self):
+        tree = make_deep_tree(self.depth)
+        copied = copy_dom_tree(tree)
+
+        depth, source, element = 0, tree, copied
+        while element["children"]:
+            self.assertIsNot(element, source)
+            self.assertEqual(element["attributes"], source["attributes"])
+            self.assertIsNot(element["attributes"]["class"], source["attributes"]["class"])
+            source, element = source["children"][0], element["children"][0]
+            depth += 1
+        self.assertEqual(depth, self.depth)
+
+    def test_copy_keeps_children_order(self):
+        tree = make_wide_tree(3, 4)
+        self.assertEqual(copy_dom_tree(tree), tree)
+
+    def test_render_beyond_recursion_limit(self):
+        html = render_elements([make_deep_tree(self.depth)])
+        self.assertTrue(html.startswith('<body class="box"><div class="box">'))
+        self.assertEqual(html.count("</div>"), self.depth)
+
+
+class ElementClassifierTests(SimpleTestCase):
+    # Tags of no category, "b" and "u" were labelled by substrings of "button"
+    unlabelled_tags = ["b", "em", "strong", "u", "small", "header", "footer", "main", "br"]
+
+    def make_element(self, tag, text=""):
+        return {"tag": tag, "attributes": {}, "text": text, "children": []}
+
+    def test_every_category_tag_is_labelled_with_its_category(self):
+        for category_name, category_value in ELEMENT_CATEGORY.items():
+            tags = category_value["tag"]
+            for tag in [tags] if isinstance(tags, str) else tags:
+                with self.subTest(category=category_name, tag=tag):
+                    attributes = label_html_elements(self.make_element(tag))["attributes"]
+                    self.assertEqual(attributes[ELEMENT_TYPE], category_value["type"])
+                    self.assertEqual(
+                        attributes.get(ELEMENT_SUB_TYPE, ""), category_value["sub_type"]
+                    )
+
+    def test_lookalike_tags_are_not_substring_matches(self):
+        # "b" and "u" are substrings of "button", "i" of "li" and "section"
+        self.assertNotIn("b", ELEMENT_LABELS)
+        self.assertNotIn("u", ELEMENT_LABELS)
+        self.assertEqual(ELEMENT_LABELS["i"], {ELEMENT_TYPE: "icon"})
+        self.assertEqual(ELEMENT_LABELS["li"], {ELEMENT_TYPE: "container"})
+        self.assertEqual(label_html_elements(self.make_element("b"))["attributes"], {})
+
+    def test_tags_outside_the_categories_are_not_labelled(self):
+        for tag in self.unlabelled_tags:
+            with self.subTest(tag=tag):
+                self.assertEqual(label_html_elements(self.make_element(tag))["attributes"], {})
+
+    def test_unlabelled_element_with_text_is_text(self):
+        attributes = label_html_elements(self.make_element("b", "bold"))["attributes"]
+        self.assertEqual(attributes, {ELEMENT_SUB_TYPE: "text"})
+
+    def test_first_category_of_a_tag_is_kept(self):
+        labels = compile_element_labels(
+            {
+                "FIRST": {"type": "first", "sub_type": "text", "tag": ["div", "p"]},
+                "SECOND": {"type": "second", "sub_type": "", "tag": "div"},
+            }
+        )
+        self.assertEqual(labels["div"], {ELEMENT_TYPE: "first", ELEMENT_SUB_TYPE: "text"})
+        self.assertEqual(labels["p"], labels["div"])
+
+
+class IdentifierAllocatorTests(SimpleTestCase):
+    def random_bytes(self, prefix):
+        # os.urandom whose blocks start with prefix
+        urandom = os.urandom
+        return mock.patch(
+            "portfolio.utils.os.urandom",
+            side_effect=lambda size: prefix + urandom(size - len(prefix)),
+        )
+
+    def test_identifiers_are_unique_lower_case_and_of_the_given_length(self):
+        allocator = IdentifierAllocator(length=8, block_size=64)
+        identifiers = [allocator.allocate("element") for _ in range(5000)]
+        self.assertEqual(len(set(identifiers)), len(identifiers))
+        for identifier in identifiers[:100]:
+            prefix, characters = identifier.split("-")
+            self.assertEqual(prefix, "element")
+            self.assertEqual(len(characters), 8)
+            self.assertTrue(set(characters) <= set(IDENTIFIER_CHARACTERS))
+
+    def test_reserved_identifiers_are_skipped(self):
+        allocator = IdentifierAllocator()
+        allocator.reserve(["element-abcdefgh"])
+        spelled = bytes(IDENTIFIER_CHARACTERS.index(character) for character in "abcdefgh")
+        with self.random_bytes(spelled * 2):
+            identifier = allocator.allocate("element")
+        self.assertNotEqual(identifier, "element-abcdefgh")
+        self.assertIn(identifier, allocator.allocated)
+
+    def test_bytes_which_would_bias_the_characters_are_dropped(self):
+        # 252 is the largest multiple of the 36 characters under 256
+        allocator = IdentifierAllocator(length=4)
+        with self.random_bytes(bytes([252, 253, 0, 254, 255, 1, 2, 35])):
+            self.assertEqual(allocator.allocate("element"), "element-abc9")
+
+    def test_same_seed_gives_the_same_identifiers(self):
+        first, second = IdentifierAllocator(seed=7), IdentifierAllocator(seed=7)
+        identifiers = [first.allocate("element") for _ in range(1000)]
+        self.assertEqual(identifiers, [second.allocate("element") for _ in range(1000)])
+        other = IdentifierAllocator(seed=8)
+        self.assertNotEqual(identifiers[:10], [other.allocate("element") for _ in range(10)])
+
+    def test_allocate_identifier_uses_the_allocator_when_given(self):
+        allocator = IdentifierAllocator()
+        identifier = allocate_identifier("asset", allocator)
+        self.assertIn(identifier, allocator.allocated)
+        self.assertTrue(allocate_identifier("asset").startswith("asset-"))
+
+
+class TemplateDataETagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="owner", email="owner@example.com")
+        self.customized_template = create_customized_template(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse(
+            "get_template_data",
+            args=[
+                self.customized_template.id,
+                self.customized_template.portfolio_project_id,
+            ],
+        )
+
+    def get(self, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(self.url, **headers)
+
+    def test_unchanged_template_is_not_modified(self):
+        etag = self.get()["ETag"]
+        self.assertEqual(self.get(etag).status_code, 304)
+
+    def test_template_change_changes_etag(self):
+        first = self.get()
+        template = self.customized_template.template
+        template.template_skeleton["body"]["children"] = []
+        template.save(update_fields=["template_skeleton"])
+
+        response = self.get(first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+
+    def test_unrelated_template_fields_keep_etag(self):
+        etag = self.get()["ETag"]
+        template = self.customized_template.template
+        template.liked = 1
+        template.save(update_fields=["liked"])
+        self.assertEqual(self.get(etag).status_code, 304)
+
+    def test_weak_and_listed_etags_are_not_modified(self):
+        etag = self.get()["ETag"]
+        for if_none_match in [
+            f"W/{etag}",
+            f'"other", {etag}',
+            f'W/"other", W/{etag}',
+            "*",
+        ]:
+            with self.subTest(if_none_match=if_none_match):
+                response = self.get(if_none_match)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], etag)
+
+    @skipUnless(msgpack, "msgpack is not installed")
+    def test_msgpack_response_has_the_json_data_and_an_etag_of_its_own(self):
+        json_response = self.get()
+        response = self.client.get(self.url, HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(response.content, raw=False), json_response.json())
+        self.assertNotEqual(response["ETag"], json_response["ETag"])
+        self.assertEqual(self.get(response["ETag"]).status_code, 200)
+
+    def test_weak_etag_of_a_compressed_response_is_not_modified(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertTrue(response["ETag"].startswith('W/"'))
+        self.assertEqual(self.get(response["ETag"]).status_code, 304)
+
+    def test_other_etags_are_modified(self):
+        etag = self.get()["ETag"]
+        for if_none_match in ['"other"', f"W/{etag[:-1]}x\"", etag.strip('"')]:
+            with self.subTest(if_none_match=if_none_match):
+                self.assertEqual(self.get(if_none_match).status_code, 200)
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        MATERIALIZED_TEMPLATE_CACHE: {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "materialized-templates",
+        },
+    }
+)
+class MaterializedTemplateCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="owner", email="owner@example.com")
+        self.customized_template = create_customized_template(self.user)
+        caches[MATERIALIZED_TEMPLATE_CACHE].clear()
+
+    def fresh(self):
+        # Another process reading the row
+        return CustomizedTemplate.objects.get(id=self.customized_template.id)
+
+    def test_materialized_template_is_cached_per_version(self):
+        materialized = self.fresh().materialize()
+        self.assertEqual(
+            caches[MATERIALIZED_TEMPLATE_CACHE].get(self.fresh().cache_key), materialized
+        )
+
+    def test_template_change_is_materialized(self):
+        self.fresh().materialize()
+        template = self.customized_template.template
+        template.template_skeleton["sections"] = []
+        template.save(update_fields=["template_skeleton"])
+
+        self.assertEqual(self.fresh().materialize()["sections"], [])
+
+    def test_write_from_another_process_is_materialized(self):
+        stale = self.fresh()
+        stale.materialize()
+        writer = self.fresh()
+        writer.sections = [{"name": "changed"}]
+        writer.save(update_fields=["sections"])
+
+        # The reader's cached entry is keyed on the old version
+        self.assertEqual(self.fresh().materialize()["sections"], [{"name": "changed"}])
+        self.assertNotEqual(stale.cache_key, self.fresh().cache_key)
+
+    def patch_title(self, customized_template):
+        body = customized_template.materialize()["body"]
+        update_fields = customized_template.apply_patch(
+            [
+                {
+                    "op": "set_attribute",
+                    "id": body["attributes"]["data-element-id"],
+                    "name": "title",
+                    "value": "patched",
+                }
+            ]
+        )
+        customized_template.save(update_fields=update_fields)
+
+    def test_patched_template_is_cached_on_commit(self):
+        customized_template = self.fresh()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                self.patch_title(customized_template)
+            self.assertIsNone(
+                caches[MATERIALIZED_TEMPLATE_CACHE].get(customized_template.cache_key)
+            )
+
+        self.assertEqual(len(callbacks), 1)
+        cached = caches[MATERIALIZED_TEMPLATE_CACHE].get(self.fresh().cache_key)
+        self.assertEqual(cached["body"]["attributes"]["title"], "patched")
+
+    def test_rolled_back_patch_is_not_cached(self):
+        customized_template = self.fresh()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    self.patch_title(customized_template)
+                    raise ValueError("Rolled back")
+
+        self.assertEqual(callbacks, [])
+        # The next write is given the version number of the rolled back patch
+        self.fresh().save(update_fields=["sections"])
+        self.assertNotIn("title", self.fresh().materialize()["body"]["attributes"])
+
+
+class DeploymentUploaderTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.s3_client = mock.MagicMock()
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def upload(self, html, previous_encoded_sizes):
+        manifest = {
+            "files": {
+                "index.html": {
+                    "sha256": "previous",
+                    "size": 4096,
+                    "content_type": "text/html",
+                    "codings": ["br", "gzip"],
+                    "cache_control": None,
+                    "encoded_sizes": previous_encoded_sizes,
+                }
+            },
+            "retired": [],
+        }
+        self.s3_client.get_object.return_value = {
+            "Body": io.BytesIO(json.dumps(manifest).encode("utf-8"))
+        }
+        report = DeploymentUploader(
+            "bucket", "project", s3_client=self.s3_client, executor=self.executor
+        ).upload(
+            [{"file_name": "index.html", "content_type": "text/html", "file_content": html}]
+        )
+        self.executor.shutdown()
+        return report
+
+    def deleted_keys(self):
+        return [
+            key["Key"]
+            for call in self.s3_client.delete_objects.call_args_list
+            for key in call.kwargs["Delete"]["Objects"]
+        ]
+
+    def test_variants_not_produced_anymore_are_deleted(self):
+        # Too small to be worth compressing
+        report = self.upload("<p></p>", {"br": 30, "gzip": 40})
+
+        self.assertEqual(report["deleted_variants"], ["index.html.br", "index.html.gz"])
+        self.assertIn("project/index.html.br", self.deleted_keys())
+        self.assertIn("project/index.html.gz", self.deleted_keys())
+        self.assertEqual(report["compressed_sizes"]["files"]["index.html"], {"identity": 7})
+
+    def test_variants_produced_again_are_kept(self):
+        report = self.upload("<p>portfolio</p>" * 256, {"gzip": 40})
+
+        self.assertEqual(report["deleted_variants"], [])
+        self.assertIn("index.html.gz", report["uploaded"])
+        self.assertNotIn("project/index.html.gz", self.deleted_keys())
+
+
+class FakeS3Bucket:
+    # The object calls of an s3 client on one bucket, failing the puts of `failing` keys
+    def __init__(self, objects=None, failing=()):
+        self.objects = dict(objects or {})  # Key -> body
+        self.failing = set(failing)
+        self.puts = []
+
+    def missing(self, operation):
+        return ClientError({"Error": {"Code": "NoSuchKey"}}, operation)
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.missing("GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        if Key in self.failing:
+            raise ClientError({"Error": {"Code": "InternalError"}}, "PutObject")
+        self.puts.append(Key)
+        self.objects[Key] = Body
+
+    def copy_object(self, Bucket, CopySource, Key):
+        if CopySource["Key"] not in self.objects:
+            raise self.missing("CopyObject")
+        self.objects[Key] = self.objects[CopySource["Key"]]
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def delete_objects(self, Bucket, Delete):
+        for key in Delete["Objects"]:
+            self.objects.pop(key["Key"], None)
+
+
+class DeploymentRollbackTests(SimpleTestCase):
+    files = [
+        {
+            "file_name": "index.html",
+            "content_type": "text/html",
+            "file_content": "<p>new</p>",
+        },
+        {"file_name": "css/style.css", "content_type": "text/css", "file_content": "p{}"},
+        {
+            "file_name": "js/new.js",
+            "content_type": "application/javascript",
+            "file_content": "1",
+        },
+    ]
+
+    def upload(self, s3_client):
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            return DeploymentUploader(
+                "bucket", "project", s3_client=s3_client, executor=executor
+            ).upload(self.files)
+        finally:
+            executor.shutdown()  # Waits for the backups to be deleted
+
+    def test_index_is_published_after_the_files_it_refers_to(self):
+        s3_client = FakeS3Bucket()
+        self.upload(s3_client)
+        self.assertEqual(
+            sorted(s3_client.puts[:2]), ["project/css/style.css", "project/js/new.js"]
+        )
+        self.assertEqual(
+            s3_client.puts[2:], ["project/index.html", f"project/{DEPLOY_MANIFEST_FILE}"]
+        )
+
+    def test_failed_upload_restores_the_published_site(self):
+        published = {
+            "project/index.html": b"<p>old</p>",
+            "project/css/style.css": b"p{color:red}",
+        }
+        s3_client = FakeS3Bucket(published, failing=["project/js/new.js"])
+
+        with self.assertRaises(DeploymentError) as context:
+            self.upload(s3_client)
+
+        self.assertEqual(list(context.exception.failures), ["js/new.js"])
+        # Old files are copied back, new ones deleted, and the backups removed
+        self.assertEqual(s3_client.objects, published)
+        self.assertNotIn("project/index.html", s3_client.puts)
+
+    def test_failed_backup_publishes_nothing(self):
+        s3_client = FakeS3Bucket({"project/index.html": b"<p>old</p>"})
+        copy_object = s3_client.copy_object
+
+        def fail_copy(Bucket, CopySource, Key):
+            if CopySource["Key"] == "project/index.html":
+                raise ClientError({"Error": {"Code": "SlowDown"}}, "CopyObject")
+            copy_object(Bucket, CopySource, Key)
+
+        s3_client.copy_object = fail_copy
+        with self.assertRaises(DeploymentError):
+            self.upload(s3_client)
+        self.assertEqual(s3_client.puts, [])
+        self.assertEqual(s3_client.objects, {"project/index.html": b"<p>old</p>"})
+
+
+class DeploymentManifestTests(SimpleTestCase):
+    def upload(self, s3_client, files):
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            return DeploymentUploader(
+                "bucket", "project", s3_client=s3_client, executor=executor
+            ).upload(
+                [
+                    {"file_name": name, "content_type": "text/css", "file_content": content}
+                    for name, content in files.items()
+                ]
+            )
+        finally:
+            executor.shutdown()
+
+    def test_unchanged_files_are_skipped(self):
+        s3_client = FakeS3Bucket()
+        self.upload(s3_client, {"a.css": "a{}", "b.css": "b{}"})
+        puts = len(s3_client.puts)
+
+        report = self.upload(s3_client, {"a.css": "a{}", "b.css": "b{color:red}"})
+        self.assertEqual((report["uploaded"], report["skipped"]), (["b.css"], ["a.css"]))
+        self.assertEqual(
+            s3_client.puts[puts:], ["project/b.css", f"project/{DEPLOY_MANIFEST_FILE}"]
+        )
+
+        # Nothing changed, not even the manifest is written
+        puts = len(s3_client.puts)
+        report = self.upload(s3_client, {"a.css": "a{}", "b.css": "b{color:red}"})
+        self.assertEqual(report["uploaded"], [])
+        self.assertEqual(len(s3_client.puts), puts)
+
+    def test_left_out_files_are_deleted_by_the_next_deploy(self):
+        s3_client = FakeS3Bucket()
+        self.upload(s3_client, {"a.css": "a{}", "old.css": "o{}"})
+        self.upload(s3_client, {"a.css": "a{}"})
+        # Still there for cached copies of the previous index.html
+        self.assertIn("project/old.css", s3_client.objects)
+
+        self.upload(s3_client, {"a.css": "a{color:red}"})
+        self.assertNotIn("project/old.css", s3_client.objects)
+
+    def test_manifest_which_could_not_be_written_is_dropped(self):
+        s3_client = FakeS3Bucket()
+        self.upload(s3_client, {"a.css": "a{}"})
+        s3_client.failing.add(f"project/{DEPLOY_MANIFEST_FILE}")
+        self.upload(s3_client, {"a.css": "a{color:red}"})
+        self.assertNotIn(f"project/{DEPLOY_MANIFEST_FILE}", s3_client.objects)
+
+        # Without a manifest every file is published again
+        s3_client.failing.clear()
+        report = self.upload(s3_client, {"a.css": "a{color:red}"})
+        self.assertEqual(report["uploaded"], ["a.css"])
+
+
+class DeploymentPipelineTests(TestCase):
+    email_js = f'emailjs.send({{to: "{EMAIL_JS_PLACEHOLDER}"}});'
+
+    def setUp(self):
+        self.user = User.objects.create(username="owner", email="owner@example.com")
+
+    def template_files(self, s3_client, template_name, folder_name, files):
+        return {file: self.email_js if file == EMAIL_JS_FILE else "" for file in files}
+
+    def fingerprinted_pipeline(self, project_name, contact_email):
+        customized_template = create_customized_template(self.user, project_name)
+        # Saving the email sends a verification email, so it is updated directly
+        PortfolioProject.objects.filter(
+            id=customized_template.portfolio_project_id
+        ).update(portfolio_contact_configured_email=contact_email)
+        job = DeploymentJob.objects.create(
+            customized_template=customized_template,
+            portfolio_project_id=customized_template.portfolio_project_id,
+            created_by=self.user,
+            payload={"project_name": project_name},
+        )
+
+        pipeline = DeploymentPipeline(job, s3_client=mock.MagicMock())
+        pipeline.template_data["style"] = {}  # Without custom css
+        with mock.patch(
+            "portfolio.deployment_jobs.extract_template_files", self.template_files
+        ):
+            pipeline.fetch_assets()
+        pipeline.minify()
+        pipeline.fingerprint()
+        return pipeline
+
+    def deployed_assets(self, project_name, contact_email):
+        pipeline = self.fingerprinted_pipeline(project_name, contact_email)
+        return pipeline.fingerprints, {
+            asset["file_name"]: asset["file_content"] for asset in pipeline.assets
+        }
+
+    def test_contact_email_is_in_the_fingerprinted_email_js(self):
+        fingerprints, assets = self.deployed_assets("first", "first@example.com")
+        email_js = assets[fingerprints[f"{S3_JS_FOLDER_NAME}/{EMAIL_JS_FILE}"]]
+        self.assertIn("first@example.com", email_js)
+        self.assertNotIn(EMAIL_JS_PLACEHOLDER, email_js)
+
+    def test_email_js_fingerprint_follows_the_contact_email(self):
+        name = f"{S3_JS_FOLDER_NAME}/{EMAIL_JS_FILE}"
+        first, _ = self.deployed_assets("first", "first@example.com")
+        second, _ = self.deployed_assets("second", "second@example.com")
+        self.assertNotEqual(first[name], second[name])
+
+    def test_fingerprinted_files_are_immutable_and_not_invalidated(self):
+        pipeline = self.fingerprinted_pipeline("first", "first@example.com")
+        for asset in pipeline.assets:
+            self.assertEqual(asset["cache_control"], IMMUTABLE_CACHE_CONTROL)
+            self.assertRegex(
+                asset["file_name"], r"\.[0-9a-f]{%d}\.(css|js)$" % FINGERPRINT_LENGTH
+            )
+
+        uploaded = [INDEX_FILE, *pipeline.fingerprints.values()]
+        pipeline.deployment = {
+            "uploaded": uploaded + [f"{name}.gz" for name in uploaded],
+            "deleted_variants": [],
+        }
+        with mock.patch("portfolio.deployment_jobs.get_invalidation_batcher") as batcher:
+            pipeline.invalidate()
+        batcher.return_value.submit.assert_called_once_with(
+            [f"/first/{INDEX_FILE}", f"/first/{INDEX_FILE}.gz"]
+        )
+
+
+class FingerprintedAssetTests(SimpleTestCase):
+    def test_content_hash_is_added_before_the_extension(self):
+        digest = hashlib.sha256(b"p{}").hexdigest()
+        self.assertEqual(
+            fingerprint_file_name("css/style.css", digest),
+            f"css/style.{digest[:FINGERPRINT_LENGTH]}.css",
+        )
+
+    def test_references_to_deployed_files_are_rewritten(self):
+        links = [
+            {"tag": "link", "attributes": {"href": href}, "text": "", "children": []}
+            for href in [
+                "css/style.css",
+                "./css/style.css",
+                "https://cdn.example.com/css/style.css",
+                "/js/script.js",
+            ]
+        ]
+        rewritten = rewrite_asset_references(
+            links,
+            {"css/style.css": "css/style.1.css", "js/script.js": "js/script.2.js"},
+        )
+        self.assertEqual(
+            [element["attributes"]["href"] for element in rewritten],
+            [
+                "css/style.1.css",
+                "./css/style.1.css",
+                "https://cdn.example.com/css/style.css",
+                "/js/script.2.js",
+            ],
+        )
+        # The elements of the template data are left as they were
+        self.assertEqual(links[0]["attributes"]["href"], "css/style.css")
+
+    def upload_image(self, s3_client, content):
+        image = SimpleUploadedFile("photo.png", content, content_type="image/png")
+        with mock.patch("portfolio.utils.s3_config", return_value=s3_client), mock.patch(
+            "portfolio.utils.get_cloudfront_domain", return_value="cdn.example.com"
+        ):
+            return upload_project_file_on_s3_project(image, "My Project", "asset-1")
+
+    def test_images_are_uploaded_once_under_their_content_hash(self):
+        s3_client = mock.MagicMock()
+        s3_client.head_object.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadObject"
+        )
+        digest = hashlib.sha256(b"image").hexdigest()[:FINGERPRINT_LENGTH]
+        key = f"my-project/{S3_ASSETS_FOLDER_NAME}/asset-1.{digest}.png"
+
+        self.assertEqual(
+            self.upload_image(s3_client, b"image"),
+            {"image_s3_url": f"https://cdn.example.com/{key}"},
+        )
+        (_, _, uploaded_key), kwargs = s3_client.upload_fileobj.call_args
+        self.assertEqual(uploaded_key, key)
+        self.assertEqual(kwargs["ExtraArgs"]["CacheControl"], IMMUTABLE_CACHE_CONTROL)
+
+        # Same content is already there under the same key
+        s3_client.reset_mock()
+        s3_client.head_object.side_effect = None
+        self.assertEqual(
+            self.upload_image(s3_client, b"image"),
+            {"image_s3_url": f"https://cdn.example.com/{key}"},
+        )
+        s3_client.upload_fileobj.assert_not_called()
+
+
+class DeploymentJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="owner", email="owner@example.com")
+
+    def queue_job(self, customized_template=None, user=None):
+        user = user or self.user
+        customized_template = customized_template or create_customized_template(
+            user, f"project-{DeploymentJob.objects.count()}"
+        )
+        return DeploymentJob.objects.create(
+            customized_template=customized_template,
+            portfolio_project_id=customized_template.portfolio_project_id,
+            created_by=user,
+        )
+
+    def make_stale(self, job):
+        DeploymentJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=timezone.now() - timedelta(seconds=DEPLOY_JOB_STALE_AFTER + 1)
+        )
+
+    def test_oldest_queued_job_is_claimed(self):
+        first, second = self.queue_job(), self.queue_job()
+        job = claim_deployment_job("worker")
+        self.assertEqual(job.pk, first.pk)
+        self.assertEqual((job.status, job.worker, job.attempts), (DeploymentJob.RUNNING, "worker", 1))
+        self.assertEqual(claim_deployment_job("worker").pk, second.pk)
+
+    def test_one_deployment_of_a_project_runs_at_a_time(self):
+        first = self.queue_job()
+        second = self.queue_job(first.customized_template)
+        running = claim_deployment_job("worker")
+        self.assertEqual(running.pk, first.pk)
+        self.assertIsNone(claim_deployment_job("worker"))
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DeploymentJob.objects.filter(pk=second.pk).update(status=DeploymentJob.RUNNING)
+
+        finish_deployment_job(running, result={})
+        self.assertEqual(claim_deployment_job("worker").pk, second.pk)
+
+    def test_running_deployments_of_a_user_are_limited(self):
+        for _ in range(DEPLOY_JOB_USER_CONCURRENCY + 1):
+            self.queue_job()
+        for _ in range(DEPLOY_JOB_USER_CONCURRENCY):
+            self.assertIsNotNone(claim_deployment_job("worker"))
+        self.assertIsNone(claim_deployment_job("worker"))
+
+        # Jobs of other users are not held back
+        other = User.objects.create(username="other", email="other@example.com")
+        job = self.queue_job(user=other)
+        self.assertEqual(claim_deployment_job("worker").pk, job.pk)
+
+    def test_failed_jobs_are_retried_until_the_max_attempts(self):
+        job = self.queue_job()
+        for attempt in range(1, DEPLOY_JOB_MAX_ATTEMPTS + 1):
+            DeploymentJob.objects.filter(pk=job.pk).update(available_at=timezone.now())
+            job = claim_deployment_job("worker")
+            self.assertEqual(job.attempts, attempt)
+            job = finish_deployment_job(job, error="upload failed", retry=True)
+
+            if attempt < DEPLOY_JOB_MAX_ATTEMPTS:
+                self.assertEqual(job.status, DeploymentJob.QUEUED)
+                # Waits for the backoff before it is claimed again
+                self.assertEqual(
+                    job.available_at - job.finished_at,
+                    timedelta(seconds=DEPLOY_JOB_RETRY_DELAY * 2 ** (attempt - 1)),
+                )
+                self.assertIsNone(claim_deployment_job("worker"))
+
+        self.assertEqual(job.status, DeploymentJob.FAILED)
+        self.assertEqual(job.error, "upload failed")
+
+    def test_stale_jobs_are_requeued_until_the_max_attempts(self):
+        other = User.objects.create(username="other", email="other@example.com")
+        stale, exhausted, alive = self.queue_job(), self.queue_job(), self.queue_job(user=other)
+        for _ in range(3):
+            claim_deployment_job("worker")
+        DeploymentJob.objects.filter(pk=exhausted.pk).update(attempts=DEPLOY_JOB_MAX_ATTEMPTS)
+        self.make_stale(stale)
+        self.make_stale(exhausted)
+
+        self.assertEqual(requeue_stale_deployment_jobs(), 1)
+        statuses = dict(DeploymentJob.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[stale.pk], DeploymentJob.QUEUED)
+        self.assertEqual(statuses[exhausted.pk], DeploymentJob.FAILED)
+        self.assertEqual(statuses[alive.pk], DeploymentJob.RUNNING)
+
+    def test_heartbeat_keeps_a_long_running_job_claimed(self):
+        self.queue_job()
+        job = claim_deployment_job("worker")
+        self.make_stale(job)
+
+        heartbeat = DeploymentHeartbeat(job)
+        self.assertTrue(heartbeat.beat())
+        self.assertEqual(requeue_stale_deployment_jobs(), 0)
+
+        self.make_stale(job)
+        requeue_stale_deployment_jobs()
+        self.assertFalse(heartbeat.beat())
+        self.assertTrue(heartbeat.lost)
+
+    def test_heartbeat_thread_beats_until_the_job_is_lost(self):
+        job = self.queue_job()
+        with mock.patch.object(
+            DeploymentHeartbeat, "beat", side_effect=[True, True, False]
+        ) as beat:
+            with DeploymentHeartbeat(job, interval=0.001) as heartbeat:
+                heartbeat.thread.join(timeout=5)
+        self.assertEqual(beat.call_count, 3)
+
+    def test_requeued_job_is_not_written_by_its_old_worker(self):
+        self.queue_job()
+        job = claim_deployment_job("first")
+        self.make_stale(job)
+        requeue_stale_deployment_jobs()
+
+        pipeline = DeploymentPipeline(job, s3_client=mock.MagicMock())
+        pipeline.job.stage_timings = {}
+        with self.assertRaises(DeploymentJobLost):
+            pipeline.save_stage("upload")
+
+        claimed = claim_deployment_job("second")
+        finish_deployment_job(job, error="upload failed")
+        claimed.refresh_from_db()
+        self.assertEqual((claimed.status, claimed.worker), (DeploymentJob.RUNNING, "second"))
+        self.assertEqual(claimed.error, "")
+
+
+class CollapsePathsTests(SimpleTestCase):
+    def test_paths_with_a_common_prefix_are_collapsed(self):
+        paths = ["/site/index.html", "/site/index.html.br", "/site/index.html.gz"]
+        self.assertEqual(collapse_paths(paths, 2, 5), ["/site/index.html*"])
+
+    def test_paths_without_a_common_prefix_are_kept(self):
+        paths = ["/site/a.css", "/site/b.js", "/site/c.html"]
+        self.assertEqual(collapse_paths(paths, 2, 5), paths)
+
+    def test_directories_under_min_paths_are_kept(self):
+        paths = ["/site/index.html", "/site/index.html.br"]
+        self.assertEqual(collapse_paths(paths, 3, 5), paths)
+
+    def test_directories_with_the_most_paths_are_collapsed_first(self):
+        paths = [
+            "/first/index.html",
+            "/first/index.html.br",
+            "/second/index.html",
+            "/second/index.html.br",
+            "/second/index.html.gz",
+        ]
+        self.assertEqual(
+            collapse_paths(paths, 2, 1),
+            ["/first/index.html", "/first/index.html.br", "/second/index.html*"],
+        )
+
+    def test_wildcards_count_against_max_wildcards_and_cover_paths(self):
+        paths = ["/site/*", "/site/index.html", "/other/index.html", "/other/index.html.br"]
+        self.assertEqual(
+            collapse_paths(paths, 2, 1),
+            ["/other/index.html", "/other/index.html.br", "/site/*"],
+        )
+
+
+@mock.patch("server.utils.cloudfront.invalidate_cloudfront_paths")
+class InvalidationBatcherTests(SimpleTestCase):
+    def setUp(self):
+        # The window never passes in a test, batches are sent by flush_all
+        self.batcher = InvalidationBatcher(
+            window=60, min_wildcard_paths=2, max_wildcards=5, max_attempts=2
+        )
+        self.batcher.client = mock.MagicMock()
+        self.addCleanup(self.batcher.flush_all)
+
+    def test_requests_of_a_window_are_sent_as_one_invalidation(self, invalidate):
+        self.batcher.submit(["/first/index.html", "/first/index.html.br"], "distribution")
+        self.batcher.submit(["/second/index.html"], "distribution")
+        self.batcher.submit(["/second/index.html"], "distribution")
+        self.batcher.flush_all()
+
+        invalidate.assert_called_once_with(
+            ["/first/index.html*", "/second/index.html"],
+            distribution_id="distribution",
+            client=self.batcher.client,
+        )
+        stats = self.batcher.stats()
+        self.assertEqual((stats["batches"], stats["invalidations_saved"]), (1, 2))
+        self.assertEqual(stats["paths_saved"], 2)
+
+    def test_distributions_are_invalidated_separately(self, invalidate):
+        self.batcher.submit(["/site/index.html"], "first")
+        self.batcher.submit(["/site/index.html"], "second")
+        self.batcher.flush_all()
+        self.assertEqual(
+            sorted(call.kwargs["distribution_id"] for call in invalidate.call_args_list),
+            ["first", "second"],
+        )
+
+    def test_failed_batches_are_retried_up_to_max_attempts(self, invalidate):
+        invalidate.side_effect = Exception("throttled")
+        self.batcher.submit(["/site/index.html"], "distribution")
+        self.batcher.flush_all()
+        self.assertEqual(self.batcher.pending, {"distribution": {"/site/index.html": 1}})
+
+        self.batcher.flush_all()
+        self.assertEqual(invalidate.call_count, 2)
+        self.assertEqual(self.batcher.pending, {})
+        stats = self.batcher.stats()
+        self.assertEqual((stats["failed_batches"], stats["dropped_paths"]), (2, 1))
+
+
+@mock.patch("server.utils.cloudfront.fetch_cloudfront_domain")
+class CloudFrontDomainResolverTests(TestCase):
+    def setUp(self):
+        self.resolver = CloudFrontDomainResolver(ttl=60, retry_after=5)
+        self.resolver.client = mock.MagicMock()
+        self.now = 1000.0
+        clock = mock.patch("server.utils.cloudfront.time")
+        clock.start().time.side_effect = lambda: self.now
+        self.addCleanup(clock.stop)
+
+    def test_domain_is_cached_for_the_ttl(self, fetch):
+        fetch.return_value = "d1.cloudfront.net"
+        self.assertEqual(self.resolver.resolve("site"), "d1.cloudfront.net")
+        self.now += 59
+        self.assertEqual(self.resolver.resolve("site"), "d1.cloudfront.net")
+        self.assertEqual(fetch.call_count, 1)
+
+        fetch.return_value = "d2.cloudfront.net"
+        self.now += 1
+        self.assertEqual(self.resolver.resolve("site"), "d2.cloudfront.net")
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_failed_lookup_keeps_the_last_domain_until_retry_after(self, fetch):
+        fetch.return_value = "d1.cloudfront.net"
+        self.resolver.resolve("site")
+        fetch.side_effect = Exception("throttled")
+        self.now += 60
+        self.assertEqual(self.resolver.resolve("site"), "d1.cloudfront.net")
+        self.now += 4
+        self.assertEqual(self.resolver.resolve("site"), "d1.cloudfront.net")
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(self.resolver.stats()["failures"], 1)
+
+    def test_cold_lookup_is_made_once_for_concurrent_callers(self, fetch):
+        looking_up, release = threading.Event(), threading.Event()
+
+        def slow_fetch(distribution_id, client):
+            looking_up.set()
+            release.wait(timeout=5)
+            return "d1.cloudfront.net"
+
+        fetch.side_effect = slow_fetch
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            first = executor.submit(self.resolver.resolve, "site")
+            looking_up.wait(timeout=5)
+            others = [executor.submit(self.resolver.resolve, "site") for _ in range(7)]
+            # Waiting callers are counted before the lookup is released
+            while self.resolver.stats()["waits"] < 7:
+                time.sleep(0.001)
+            release.set()
+            results = [first.result()] + [other.result() for other in others]
+
+        self.assertEqual(results, ["d1.cloudfront.net"] * 8)
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_expired_domain_is_returned_while_it_is_refreshed(self, fetch):
+        fetch.return_value = "d1.cloudfront.net"
+        self.resolver.resolve("site")
+        self.now += 60
+        # Another caller is refreshing it
+        self.resolver.inflight["site"] = threading.Event()
+        self.assertEqual(self.resolver.resolve("site"), "d1.cloudfront.net")
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(self.resolver.stats()["stale_hits"], 1)
+
+    @mock.patch.dict(
+        os.environ, {"PREBUILT_TEMPLATES_CLOUDFRONT_DISTRIBUION_ID": "templates"}
+    )
+    def test_templates_domain_is_persisted(self, fetch):
+        user = User.objects.create(username="owner", email="owner@example.com")
+        template = Template.objects.create(
+            template_name="fixture", created_by=user, cloudfront_domain="d1.cloudfront.net"
+        )
+        self.assertEqual(self.resolver.resolve("templates"), "d1.cloudfront.net")
+        fetch.assert_not_called()
+
+        fetch.return_value = "d2.cloudfront.net"
+        self.now += 60
+        self.assertEqual(self.resolver.resolve("templates"), "d2.cloudfront.net")
+        template.refresh_from_db()
+        self.assertEqual(template.cloudfront_domain, "d2.cloudfront.net")
+
+
+class FakeS3Listing:
+    # list_objects_v2 pages and delete_objects of an s3 client
+    def __init__(self, keys, failing=None):
+        self.keys = keys
+        self.failing = failing or {}  # Key -> attempts which fail before it is deleted
+        self.page_sizes = []
+        self.deleted = []
+        self.lock = threading.Lock()
+
+    def get_paginator(self, operation):
+        return self
+
+    def paginate(self, Bucket, Prefix, PaginationConfig):
+        page_size = PaginationConfig["PageSize"]
+        self.page_sizes.append(page_size)
+        keys = [key for key in self.keys if key.startswith(Prefix)]
+        yield {"KeyCount": 0}  # Pages without Contents are possible
+        for start in range(0, len(keys), page_size):
+            yield {"Contents": [{"Key": key} for key in keys[start : start + page_size]]}
+
+    def delete_objects(self, Bucket, Delete):
+        errors = []
+        with self.lock:
+            for obj in Delete["Objects"]:
+                if self.failing.get(obj["Key"]):
+                    self.failing[obj["Key"]] -= 1
+                    errors.append({"Key": obj["Key"], "Code": "SlowDown"})
+                else:
+                    self.deleted.append(obj["Key"])
+        return {"Errors": errors} if errors else {}
+
+
+@mock.patch("portfolio.cloud_functions.bulk_delete.BULK_DELETE_RETRY_DELAY", 0)
+class PrefixDeletionTests(SimpleTestCase):
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        self.addCleanup(self.executor.shutdown)
+
+    def delete(self, s3_client, prefix="project/", on_progress=None):
+        return PrefixDeletion(
+            "bucket",
+            prefix,
+            s3_client=s3_client,
+            executor=self.executor,
+            on_progress=on_progress,
+        )
+
+    def test_every_page_of_keys_is_deleted_in_batches(self):
+        keys = [
+            f"project/file-{number}" for number in range(2 * BULK_DELETE_BATCH_SIZE + 5)
+        ]
+        s3_client = FakeS3Listing(keys + ["other/file"])
+        progress = []
+
+        report = self.delete(s3_client, on_progress=progress.append).run()
+
+        self.assertEqual(s3_client.page_sizes, [BULK_DELETE_BATCH_SIZE])
+        self.assertEqual(sorted(s3_client.deleted), sorted(keys))
+        self.assertEqual(
+            {name: report[name] for name in ["listed", "deleted", "failed", "batches"]},
+            {"listed": len(keys), "deleted": len(keys), "failed": 0, "batches": 3},
+        )
+        self.assertEqual(len(progress), 3)
+
+    def test_keys_which_failed_are_retried(self):
+        s3_client = FakeS3Listing(["project/a", "project/b"], failing={"project/b": 1})
+        report = self.delete(s3_client).run()
+        self.assertEqual(sorted(s3_client.deleted), ["project/a", "project/b"])
+        self.assertEqual((report["retried"], report["failed"]), (1, 0))
+
+    def test_keys_failing_every_attempt_are_reported(self):
+        s3_client = FakeS3Listing(
+            ["project/a", "project/b"], failing={"project/b": BULK_DELETE_MAX_ATTEMPTS}
+        )
+        deletion = self.delete(s3_client)
+        report = deletion.run()
+        self.assertEqual(s3_client.deleted, ["project/a"])
+        self.assertEqual(report["failed"], 1)
+        self.assertEqual(deletion.failed_keys, ["project/b"])
+
+    def test_empty_prefix_is_refused(self):
+        s3_client = FakeS3Listing(["project/a"])
+        with self.assertRaises(ValueError):
+            self.delete(s3_client, prefix="").run()
+        self.assertEqual(s3_client.deleted, [])
+
+
+@skipUnless(hasattr(os, "fork"), "Needs os.fork")
+class AWSClientRegistryTests(SimpleTestCase):
+    def test_forked_child_gets_an_empty_registry_and_a_new_lock(self):
+        registry = AWSClientRegistry({}, max_pool_connections=4, max_attempts=2)
+        registry.clients["s3"] = parent_client = object()
+        read_end, write_end = os.pipe()
+
+        # The lock is held by the parent while it forks, as another thread could
+        with registry.lock:
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    emptied = registry.lock.acquire(blocking=False) and not registry.clients
+                    os.write(write_end, b"1" if emptied else b"0")
+                finally:
+                    os._exit(0)
+
+        os.waitpid(pid, 0)
+        os.close(write_end)
+        self.assertEqual(os.read(read_end, 1), b"1")
+        os.close(read_end)
+        self.assertIs(registry.get_client("s3"), parent_client)
+
+    def test_registries_are_not_kept_alive_by_the_fork_hook(self):
+        registry = AWSClientRegistry({}, max_pool_connections=4, max_attempts=2)
+        reference = weakref.ref(registry)
+        del registry
+        gc.collect()
+        self.assertIsNone(reference())
+
+
+def css_properties(**declarations):
+    return [
+        {"property": name.replace("_", "-"), "value": value}
+        for name, value in declarations.items()
+    ]
+
+
+class CSSCompilerTests(SimpleTestCase):
+    def test_rules_with_the_same_declarations_are_grouped(self):
+        css_json = {
+            "a": css_properties(color="Red", margin="0"),
+            "b": css_properties(padding="1px"),
+            "c": css_properties(color="red", margin="0"),
+        }
+        self.assertEqual(
+            compile_css(css_json),
+            ".a,.c{color:red!important;margin:0!important}.b{padding:1px!important}",
+        )
+
+    def test_rules_are_not_grouped_across_an_overriding_rule(self):
+        # Grouping .c with .a would let .b override the color of .c
+        css_json = {
+            "a": css_properties(color="red"),
+            "b": css_properties(color="blue"),
+            "c": css_properties(color="red"),
+        }
+        self.assertEqual(
+            compile_css(css_json),
+            ".a{color:red!important}.b{color:blue!important}.c{color:red!important}",
+        )
+
+    def test_empty_rules_are_dropped_and_the_last_value_wins(self):
+        css_json = {
+            "a": [],
+            "b": [{"property": "color", "value": ""}],
+            "c": [
+                {"property": "color", "value": "red"},
+                {"property": "color", "value": "blue"},
+            ],
+        }
+        self.assertEqual(compile_css(css_json), ".c{color:blue!important}")
+
+    @override_settings(
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "compiled-css",
+            }
+        }
+    )
+    def test_compiled_css_is_cached_by_the_style_json(self):
+        caches["default"].clear()
+        first = {"a": css_properties(color="red"), "b": css_properties(margin="0")}
+        reordered = {"b": first["b"], "a": first["a"]}
+        with mock.patch(
+            "portfolio.dom_manipulation.css_compiler.compile_css", wraps=compile_css
+        ) as compile:
+            self.assertEqual(compile_css_cached(first), compile_css(first))
+            self.assertEqual(compile_css_cached(dict(first)), compile_css(first))
+            self.assertEqual(compile.call_count, 1)
+
+            # Order of the rules is part of the cascade, so it is part of the key
+            self.assertEqual(compile_css_cached(reordered), compile_css(reordered))
+            self.assertEqual(compile.call_count, 2)
+
+
+class FakeS3Objects:
+    # get_object of an s3 client, answering conditional gets like s3 does
+    def __init__(self, objects):
+        self.objects = objects  # Key -> content
+        self.requests = []
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.requests.append((Key, IfNoneMatch))
+        content = self.objects[Key]
+        etag = f'"{hashlib.md5(content).hexdigest()}"'
+        if IfNoneMatch == etag:
+            raise ClientError({"Error": {"Code": "304"}}, "GetObject")
+        return {"Body": io.BytesIO(content), "ETag": etag}
+
+
+class TemplateAssetCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.cache_dir = cache_dir.name
+        self.s3_client = FakeS3Objects(
+            {"t/css/a.css": b"a" * 4, "t/css/b.css": b"b" * 4, "t/css/c.css": b"c" * 4}
+        )
+
+    def cache(self, max_bytes=1024, revalidate_after=60):
+        return TemplateAssetCache(max_bytes, self.cache_dir, revalidate_after)
+
+    def test_fresh_files_are_read_from_memory(self):
+        cache = self.cache()
+        for _ in range(3):
+            self.assertEqual(cache.get(self.s3_client, "bucket", "t/css/a.css"), b"aaaa")
+        self.assertEqual(len(self.s3_client.requests), 1)
+        stats = cache.stats()
+        self.assertEqual((stats["misses"], stats["memory_hits"]), (1, 2))
+
+    def test_least_recently_used_files_are_evicted(self):
+        cache = self.cache(max_bytes=8)
+        for key in ["t/css/a.css", "t/css/b.css", "t/css/a.css", "t/css/c.css"]:
+            cache.get(self.s3_client, "bucket", key)
+        self.assertEqual(
+            list(cache.entries), [("bucket", "t/css/a.css"), ("bucket", "t/css/c.css")]
+        )
+        self.assertEqual((cache.size, cache.stats()["evictions"]), (8, 1))
+
+    def test_files_larger_than_the_cache_are_not_kept_in_memory(self):
+        cache = self.cache(max_bytes=3)
+        self.assertEqual(cache.get(self.s3_client, "bucket", "t/css/a.css"), b"aaaa")
+        self.assertEqual((len(cache.entries), cache.size), (0, 0))
+
+    def test_other_processes_read_the_files_from_disk(self):
+        self.cache().get(self.s3_client, "bucket", "t/css/a.css")
+        cache = self.cache()
+        self.assertEqual(cache.get(self.s3_client, "bucket", "t/css/a.css"), b"aaaa")
+        self.assertEqual(len(self.s3_client.requests), 1)
+        self.assertEqual(cache.stats()["disk_hits"], 1)
+
+    def test_stale_files_are_revalidated_with_their_etag(self):
+        cache = self.cache(revalidate_after=0)
+        cache.get(self.s3_client, "bucket", "t/css/a.css")
+        self.assertEqual(cache.get(self.s3_client, "bucket", "t/css/a.css"), b"aaaa")
+        self.assertEqual(cache.stats()["revalidated"], 1)
+
+        self.s3_client.objects["t/css/a.css"] = b"changed"
+        self.assertEqual(cache.get(self.s3_client, "bucket", "t/css/a.css"), b"changed")
+        self.assertEqual(
+            [if_none_match is not None for _, if_none_match in self.s3_client.requests],
+            [False, True, True],
+        )
+        # The changed file is written to disk for the other processes
+        self.assertEqual(
+            self.cache().read_disk("bucket", "t/css/a.css").content, b"changed"
+        )
+
+    def test_invalidated_prefix_is_removed_from_memory_and_disk(self):
+        cache = self.cache()
+        cache.get(self.s3_client, "bucket", "t/css/a.css")
+        cache.invalidate("bucket", "t/")
+        self.assertEqual((len(cache.entries), cache.size), (0, 0))
+        self.assertIsNone(cache.read_disk("bucket", "t/css/a.css"))
+
+    def test_keys_outside_the_cache_directory_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.cache().disk_path("bucket", "../../etc/passwd")
+
+
+def shouting_minifier(content):
+    # Minifier configured by the tests through DEPLOY_MINIFIERS
+    return content.upper()
+
+
+def failing_minifier(content):
+    raise ValueError("Unexpected token")
+
+
+class MinifierTests(SimpleTestCase):
+    def test_html_whitespace_is_collapsed_and_comments_removed(self):
+        html = """
+            <div>
+                <!-- navigation -->
+                <p>Hello   <b>world</b> !</p>
+                <pre>  kept
+  as is </pre>
+                <!--[if IE]><p>old</p><![endif]-->
+            </div>
+        """
+        self.assertEqual(
+            minify_html(html),
+            "<div><p>Hello <b>world</b> !</p><pre>  kept\n  as is </pre>"
+            "<!--[if IE]><p>old</p><![endif]--></div>",
+        )
+
+    def test_css_fallback_keeps_strings_and_bang_comments(self):
+        css = """/*! license */a > b ,  p { content: "  a ;  b  " ; color: red ; }
+            /* dropped */
+        """
+        self.assertEqual(
+            minify_css_fallback(css),
+            '/*! license */a>b,p{content:"  a ;  b  ";color:red}',
+        )
+
+    @override_settings(
+        DEPLOY_MINIFIERS={
+            "text/html": "portfolio.tests.shouting_minifier",
+            "text/css": "portfolio.tests.failing_minifier",
+            "application/javascript": None,
+        }
+    )
+    def test_minifier_of_the_content_type_is_used(self):
+        self.assertEqual(minify("<p>a</p>", "text/html"), "<P>A</P>")
+        # Files are deployed as they are without a minifier, or when it fails
+        self.assertEqual(minify("var a = 1;", "application/javascript"), "var a = 1;")
+        self.assertEqual(minify("p { }", "text/css"), "p { }")
+        self.assertEqual(minify("{}", "application/json"), "{}")
+
+    @override_settings(
+        DEPLOY_MINIFIERS={"text/html": "portfolio.tests.shouting_minifier"},
+        CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "minified-assets",
+            }
+        },
+    )
+    def test_cached_results_are_minified_once(self):
+        caches["default"].clear()
+        # Minifiers are imported once, the patched one is dropped afterwards
+        get_minifier.cache_clear()
+        self.addCleanup(get_minifier.cache_clear)
+        with mock.patch(
+            "portfolio.tests.shouting_minifier", wraps=shouting_minifier
+        ) as minifier:
+            for _ in range(2):
+                self.assertEqual(minify("<p>a</p>", "text/html", cached=True), "<P>A</P>")
+            minify("<p>a</p>", "text/html")
+        self.assertEqual(minifier.call_count, 2)
+
+    def test_report_has_the_sizes_and_their_totals(self):
+        self.assertEqual(
+            minification_report({"index.html": (100, 60), "css/style.css": (50, 40)}),
+            {
+                "files": {
+                    "index.html": {"before": 100, "after": 60},
+                    "css/style.css": {"before": 50, "after": 40},
+                },
+                "total": {"before": 150, "after": 100},
+            },
+        )
+
+
+class TemplateUploaderTests(SimpleTestCase):
+    def test_uploader_pool_fits_all_its_connections(self):
+        with mock.patch(
+            "portfolio.cloud_functions.template_upload.s3_config"
+        ) as s3_config:
+            uploader = TemplateUploader("bucket")
+
+        # A client of its own, the shared client is created without a config
+        (config,) = s3_config.call_args.args
+        self.assertEqual(
+            config.max_pool_connections,
+            TEMPLATE_UPLOAD_WORKERS * TEMPLATE_UPLOAD_FILE_CONCURRENCY,
+        )
+        self.assertIs(uploader.s3_client, s3_config.return_value)
+
+
+class ProjectCreationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="owner", email="owner@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_project(self, template_dom_tree):
+        Template.objects.create(
+            template_name="broken", template_dom_tree=template_dom_tree, created_by=self.user
+        )
+        with mock.patch("portfolio.views.S3_Project"):
+            return self.client.post(
+                reverse("create_project"),
+                {"project_name": "portfolio", "template_name": "broken"},
+                format="json",
+            )
+
+    def test_template_without_body_is_an_error_response(self):
+        response = self.create_project({"meta": []})
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(response.json()["success"])
+        self.assertFalse(PortfolioProject.objects.exists())
+
+    def test_malformed_template_is_an_error_response(self):
+        response = self.create_project({"body": "not a list"})
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(PortfolioProject.objects.exists())
+
+    def test_template_without_dom_tree_is_an_error_response(self):
+        response = self.create_project(None)
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(response.json()["success"])
+
+    def test_project_is_created_from_the_compiled_skeleton(self):
+        response = self.create_project(parse_with_dom_parser(read_fixture_index_file()))
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNotNone(Template.objects.get().template_skeleton)
+
+
+class CopyOnWriteOverridesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="owner", email="owner@example.com")
+        self.customized_template = create_customized_template(self.user)
+
+    def fresh(self):
+        return CustomizedTemplate.objects.select_related("template").get(
+            id=self.customized_template.id
+        )
+
+    def find(self, body, predicate):
+        found = []
+        walk_dom_tree([body], enter=lambda element: predicate(element) and found.append(element))
+        return found
+
+    def test_skeleton_elements_have_stored_identities(self):
+        skeleton_body = self.customized_template.template.template_skeleton["body"]
+        identifiers = [
+            element["attributes"][ELEMENT_IDENTIFIER_PREFIX]
+            for element in self.find(skeleton_body, lambda element: True)
+        ]
+        self.assertEqual(len(identifiers), len(set(identifiers)))
+        self.assertEqual(self.fresh().materialize()["body"], skeleton_body)
+
+    def test_overrides_target_the_same_elements_after_a_skeleton_edit(self):
+        customized_template = self.fresh()
+        body = customized_template.materialize()["body"]
+        (brand,) = self.find(body, lambda element: element["text"] == "JD")
+        (toggle,) = self.find(body, lambda element: element["tag"] == "button")
+        customized_template.save(
+            update_fields=customized_template.apply_patch(
+                [
+                    {"op": "set_text", "id": element_id(brand), "text": "Jane"},
+                    {
+                        "op": "set_attribute",
+                        "id": element_id(toggle),
+                        "name": "title",
+                        "value": "Menu",
+                    },
+                ]
+            )
+        )
+
+        # Elements added around the patched ones, which shifts their positions
+        template = Template.objects.get()
+        skeleton_body = template.template_skeleton["body"]
+        skeleton_body["children"].insert(
+            0, {"tag": "span", "attributes": {}, "text": "new", "children": []}
+        )
+        navigation = skeleton_body["children"][1]
+        navigation["children"].insert(
+            0, {"tag": "p", "attributes": {"class": ["intro"]}, "text": "", "children": []}
+        )
+        navigation["children"].append(
+            {"tag": "small", "attributes": {}, "text": "v2", "children": []}
+        )
+        template.save(update_fields=["template_skeleton"])
+
+        body = self.fresh().materialize()["body"]
+        (brand,) = self.find(body, lambda element: element_id(element) == element_id(brand))
+        self.assertEqual((brand["tag"], brand["attributes"]["href"]), ("a", "#home"))
+        self.assertEqual(brand["text"], "Jane")
+        (toggle,) = self.find(body, lambda element: element_id(element) == element_id(toggle))
+        self.assertEqual(toggle["tag"], "button")
+        self.assertEqual(toggle["attributes"]["title"], "Menu")
+
+        # The added elements got identities of their own
+        identifiers = [element_id(element) for element in self.find(body, lambda element: True)]
+        self.assertNotIn(None, identifiers)
+        self.assertEqual(len(identifiers), len(set(identifiers)))
+
+    def test_inserted_elements_do_not_reuse_identifiers_of_the_body(self):
+        customized_template = self.fresh()
+        body = customized_template.materialize()["body"]
+        (brand,) = self.find(body, lambda element: element["text"] == "JD")
+        (navigation,) = self.find(body, lambda element: element["tag"] == "nav")
+        (class_name,) = [
+            value
+            for value in brand["attributes"]["class"]
+            if value.startswith(f"{ELEMENT_DEFAULT_CLASS_NAME}-")
+        ]
+
+        # Random characters which first spell a class name and an identifier in use
+        taken = class_name.rsplit("-", 1)[1] + element_id(navigation).rsplit("-", 1)[1]
+        prefix = bytes(IDENTIFIER_CHARACTERS.index(character) for character in taken)
+        urandom = os.urandom
+        with mock.patch(
+            "portfolio.utils.os.urandom",
+            side_effect=lambda size: prefix + urandom(size - len(prefix)),
+        ):
+            customized_template.apply_patch(
+                [
+                    {
+                        "op": "insert",
+                        "parent": element_id(navigation),
+                        "index": 0,
+                        "element": {"tag": "p", "attributes": {}, "text": "new", "children": []},
+                    }
+                ]
+            )
+
+        names = []
+        self.find(
+            customized_template.pending_materialized["body"],
+            lambda element: names.extend(
+                [element_id(element), *element["attributes"].get("class", [])]
+            ),
+        )
+        prefixes = (f"{ELEMENT_DEFAULT_CLASS_NAME}-", f"{ELEMENT_IDENTIFIER_VALUE}-")
+        names = [name for name in names if name and name.startswith(prefixes)]
+        self.assertEqual(len(names), len(set(names)))
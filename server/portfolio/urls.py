@@ -3,10 +3,12 @@ from .views import (
     Project,
     UploadTemplate,
     ListTemplates,
+    TemplateAssetCacheStats,
     ListPortfolioProject,
     UpdateCustomizeTemplate,
     UpdateProjectImageOrDocument,
     Deployment,
+    DeploymentStatus,
     DeletePortfolioProject,
     PortfolioDomain,
     PortfolioEmailSend,
@@ -27,6 +29,11 @@ urlpatterns = [
         name="upload_template",
     ),
     path("list-templates/", ListTemplates.as_view(), name="list_templates"),
+    path(
+        "template-asset-cache-stats/",
+        TemplateAssetCacheStats.as_view(),
+        name="template_asset_cache_stats",
+    ),
     path(
         "list-portfolio-projects/",
         ListPortfolioProject.as_view(),
@@ -47,6 +54,11 @@ urlpatterns = [
         Deployment.as_view(),
         name="deploy_portfolio",
     ),
+    path(
+        "deployment-status/<int:job_id>/",
+        DeploymentStatus.as_view(),
+        name="deployment_status",
+    ),
     path(
         "list-deployed-portfolio/",
         Deployment.as_view(),
@@ -1,16 +1,18 @@
+import hashlib
 import random
 import string
-from server.utils.s3 import (
-    s3_config,
-    get_cloudfront_domain,
-    invalidate_cloudfront_cache,
-)
+from server.utils.s3 import s3_config
+from server.utils.cloudfront import get_cloudfront_domain
 from django.conf import settings
 from server.utils.response import BaseResponse
 import os
 from botocore.exceptions import ClientError
 from django.shortcuts import get_object_or_404
-from portfolio.constants import S3_ASSETS_FOLDER_NAME
+from portfolio.constants import (
+    S3_ASSETS_FOLDER_NAME,
+    IMMUTABLE_CACHE_CONTROL,
+    FINGERPRINT_LENGTH,
+)
 
 
 def get_object_or_404_with_permission(view, queryset, pk):
@@ -20,12 +22,93 @@ def get_object_or_404_with_permission(view, queryset, pk):
     return obj
 
 
+def fingerprint_file_name(file_name, digest):
+    # css/style.css -> css/style.<content hash>.css
+    root, extension = os.path.splitext(file_name)
+    return f"{root}.{digest[:FINGERPRINT_LENGTH]}{extension}"
+
+
+def file_digest(file):
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
 def generate_random_characters(digits=6):
     characters = string.ascii_letters + string.digits
-    random_string = "".join(random.choice(characters) for _ in range(digits))
+    random_string = "".join(random.choices(characters, k=digits))
     return random_string
 
 
+# Identifiers are lower cased, so they are built from lower case characters only.
+# Random bytes at or above the largest multiple of the alphabet size are dropped,
+# which keeps every character equally likely.
+IDENTIFIER_CHARACTERS = string.ascii_lowercase + string.digits
+IDENTIFIER_BYTE_TABLE = bytes(
+    ord(IDENTIFIER_CHARACTERS[byte % len(IDENTIFIER_CHARACTERS)]) for byte in range(256)
+)
+IDENTIFIER_REJECTED_BYTES = bytes(
+    range(256 - 256 % len(IDENTIFIER_CHARACTERS), 256)
+)
+
+
+class IdentifierAllocator:
+    """
+    Hands out identifiers like "element-1a2b3c4d" which are unique among all the
+    identifiers allocated or reserved on it, e.g. everything in one project.
+    Random characters are drawn in blocks from os.urandom. When a seed is given
+    they are drawn from a SHAKE-256 stream of the seed instead, so the same seed
+    gives the same identifiers in every process and python version.
+    """
+
+    def __init__(self, length=8, block_size=4096, seed=None):
+        self.length = length
+        self.block_size = block_size
+        self.seed = seed
+        self.blocks_drawn = 0
+        self.allocated = set()
+        self.characters = ""
+        self.position = 0
+
+    def entropy(self, size):
+        if self.seed is None:
+            return os.urandom(size)
+
+        self.blocks_drawn += 1
+        block_seed = f"{self.seed}:{self.blocks_drawn}".encode("utf-8")
+        return hashlib.shake_256(block_seed).digest(size)
+
+    def random_characters(self, digits):
+        while self.position + digits > len(self.characters):
+            data = self.entropy(max(self.block_size, digits * 2))
+            self.characters = self.characters[self.position :] + data.translate(
+                IDENTIFIER_BYTE_TABLE, IDENTIFIER_REJECTED_BYTES
+            ).decode("ascii")
+            self.position = 0
+
+        characters = self.characters[self.position : self.position + digits]
+        self.position += digits
+        return characters
+
+    def reserve(self, identifiers):
+        self.allocated.update(identifiers)
+
+    def allocate(self, prefix):
+        while True:
+            identifier = f"{prefix}-{self.random_characters(self.length)}"
+            if identifier not in self.allocated:
+                self.allocated.add(identifier)
+                return identifier
+
+
+def allocate_identifier(prefix, allocator=None):
+    if allocator:
+        return allocator.allocate(prefix)
+    return f"{prefix}-{generate_random_characters(digits=8)}".lower()
+
+
 def upload_project_file_on_s3_project(file, project_folder_name, new_file_name):
     s3_client = s3_config()
     bucket_name = settings.AWS_DEPLOYED_PORTFOLIO_BUCKET_NAME
@@ -33,18 +116,21 @@ def upload_project_file_on_s3_project(file, project_folder_name, new_file_name):
     file_extension = os.path.splitext(file.name)[1]  # Extracts .png, .jpg, etc.
     if not file_extension:
         file_extension = "." + file.content_type.split("/")[1]
-    file_s3_path = f"{project_folder_name.replace(' ', '-').lower()}/assests/{new_file_name}{file_extension}"
+
+    # Every content gets its own key, so the key is never overwritten or invalidated
+    file_s3_path = fingerprint_file_name(
+        f"{project_folder_name.replace(' ', '-').lower()}/{S3_ASSETS_FOLDER_NAME}/{new_file_name}{file_extension}",
+        file_digest(file),
+    )
 
     try:
-        # Check if the object exists in S3
+        # Same content is already uploaded
         s3_client.head_object(Bucket=bucket_name, Key=file_s3_path)
-
-        # If it exists, delete it
-        s3_client.delete_object(Bucket=bucket_name, Key=file_s3_path)
+        is_uploaded = True
     except ClientError as error:
         # Check if the error is because the object does not exist
         if error.response["Error"]["Code"] == "404":
-            print(f"{file_s3_path} does not exist in S3. No need to delete.")
+            is_uploaded = False
         else:
             print("Error occurred while checking if file already exists:", error)
             return BaseResponse.error(
@@ -57,19 +143,20 @@ def upload_project_file_on_s3_project(file, project_folder_name, new_file_name):
         )
 
     try:
-        s3_client.upload_fileobj(
-            file,
-            bucket_name,
-            file_s3_path,
-            ExtraArgs={"ContentType": file.content_type},
-        )
-        invalidate_cloudfront_cache(
-            project_name=project_folder_name, file_name=new_file_name + file_extension
-        )
+        if not is_uploaded:
+            s3_client.upload_fileobj(
+                file,
+                bucket_name,
+                file_s3_path,
+                ExtraArgs={
+                    "ContentType": file.content_type,
+                    "CacheControl": IMMUTABLE_CACHE_CONTROL,
+                },
+            )
         distribution_id = os.environ.get("DEPLOYED_SITE_CLOUDFRONT_DISTRIBUION_ID")
         cloudfront_domain = get_cloudfront_domain(distribution_id=distribution_id)
 
-        url = f"https://{cloudfront_domain}/{project_folder_name}/{S3_ASSETS_FOLDER_NAME}/{new_file_name}"
+        url = f"https://{cloudfront_domain}/{file_s3_path}"
         return {"image_s3_url": url}
     except Exception as error:
         print("Error occurred while uploading the project image on s3 -> ", error)
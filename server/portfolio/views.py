@@ -2,58 +2,59 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from .permissions import IsOwner
 from server.response.api_response import ApiResponse
 from rest_framework.views import APIView
-from bs4 import BeautifulSoup
-from server.utils.s3 import (
-    s3_config,
-    s3_name_format,
-)
+from server.utils.s3 import s3_name_format
+import re
 import json
 from .serializers import (
     CreateProjectSerializer,
     ListTemplatesSerializer,
     TemplateDataSerializer,
     ListPortfolioProjectSerializer,
-    CustomizedTemplateSerializer,
     PortfolioContactEmailSerializer,
+    DeploymentJobSerializer,
 )
-from .models import PortfolioProject, CustomizedTemplate, Template
+from .models import PortfolioProject, CustomizedTemplate, Template, DeploymentJob
 from django.shortcuts import get_object_or_404
 from django.db import transaction
 import os
+import secrets
 from django.conf import settings
-from django.http import Http404
+from django.http import Http404, HttpResponseNotModified
+from django.utils.http import parse_etags
+from django.utils.cache import patch_vary_headers
+from django.urls import reverse
 from .utils import (
     upload_project_file_on_s3_project,
     get_object_or_404_with_permission,
 )
-import boto3
+from server.utils.aws import get_aws_client
 from server.email import BaseEmail
 from portfolio.cloud_functions.s3 import S3_Template, S3_Project
-from portfolio.exceptions.exceptions import GeneralError, DataNotPresent
-from portfolio.dom_manipulation.handle_dom import parse_dom_tree
-from server.renderers import CustomJSONRenderer
-from portfolio.constants import (
-    INDEX_FILE,
-    RESPONSIVE_STYLE_FILE,
-    UNIVERSAL_STYLE_FILE,
-    ROOT_JS_FILE,
-    EMAIL_JS_FILE,
-    S3_JS_FOLDER_NAME,
-    S3_CSS_FOLDER_NAME,
-    ROOT_STYLE_FILE,
+from portfolio.cloud_functions.asset_cache import get_template_asset_cache
+from portfolio.deployment_jobs import enqueue_deployment_job
+from portfolio.exceptions.exceptions import (
+    GeneralError,
+    DataNotPresent,
+    PatchError,
 )
+from rest_framework.exceptions import PermissionDenied
+from portfolio.dom_manipulation.handle_dom import compile_template_skeleton
+from server.renderers import CustomJSONRenderer, MessagePackRenderer
+from portfolio.constants import S3_ASSETS_FOLDER_NAME, FINGERPRINT_LENGTH
 
 
 class Project(APIView):
     permission_classes = [IsAuthenticated]
-    renderer_classes = [CustomJSONRenderer]
+    renderer_classes = [CustomJSONRenderer, MessagePackRenderer]
 
-    def get_section(self, template_data):
-        sections = []
-        for elem in template_data["body"][0]["children"]:
-            if elem["tag"] == "section":
-                sections.append({elem["tag"]: elem["attributes"]["id"]})
-        return sections
+    def get_template_skeleton(self, template_instance):
+        # Templates uploaded before skeletons existed are compiled on first use
+        if not template_instance.template_skeleton:
+            template_instance.template_skeleton = compile_template_skeleton(
+                template_instance.template_dom_tree
+            )
+            template_instance.save(update_fields=["template_skeleton"])
+        return template_instance.template_skeleton
 
     def post(self, request):
         data = request.data
@@ -68,13 +69,13 @@ class Project(APIView):
             )
 
             template_data = template_instance.template_dom_tree
-            html_body = template_data.get("body")[0]
-            parsed_html_body_children = parse_dom_tree(html_body).get("children")[0]
-
-            if template_data and parsed_html_body_children:
-                sections = self.get_section(template_data)
 
+            if template_data:
                 try:
+                    template_skeleton = self.get_template_skeleton(template_instance)
+                    if not template_skeleton.get("body"):
+                        raise GeneralError("Template has no body to create the project from")
+
                     with transaction.atomic():
                         project_instance = PortfolioProject.objects.create(
                             project_name=serializer.validated_data.get("project_name"),
@@ -82,18 +83,13 @@ class Project(APIView):
                             pre_built_template=template_instance,
                             portfolio_contact_configured_email=request.user.email,
                         )
+                        # Body and template data are read from the template until
+                        # they are customized
                         customized_template_instance = (
                             CustomizedTemplate.objects.create(
                                 template=template_instance,
                                 portfolio_project=project_instance,
-                                meta=template_data.get("meta"),
-                                links=template_data.get("link"),
-                                scripts=template_data.get("script"),
-                                body=parsed_html_body_children,
-                                style=template_data.get("style"),
-                                css=template_data.get("css"),
-                                js=template_data.get("js"),
-                                sections=sections,
+                                id_seed=secrets.randbits(62),
                             )
                         )
 
@@ -103,10 +99,6 @@ class Project(APIView):
                         bucket_name=bucket_name, project_name=project_name
                     )
                     s3_project_instance.create_assests_on_s3()
-                    s3_project_instance.configure_user_contact_form(
-                        user_email=request.user.email,
-                        template_name=customized_template_instance.template.template_name,
-                    )
                 except GeneralError as error:
                     return ApiResponse.response_failed(
                         message=str(error), status=500, success=False
@@ -120,19 +112,27 @@ class Project(APIView):
                         message=f"Error occurred while creating project! Please try again or contact at support@portify.com {str(error)}",
                         status=500,
                     )
-            return ApiResponse.response_succeed(
-                message="Project created",
-                status=201,
-                data={
-                    "customized_template_id": customized_template_instance.id,
-                    "project_name": customized_template_instance.portfolio_project.project_name,
-                },
-            )
+                return ApiResponse.response_succeed(
+                    message="Project created",
+                    status=201,
+                    data={
+                        "customized_template_id": customized_template_instance.id,
+                        "project_name": customized_template_instance.portfolio_project.project_name,
+                    },
+                )
 
         return ApiResponse.response_failed(
             message="Error occurred on server", status=500
         )
 
+    def is_not_modified(self, request, etag):
+        if_none_match = request.headers.get("If-None-Match")
+        if not if_none_match:
+            return False
+        # Weak comparison, compressed responses carry the weak form of the ETag
+        etags = [tag.removeprefix("W/") for tag in parse_etags(if_none_match)]
+        return "*" in etags or etag in etags
+
     def get(self, request, custom_template_id, portfolio_project_id):
         if not custom_template_id:
             return ApiResponse.response_failed(
@@ -140,14 +140,40 @@ class Project(APIView):
             )
 
         try:
+            # Only the version is read, the template data is not loaded when unchanged
+            content_version = (
+                CustomizedTemplate.objects.filter(id=custom_template_id)
+                .values_list("content_version", flat=True)
+                .first()
+            )
+            if content_version is None:
+                raise Http404
+
+            representation = request.accepted_renderer.format
+            etag = CustomizedTemplate.content_etag(
+                custom_template_id, content_version, representation
+            )
+            if self.is_not_modified(request, etag):
+                response = HttpResponseNotModified()
+                response["ETag"] = etag
+                response["Cache-Control"] = "private, no-cache"
+                patch_vary_headers(response, ("Accept",))
+                return response
+
             custom_template = get_object_or_404(
                 CustomizedTemplate, id=custom_template_id
             )
             serializer = TemplateDataSerializer(custom_template)
 
-            return ApiResponse.response_succeed(
+            response = ApiResponse.response_succeed(
                 message="Template found", data=serializer.data, status=200
             )
+            response["ETag"] = CustomizedTemplate.content_etag(
+                custom_template.id, custom_template.content_version, representation
+            )
+            response["Cache-Control"] = "private, no-cache"
+            patch_vary_headers(response, ("Accept",))
+            return response
         except Http404:
             return ApiResponse.response_failed(
                 message=f"Template with this id {custom_template_id} does not exsit. Please try again!",
@@ -220,6 +246,7 @@ class UploadTemplate(APIView):
                     template_url=template_url,
                     template_preview=template_preview_url,
                     template_dom_tree=dom_elements_data,
+                    template_skeleton=compile_template_skeleton(dom_elements_data),
                     bucket_name=bucket_name,
                     cloudfront_domain=aws_s3_object.template_cloudfront_domain,
                     created_by=request.user,
@@ -271,6 +298,18 @@ class ListTemplates(APIView):
             )
 
 
+class TemplateAssetCacheStats(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        # Counters are kept per server process
+        return ApiResponse.response_succeed(
+            message="Template asset cache stats",
+            status=200,
+            data=get_template_asset_cache().stats(),
+        )
+
+
 class ListPortfolioProject(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -292,9 +331,13 @@ class ListPortfolioProject(APIView):
 class UpdateCustomizeTemplate(APIView):
     permission_classes = [IsAuthenticated, IsOwner]
 
-    def get_object(self, pk):
+    def get_object(self, pk, for_update=False):
+        queryset = CustomizedTemplate.objects
+        if for_update:
+            queryset = queryset.select_for_update()
+
         try:
-            customized_template_instance = CustomizedTemplate.objects.get(id=pk)
+            customized_template_instance = queryset.get(id=pk)
             self.check_object_permissions(
                 self.request, customized_template_instance.portfolio_project
             )
@@ -321,7 +364,7 @@ class UpdateCustomizeTemplate(APIView):
                 )
 
             if project_template_body:
-                customized_template.body = project_template_body
+                customized_template.set_body(project_template_body)
 
             customized_template.save()
 
@@ -335,6 +378,51 @@ class UpdateCustomizeTemplate(APIView):
             status=200, message="Success saving", success=True
         )
 
+    def patch(self, request):
+        data = request.data
+        project_template_id = data.get("project_template_id", None)
+        operations = data.get("operations", None)
+
+        if not project_template_id:
+            return ApiResponse.response_failed(
+                message="Custom template id is not found", success=False, status=404
+            )
+
+        if not operations or not isinstance(operations, list):
+            return ApiResponse.response_failed(
+                message="Patch operations are not provided", success=False, status=400
+            )
+
+        try:
+            with transaction.atomic():
+                customized_template = self.get_object(
+                    pk=project_template_id, for_update=True
+                )
+
+                if not customized_template:
+                    return ApiResponse.response_failed(
+                        status=404, message="Project not found", success=False
+                    )
+
+                update_fields = customized_template.apply_patch(operations)
+                customized_template.save(update_fields=update_fields)
+
+        except PatchError as error:
+            return ApiResponse.response_failed(
+                success=False, message=str(error), status=400
+            )
+        except PermissionDenied:
+            raise
+        except Exception as error:
+            print("Error occurred while patching the template -> ", error)
+            return ApiResponse.response_failed(
+                success=False, message="Error occurred while saving", status=500
+            )
+
+        return ApiResponse.response_succeed(
+            status=200, message="Success saving", success=True
+        )
+
 
 class UpdateProjectImageOrDocument(APIView):
     permission_classes = [IsAuthenticated, IsOwner]
@@ -381,6 +469,28 @@ class UpdateProjectImageOrDocument(APIView):
                 message=uploaded.get("message"), status=500, success=False
             )
 
+        # Elements showing an earlier upload of the file are pointed to the new key
+        asset_pattern = re.compile(
+            rf"/{re.escape(s3_name_format(project_name))}/{S3_ASSETS_FOLDER_NAME}/"
+            rf"{re.escape(str(new_file_name))}(\.[0-9a-f]{{{FINGERPRINT_LENGTH}}})?"
+            rf"(\.\w+)?$"
+        )
+        try:
+            with transaction.atomic():
+                customized_template_instance = (
+                    CustomizedTemplate.objects.select_for_update()
+                    .filter(portfolio_project=project_instance)
+                    .first()
+                )
+                if customized_template_instance:
+                    update_fields = customized_template_instance.replace_asset_url(
+                        asset_pattern, uploaded["image_s3_url"]
+                    )
+                    if update_fields:
+                        customized_template_instance.save(update_fields=update_fields)
+        except Exception as error:
+            print("Error occurred while updating the image references -> ", error)
+
         return ApiResponse.response_succeed(
             message="Image uploaded successfully",
             status=200,
@@ -392,169 +502,9 @@ class UpdateProjectImageOrDocument(APIView):
 class Deployment(APIView):
     permission_classes = [IsAuthenticated, IsOwner]
 
-    def parse_element(self, elements, soup, parent=None):
-        top_level_elements = []
-
-        for element in elements:
-            tag_name = element.get("tag").lower()
-            new_tag = soup.new_tag(tag_name)
-
-            if "attributes" in element and len(element.get("attributes")):
-                for attr, value in element.get("attributes").items():
-                    if isinstance(value, list):
-                        new_tag[attr] = " ".join(value)  # Join classes with space
-                    else:
-                        new_tag[attr] = value
-            if "text" in element and element.get("text"):
-                new_tag.string = element.get("text")
-
-            if "children" in element and element.get("children"):
-                self.parse_element(element.get("children"), soup, new_tag)
-
-            if parent:
-                parent.append(new_tag)
-            else:
-                top_level_elements.append(new_tag)
-
-        if parent is None:
-            return top_level_elements
-
-        return parent
-
-    def parse_meta(self, meta_data, soup, description):
-        for element in meta_data:
-            tag_name = element.get("tag")
-            attributes = element.get("attributes", {})
-
-            # Extract the "name" attribute separately to avoid conflicts
-            name_attr = attributes.pop("name", None)
-
-            # Create a new tag
-            new_tag = soup.new_tag(tag_name, **attributes)
-
-            # If there was a "name" attribute, set it manually
-            if name_attr:
-                new_tag["name"] = name_attr
-
-            # Add text if present
-            if element.get("text"):
-                new_tag.string = element["text"]
-
-            # Append the tag to the soup
-            soup.append(new_tag)
-
-        new_tag = soup.new_tag(
-            "meta", attrs={"name": "description", "content": description}
-        )
-        soup.append(new_tag)
-        return soup
-
-    def build_html(self, meta, body, links, script, title, description):
-        soup = BeautifulSoup("", "html.parser")
-        html = soup.new_tag("html")
-        head = soup.new_tag("head")
-        document_title = soup.new_tag("title")
-        document_title.string = title
-
-        html.append(self.parse_meta(meta, soup, description))
-        head.append(document_title)
-        html_links = self.parse_element(links, soup)
-        for link in html_links:
-            head.append(link)
-        html.append(head)
-        html.append(self.parse_element(body, soup)[0])
-        return html
-
-    def convert_json_to_css(self, css_json):
-        css_rules = []
-        print("json", css_json)
-        # Iterate over the JSON object to convert it to CSS format
-        for class_name, properties in css_json.items():
-            css_rule = f".{class_name} {{\n"
-            for prop in properties:
-                if prop.get("value"):
-                    property_name = prop.get("property")
-                    property_value = f"{prop.get('value')}"
-                    css_rule += (
-                        f"  {property_name}: {property_value.lower()} !important;\n"
-                    )
-            css_rule += "}"
-            css_rules.append(css_rule)
-
-        return "\n".join(css_rules)
-
-    def extract_template_css(self, s3_client, template_name):
-        try:
-            css_response = {}
-            # cssData = [
-            #     {"file": ROOT_STYLE_FILE},
-            #     {"file": RESPONSIVE_STYLE_FILE},
-            #     {"file": UNIVERSAL_STYLE_FILE},
-            # ]
-            cssFiles = [ROOT_STYLE_FILE, RESPONSIVE_STYLE_FILE, UNIVERSAL_STYLE_FILE]
-
-            for file in cssFiles:
-                response = s3_client.get_object(
-                    Bucket=settings.AWS_STORAGE_TEMPLATE_BUCKET_NAME,
-                    Key=f"{template_name}/{S3_CSS_FOLDER_NAME}/{file}",
-                )
-                css = response["Body"].read().decode("utf-8")
-                css_response[file] = css
-
-            # for data in cssData:
-            #     response = s3_client.get_object(
-            #         Bucket=settings.AWS_STORAGE_TEMPLATE_BUCKET_NAME,
-            #         Key=f'{template_name}/{S3_CSS_FOLDER_NAME}/{data["file"]}',
-            #     )
-            #     css = response["Body"].read().decode("utf-8")
-            #     if data["file"] == ROOT_STYLE_FILE:
-            #         css_response["template_css"] = css
-            #     elif data["file"] == "responsive.css":
-            #         css_response["template_responsive_css"] = css
-            #     elif data["file"] == "universal-style.css":
-            #         css_response["template_universal_css"] = css
-
-            print(" \n in extract tempalte css -> ", json.dumps(css_response, indent=2))
-            return css_response
-
-        except Exception as error:
-            print("Error occurred while getting the css from the template ->", error)
-            return False
-
-    def extract_template_js(self, s3_client, template_name):
-        try:
-            js_response = {}
-            js_data = [{"file": "script.js"}]
-            js_files = [ROOT_JS_FILE, EMAIL_JS_FILE]
-
-            for file in js_files:
-                response = s3_client.get_object(
-                    Bucket=settings.AWS_STORAGE_TEMPLATE_BUCKET_NAME,
-                    Key=f"{template_name}/{S3_JS_FOLDER_NAME}/{file}",
-                )
-                js = response["Body"].read().decode("utf-8")
-                js_response[file] = js
-
-            # for data in js_data:
-            #     response = s3_client.get_object(
-            #         Bucket=settings.AWS_STORAGE_TEMPLATE_BUCKET_NAME,
-            #         Key=f'{template_name}/js/{data["file"]}',
-            #     )
-            #     js = response["Body"].read().decode("utf-8")
-            #     js_response["template_js"] = js
-
-            return js_response
-
-        except Exception as error:
-            print("Error occurred while getting the js from the template ->", error)
-            return False
-
     def post(self, request):
         data = request.data
         custom_template_id = data.get("customized_template_id")
-        project_name = str(data.get("project_name"))
-        title = request.data.get("title")
-        description = request.data.get("description")
 
         try:
             portfolio_project_instance = get_object_or_404_with_permission(
@@ -564,7 +514,6 @@ class Deployment(APIView):
                 customized_template_instance = CustomizedTemplate.objects.get(
                     id=custom_template_id
                 )
-            serializer = CustomizedTemplateSerializer(customized_template_instance)
         except CustomizedTemplate.DoesNotExist:
             print("Custom template with the given id does not exist.")
             return ApiResponse.response_failed(
@@ -578,129 +527,32 @@ class Deployment(APIView):
                 message="Error occurred on server", status=500, success=False
             )
 
-        meta_data = serializer.data.get("meta")
-        body = [serializer.data.get("body")]
-        links = serializer.data.get("links")
-        style = serializer.data.get("style")
-        script = serializer.data.get("scripts")
-        template_name = customized_template_instance.template.template_name
-
-        if not title and not description:
-            title = customized_template_instance.portfolio_project.portfolio_title
-            description = (
-                customized_template_instance.portfolio_project.portfolio_description
-            )
-
-        html = self.build_html(
-            meta=meta_data,
-            body=body,
-            links=links,
-            script=script,
-            title=title,
-            description=description,
-        )
-
-        if isinstance(style, dict):
-            custom_css = ""
-        else:
-            custom_css = self.convert_json_to_css(style[0])
-
-        s3_client = s3_config()
-
-        css_response = self.extract_template_css(
-            s3_client=s3_client, template_name=template_name
-        )
-
-        print("\n css response -> ", json.dumps(css_response, indent=2))
-
-        js_response = self.extract_template_js(
-            s3_client=s3_client, template_name=template_name
-        )
-        merged_css = css_response[ROOT_STYLE_FILE] + "\n" + custom_css
-
-        bucket_name = settings.AWS_DEPLOYED_PORTFOLIO_BUCKET_NAME
-        project_name = s3_name_format(project_name)
-        content_to_upload = [
-            {
-                "file_name": INDEX_FILE,
-                "content_type": "text/html",
-                "file_content": str(html),
-            },
-            {
-                "file_name": f"{S3_CSS_FOLDER_NAME}/{ROOT_STYLE_FILE}",
-                "content_type": "text/css",
-                "file_content": str(merged_css),
-            },
-            {
-                "file_name": f"{S3_CSS_FOLDER_NAME}/{RESPONSIVE_STYLE_FILE}",
-                "content_type": "text/css",
-                "file_content": str(css_response[RESPONSIVE_STYLE_FILE]),
-            },
-            {
-                "file_name": f"{S3_CSS_FOLDER_NAME}/{UNIVERSAL_STYLE_FILE}",
-                "content_type": "text/css",
-                "file_content": str(css_response[UNIVERSAL_STYLE_FILE]),
-            },
-            {
-                "file_name": f"{S3_JS_FOLDER_NAME}/{ROOT_JS_FILE}",
-                "content_type": "application/javascript",
-                "file_content": str(js_response[ROOT_JS_FILE]),
-            },
-            {
-                "file_name": f"{S3_JS_FOLDER_NAME}/{EMAIL_JS_FILE}",
-                "content_type": "application/javascript",
-                "file_content": str(js_response[EMAIL_JS_FILE]),
-            },
-        ]
-
         try:
-            for content in content_to_upload:
-                s3_client.put_object(
-                    Body=str(content["file_content"]),
-                    Bucket=bucket_name,
-                    Key=f'{project_name}/{content["file_name"]}',
-                    ContentType=content["content_type"],
-                )
-        except Exception as error:
-            print("Error occurred on server while deploying project to s3 -> ", error)
-            return ApiResponse.response_failed(
-                success=False, message="Error occurred on server", status=500
-            )
-
-        try:
-            domain_name = os.environ.get("DOMAIN_NAME")
-            deployed_url = f"{portfolio_project_instance.project_slug}.{domain_name}"
-        except Exception as error:
-            print("Error occurred while building cloudfront url -> ", error)
-            return ApiResponse.response_failed(
-                message="Error occurred on server while deploying the site",
-                status=500,
-                success=False,
+            job = enqueue_deployment_job(
+                customized_template=customized_template_instance,
+                user=request.user,
+                payload={
+                    "project_name": str(data.get("project_name")),
+                    "title": data.get("title"),
+                    "description": data.get("description"),
+                },
             )
-
-        try:
-            customized_template_instance.portfolio_project.deployed_url = deployed_url
-            customized_template_instance.portfolio_project.is_deployed = True
-            customized_template_instance.portfolio_project.portfolio_title = title
-            customized_template_instance.portfolio_project.portfolio_description = title
-            customized_template_instance.portfolio_project.portfolio_description = (
-                description
-            )
-            customized_template_instance.portfolio_project.save()
         except Exception as error:
-            print(
-                "Error occurred while updating portfolio project for deployment -> ",
-                error,
-            )
+            print("Error occurred while queueing the deployment -> ", error)
             return ApiResponse.response_failed(
-                message="Error occurred on server", success=False, status=500
+                message="Error occurred on server", status=500, success=False
             )
 
+        # Deployment runs in a worker, its progress is polled from deployment_status
         return ApiResponse.response_succeed(
-            status=200,
-            message="Portfolio deployed",
+            status=202,
+            message="Portfolio deployment queued",
             success=True,
-            data={"deployed_url": deployed_url},
+            data={
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": reverse("deployment_status", args=[job.id]),
+            },
         )
 
     def get(self, request):
@@ -735,6 +587,21 @@ class Deployment(APIView):
         )
 
 
+class DeploymentStatus(APIView):
+    permission_classes = [IsAuthenticated, IsOwner]
+
+    def get(self, request, job_id):
+        job = get_object_or_404_with_permission(
+            view=self, queryset=DeploymentJob.objects, pk=job_id
+        )
+        return ApiResponse.response_succeed(
+            message=f"Deployment {job.status}",
+            success=True,
+            status=200,
+            data=DeploymentJobSerializer(job).data,
+        )
+
+
 class DeletePortfolioProject(APIView):
     permission_classes = [IsAuthenticated, IsOwner]
 
@@ -798,12 +665,7 @@ class PortfolioDomain(APIView):
     def post(self, request):
         domain_name = request.data.get("domain_name") + "." + request.data.get("tld")
         print(domain_name)
-        route53_client = boto3.client(
-            "route53domains",
-            aws_access_key_id=os.environ.get("53_SECRET_ACCESS_KEY"),
-            aws_secret_access_key=os.environ.get("53_ACCESS_KEY"),
-            region_name="us-east-1",
-        )
+        route53_client = get_aws_client("route53domains")
 
         try:
             response = route53_client.check_domain_availability(DomainName=domain_name)
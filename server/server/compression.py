@@ -0,0 +1,145 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # Zstandard is optional, gzip is always available
+    zstandard = None
+
+
+class DecompressionError(Exception):
+    pass
+
+
+def gzip_compress(data, level):
+    # Same as gzip.compress with a fixed mtime, so equal data gives equal bytes
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_decompress(data, max_size):
+    decompressor = zlib.decompressobj(47)  # Accepts gzip and zlib headers
+    decompressed = decompressor.decompress(data, max_size)
+    if decompressor.unconsumed_tail:
+        raise DecompressionError("Decompressed data is too large")
+    if not decompressor.eof:
+        raise DecompressionError("Compressed data is incomplete")
+    return decompressed
+
+
+def brotli_compress(data, level):
+    return brotli.compress(data, quality=level, mode=brotli.MODE_TEXT)
+
+
+def brotli_decompress(data, max_size):
+    # Stops decompressing once the output is over max_size
+    decompressor = brotli.Decompressor()
+    decompressed = decompressor.process(data, output_buffer_limit=max_size + 1)
+    if len(decompressed) > max_size:
+        raise DecompressionError("Decompressed data is too large")
+    if not decompressor.is_finished():
+        raise DecompressionError("Compressed data is incomplete")
+    return decompressed
+
+
+def zstd_compress(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def zstd_frames_are_complete(data):
+    # Stream readers stop quietly at the end of the data, even inside a frame
+    if not data:
+        return False
+    while data:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        decompressor.decompress(data)
+        if not decompressor.eof:
+            return False
+        data = decompressor.unused_data
+    return True
+
+
+def zstd_decompress(data, max_size):
+    # Reads one byte over max_size at most, whatever the frames claim their size is
+    with zstandard.ZstdDecompressor().stream_reader(
+        data, read_across_frames=True
+    ) as reader:
+        decompressed = reader.read(max_size + 1)
+    if len(decompressed) > max_size:
+        raise DecompressionError("Decompressed data is too large")
+    # Only checked once the whole data is known to decompress to max_size at most
+    if not zstd_frames_are_complete(data):
+        raise DecompressionError("Compressed data is incomplete")
+    return decompressed
+
+
+# Content coding -> (compress, decompress), in the order of server preference
+CODECS = {}
+if zstandard is not None:
+    CODECS["zstd"] = (zstd_compress, zstd_decompress)
+if brotli is not None:
+    CODECS["br"] = (brotli_compress, brotli_decompress)
+CODECS["gzip"] = (gzip_compress, gzip_decompress)
+
+CODEC_ALIASES = {"x-gzip": "gzip"}
+
+
+def parse_accept_encoding(header):
+    # Returns the content coding -> q value pairs of an Accept-Encoding header
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        coding = CODEC_ALIASES.get(coding.strip().lower(), coding.strip().lower())
+        if not coding:
+            continue
+
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def negotiate_encoding(header, codecs=CODECS):
+    """
+    Picks the content coding to respond with from an Accept-Encoding header.
+    Highest q value wins, ties are broken by the order of `codecs`.
+    """
+    if not header:
+        return None
+
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+
+    best, best_quality = None, 0.0
+    for coding in codecs:
+        quality = accepted.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(data, coding, level):
+    return CODECS[coding][0](data, level)
+
+
+def decompress(data, coding, max_size):
+    coding = CODEC_ALIASES.get(coding, coding)
+    if coding not in CODECS:
+        raise DecompressionError(f"Content encoding {coding} is not supported")
+
+    try:
+        return CODECS[coding][1](data, max_size)
+    except DecompressionError:
+        raise
+    except Exception as error:
+        raise DecompressionError(f"Invalid {coding} data -> {error}")
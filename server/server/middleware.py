@@ -0,0 +1,86 @@
+import io
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from server.compression import (
+    negotiate_encoding,
+    compress,
+    decompress,
+    DecompressionError,
+)
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with the best content coding accepted by the client
+    (zstd, br or gzip), using the compression levels configured for the route,
+    and decompresses the request bodies of the routes which accept them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = settings.COMPRESSION_MIN_SIZE
+        self.levels = settings.COMPRESSION_LEVELS
+        self.route_levels = settings.COMPRESSION_ROUTE_LEVELS
+        self.request_routes = set(settings.COMPRESSED_REQUEST_ROUTES)
+        self.request_max_size = settings.COMPRESSED_REQUEST_MAX_SIZE
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.compress_response(request, response)
+
+    def route_name(self, request):
+        resolver_match = getattr(request, "resolver_match", None)
+        return resolver_match.url_name if resolver_match else None
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        content_encoding = request.META.get("HTTP_CONTENT_ENCODING", "").strip()
+        if not content_encoding or content_encoding.lower() == "identity":
+            return None
+
+        if self.route_name(request) not in self.request_routes:
+            return JsonResponse(
+                {"success": False, "message": "Compressed request is not supported"},
+                status=415,
+            )
+
+        try:
+            body = decompress(
+                request.body, content_encoding.lower(), self.request_max_size
+            )
+        except DecompressionError as error:
+            return JsonResponse({"success": False, "message": str(error)}, status=415)
+
+        # Views read the decompressed body as if it was sent uncompressed
+        request._body = body
+        request._stream = io.BytesIO(body)
+        request.META["CONTENT_LENGTH"] = str(len(body))
+        del request.META["HTTP_CONTENT_ENCODING"]
+        return None
+
+    def compress_response(self, request, response):
+        if response.streaming or response.has_header("Content-Encoding"):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if len(response.content) < self.min_size:
+            return response
+
+        coding = negotiate_encoding(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if not coding:
+            return response
+
+        levels = {**self.levels, **self.route_levels.get(self.route_name(request), {})}
+        compressed_content = compress(response.content, coding, levels[coding])
+        if len(compressed_content) >= len(response.content):
+            return response
+
+        response.content = compressed_content
+        response["Content-Length"] = str(len(compressed_content))
+        response["Content-Encoding"] = coding
+
+        # Compressed bytes differ from the original ones, so a strong ETag is weakened
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        return response
@@ -0,0 +1,17 @@
+from rest_framework.parsers import BaseParser
+from rest_framework.exceptions import ParseError
+from server.renderers import msgpack
+
+
+class MessagePackParser(BaseParser):
+    # Request bodies sent with "Content-Type: application/msgpack"
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if msgpack is None:
+            raise ParseError("MessagePack requests are not supported")
+
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except Exception as error:
+            raise ParseError(f"MessagePack parse error - {error or type(error).__name__}")
@@ -1,15 +1,75 @@
 import json
 from rest_framework import renderers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # Standard library encoder is used when orjson is missing
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # MessagePack responses are only available with msgpack
+    msgpack = None
+
+
+def contains_error_detail(data):
+    # Looks for DRF error details by type, only inside the containers of the data
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, ErrorDetail):
+            return True
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+def encode_json(data):
+    if orjson is not None:
+        return orjson.dumps(
+            data, default=JSONEncoder().default, option=orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(
+        data, cls=JSONEncoder, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def format_error_message(data):
+    # Errors raised through DRF reach here as {"message": {"detail": ErrorDetail}}
+    message = data.get("message") if isinstance(data, dict) else None
+    if isinstance(message, dict) and contains_error_detail(message):
+        data["message"] = str(message.get("detail"))
+    return data
 
 
 class CustomJSONRenderer(renderers.JSONRenderer):
     charset = "UTF-8"
 
     def render(self, data, accepted_media_type=None, renderer_context=None):
-        if "ErrorDetail" in str(data):
-            data["message"] = str(data.get("message").get("detail"))
-            response = data
-            return json.dumps(response)
-        else:
-            response = data
-        return json.dumps(response)
+        return encode_json(format_error_message(data))
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """
+    Opt in binary format of the same response data, used when the client sends
+    "Accept: application/msgpack".
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if msgpack is None:
+            raise RuntimeError("msgpack is not installed")
+
+        return msgpack.packb(
+            format_error_message(data),
+            default=JSONEncoder().default,
+            use_bin_type=True,
+        )
@@ -36,6 +36,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "server.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -71,8 +72,27 @@ REST_FRAMEWORK = {
     "EXCEPTION_HANDLER": "server.utils.exception_handler.custom_exception_handler",
     "DEFAULT_RENDERER_CLASSES": [
         "server.renderers.CustomJSONRenderer",  # Your custom renderer if any
+        "server.renderers.MessagePackRenderer",
     ],
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+        "server.parsers.MessagePackParser",
+    ],
+}
+
+# Response compression (server.middleware.CompressionMiddleware)
+COMPRESSION_MIN_SIZE = 1024  # Responses smaller than this are sent as they are
+COMPRESSION_LEVELS = {"zstd": 3, "br": 5, "gzip": 6}
+# Compression levels per url name, the editor payloads are large so they use
+# cheaper levels (see the benchmark_compression command)
+COMPRESSION_ROUTE_LEVELS = {
+    "get_template_data": {"zstd": 1, "br": 4, "gzip": 4},
 }
+# Url names which accept compressed request bodies
+COMPRESSED_REQUEST_ROUTES = ["update_dom_data"]
+COMPRESSED_REQUEST_MAX_SIZE = 64 * 1024 * 1024
 
 AUTHENTICATION_BACKENDS = (
     "social_core.backends.google.GoogleOAuth2",  # For Google OAuth
@@ -185,11 +205,69 @@ AWS_ACCESS_KEY_ID = os.environ.get("S3_SECRET_ACCESS_KEY")
 AWS_SECRET_ACCESS_KEY = os.environ.get("S3_KEY_ID")
 AWS_S3_REGION_NAME = os.environ.get("S3_REGION_NAME")
 
+# Clients shared by the whole process (server.utils.aws)
+AWS_CLIENTS = {
+    "s3": {
+        "aws_access_key_id": AWS_ACCESS_KEY_ID,
+        "aws_secret_access_key": AWS_SECRET_ACCESS_KEY,
+        "region_name": AWS_S3_REGION_NAME,
+    },
+    "cloudfront": {
+        "aws_access_key_id": AWS_ACCESS_KEY_ID,
+        "aws_secret_access_key": AWS_SECRET_ACCESS_KEY,
+    },
+    "route53domains": {
+        "aws_access_key_id": os.environ.get("53_SECRET_ACCESS_KEY"),
+        "aws_secret_access_key": os.environ.get("53_ACCESS_KEY"),
+        "region_name": "us-east-1",  # Route 53 Domains only runs in us-east-1
+    },
+}
+AWS_MAX_POOL_CONNECTIONS = 16  # Connections per client, at least the upload workers
+AWS_RETRY_MAX_ATTEMPTS = 5  # Retries of a throttled or failed request, adaptive
+
 
 # Additional buckets for templates and portfolio sites
 AWS_STORAGE_TEMPLATE_BUCKET_NAME = os.environ.get("S3_TEMPLATE_BUCKET_NAME")
 AWS_DEPLOYED_PORTFOLIO_BUCKET_NAME = os.environ.get("S3_DEPLOYED_BUCKET_NAME")
 
+# Cache of the template css and js files read while deploying
+TEMPLATE_ASSET_CACHE_MAX_BYTES = 32 * 1024 * 1024
+TEMPLATE_ASSET_CACHE_DIR = os.environ.get(
+    "TEMPLATE_ASSET_CACHE_DIR", str(BASE_DIR / ".template_asset_cache")
+)
+TEMPLATE_ASSET_CACHE_REVALIDATE_AFTER = 60  # Seconds before checking the s3 ETag
+
+# Invalidations of the deployed site are batched (server.utils.cloudfront)
+CLOUDFRONT_INVALIDATION_WINDOW = 5  # Seconds paths are collected before sending
+CLOUDFRONT_INVALIDATION_WILDCARD_MIN_PATHS = 3  # Paths of a folder sent as folder/*
+CLOUDFRONT_INVALIDATION_MAX_WILDCARDS = 15  # CloudFront limit of wildcards in progress
+CLOUDFRONT_DOMAIN_CACHE_TTL = 60 * 60  # Seconds a distribution domain is trusted
+CLOUDFRONT_DOMAIN_RETRY_AFTER = 30  # Seconds before retrying a failed lookup
+
+# Content keyed caches (compiled css, minified files) can live in each process.
+# Materialized customized templates are read by the web and the deployment worker
+# processes, so they are only cached when a shared redis cache is configured.
+REDIS_URL = os.environ.get("REDIS_URL")
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "templates": (
+        {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "templates",
+        }
+        if REDIS_URL
+        else {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+    ),
+}
+
+# Minifiers of the deployed files per content type, None deploys them as they are
+DEPLOY_MINIFIERS = {
+    "text/html": "portfolio.dom_manipulation.minify.minify_html",
+    "text/css": "portfolio.dom_manipulation.minify.minify_css",
+    "application/javascript": "portfolio.dom_manipulation.minify.minify_js",
+}
+
 # Prebuilt tempalte local path
 TEMPLATES_BASE_DIR = "D:\Learnings\Web Development Projects\Templates"
 
@@ -225,3 +303,4 @@ GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_OAUTH2_SECRET")
 
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = ["ETag"]
@@ -0,0 +1,95 @@
+import os
+import weakref
+import threading
+import boto3
+from botocore.config import Config
+from django.conf import settings
+
+
+# Registries of the process, emptied in a forked child by one hook for all of them
+_registries = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for registry in list(_registries):
+        registry.after_fork()
+
+
+if hasattr(os, "register_at_fork"):  # Not on Windows, which doesn't fork
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class AWSClientRegistry:
+    """
+    Creates one client per AWS service from a shared session, so the service
+    models and endpoints are loaded once per process and the connection pool
+    of a client is reused by every request. boto3 clients are thread safe but
+    their sessions are not, so clients are created under a lock. A forked
+    worker shares neither the sockets nor a lock held by another thread of its
+    parent, so the child empties the registry and gets a new lock.
+    """
+
+    def __init__(self, services, max_pool_connections, max_attempts):
+        self.services = services
+        self.config = Config(
+            max_pool_connections=max_pool_connections,
+            retries={"mode": "adaptive", "max_attempts": max_attempts},
+        )
+        self.after_fork()
+        _registries.add(self)
+
+    def after_fork(self):
+        self.lock = threading.Lock()
+        self.session = None
+        self.clients = {}
+
+    def get_session(self):
+        # Called with the lock held
+        if self.session is None:
+            self.session = boto3.session.Session()
+        return self.session
+
+    def create_client(self, service_name, config=None):
+        # Clients with a config of their own are not kept, their caller keeps them
+        with self.lock:
+            return self.get_session().client(
+                service_name,
+                config=self.config.merge(config) if config else self.config,
+                **self.services.get(service_name, {}),
+            )
+
+    def get_client(self, service_name):
+        client = self.clients.get(service_name)
+        if client is not None:
+            return client
+
+        with self.lock:
+            if service_name not in self.clients:
+                self.clients[service_name] = self.get_session().client(
+                    service_name,
+                    config=self.config,
+                    **self.services.get(service_name, {}),
+                )
+            return self.clients[service_name]
+
+
+_aws_client_registry = None
+_aws_client_registry_lock = threading.Lock()
+
+
+def get_aws_client_registry():
+    global _aws_client_registry
+
+    if _aws_client_registry is None:
+        with _aws_client_registry_lock:
+            if _aws_client_registry is None:
+                _aws_client_registry = AWSClientRegistry(
+                    services=settings.AWS_CLIENTS,
+                    max_pool_connections=settings.AWS_MAX_POOL_CONNECTIONS,
+                    max_attempts=settings.AWS_RETRY_MAX_ATTEMPTS,
+                )
+    return _aws_client_registry
+
+
+def get_aws_client(service_name):
+    return get_aws_client_registry().get_client(service_name)
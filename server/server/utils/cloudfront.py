@@ -0,0 +1,354 @@
+import os
+import time
+import atexit
+import posixpath
+import threading
+from collections import deque
+from django.conf import settings
+from server.utils.s3 import (
+    cloudfront_config,
+    fetch_cloudfront_domain,
+    invalidate_cloudfront_paths,
+)
+
+
+def common_prefix(names):
+    return os.path.commonprefix(list(names))
+
+
+def collapse_paths(paths, min_paths, max_wildcards):
+    """
+    Replaces the paths of a directory by one wildcard path ("/site/index.html*"
+    or "/site/css/style.*") when at least `min_paths` of them are in the
+    directory and their names share a prefix. Names without a common prefix are
+    kept, as "/site/*" would invalidate every file under the directory.
+    CloudFront charges a wildcard path as one path and allows only a few of them
+    in progress, so the directories with the most paths are collapsed first.
+    """
+    by_directory = {}
+    for path in paths:
+        if path.endswith("*"):
+            continue
+        directory, name = posixpath.split(path)
+        by_directory.setdefault(directory, []).append(name)
+
+    collapsed = {path for path in paths if path.endswith("*")}
+    wildcards = len(collapsed)
+    for directory, names in sorted(
+        by_directory.items(), key=lambda item: len(item[1]), reverse=True
+    ):
+        prefix = common_prefix(names)
+        if prefix and len(names) >= min_paths and wildcards < max_wildcards:
+            collapsed.add(posixpath.join(directory, prefix) + "*")
+            wildcards += 1
+        else:
+            collapsed.update(posixpath.join(directory, name) for name in names)
+
+    # Paths covered by a wildcard of the batch are not sent again
+    prefixes = [path[:-1] for path in collapsed if path.endswith("*")]
+    return sorted(
+        path
+        for path in collapsed
+        if not any(
+            path != prefix + "*" and path.startswith(prefix) for prefix in prefixes
+        )
+    )
+
+
+class InvalidationBatcher:
+    """
+    Collects the paths to invalidate per distribution for `window` seconds and
+    sends them as one invalidation from a timer thread, so callers never wait
+    for CloudFront. Failed batches are merged into the next one of the same
+    distribution, up to `max_attempts` times.
+    """
+
+    def __init__(self, window, min_wildcard_paths, max_wildcards, max_attempts=3):
+        self.window = window
+        self.min_wildcard_paths = min_wildcard_paths
+        self.max_wildcards = max_wildcards
+        self.max_attempts = max_attempts
+        self.client = None  # The shared cloudfront client is used unless one is set
+        self.pending = {}  # Distribution id -> {path: attempts}
+        self.pending_counts = {}  # Distribution id -> [requests, paths] batched
+        self.timers = {}
+        self.lock = threading.Lock()
+        self.batch_sizes = deque(maxlen=100)
+        self.counters = {
+            "requests": 0,
+            "requested_paths": 0,
+            "batches": 0,
+            "batched_requests": 0,
+            "batched_paths": 0,
+            "submitted_paths": 0,
+            "failed_batches": 0,
+            "dropped_paths": 0,
+        }
+
+    def get_client(self):
+        return self.client or cloudfront_config()
+
+    def submit(self, paths, distribution_id=None):
+        distribution_id = distribution_id or os.environ.get(
+            "DEPLOYED_SITE_CLOUDFRONT_DISTRIBUION_ID"
+        )
+        with self.lock:
+            self.counters["requests"] += 1
+            self.counters["requested_paths"] += len(paths)
+            pending = self.pending.setdefault(distribution_id, {})
+            for path in paths:
+                pending.setdefault(path, 0)
+            counts = self.pending_counts.setdefault(distribution_id, [0, 0])
+            counts[0] += 1
+            counts[1] += len(paths)
+            self.schedule(distribution_id)
+
+    def schedule(self, distribution_id):
+        # Called with the lock held, one timer per distribution at a time
+        if distribution_id in self.timers:
+            return
+        timer = threading.Timer(self.window, self.flush, args=(distribution_id,))
+        timer.daemon = True
+        self.timers[distribution_id] = timer
+        timer.start()
+
+    def flush(self, distribution_id):
+        with self.lock:
+            self.timers.pop(distribution_id, None)
+            pending = self.pending.pop(distribution_id, {})
+            counts = self.pending_counts.pop(distribution_id, [0, 0])
+        if not pending:
+            return
+
+        paths = collapse_paths(pending, self.min_wildcard_paths, self.max_wildcards)
+        try:
+            invalidate_cloudfront_paths(
+                paths, distribution_id=distribution_id, client=self.get_client()
+            )
+        except Exception as error:
+            print("Error occurred while invalidating the cloudfront paths -> ", error)
+            self.retry(distribution_id, pending, counts)
+            return
+
+        with self.lock:
+            self.counters["batches"] += 1
+            self.counters["batched_requests"] += counts[0]
+            self.counters["batched_paths"] += counts[1]
+            self.counters["submitted_paths"] += len(paths)
+            self.batch_sizes.append(len(paths))
+
+    def retry(self, distribution_id, pending, counts):
+        with self.lock:
+            self.counters["failed_batches"] += 1
+            retried = self.pending.setdefault(distribution_id, {})
+            retried_counts = self.pending_counts.setdefault(distribution_id, [0, 0])
+            retried_counts[0] += counts[0]
+            retried_counts[1] += counts[1]
+            for path, attempts in pending.items():
+                if attempts + 1 < self.max_attempts:
+                    retried[path] = max(retried.get(path, 0), attempts + 1)
+                else:
+                    self.counters["dropped_paths"] += 1
+
+            if retried:
+                self.schedule(distribution_id)
+            else:
+                self.pending.pop(distribution_id)
+                self.pending_counts.pop(distribution_id)
+
+    def flush_all(self):
+        with self.lock:
+            for timer in self.timers.values():
+                timer.cancel()
+            self.timers.clear()
+            distribution_ids = list(self.pending)
+
+        for distribution_id in distribution_ids:
+            self.flush(distribution_id)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            batch_sizes = list(self.batch_sizes)
+
+        return {
+            **counters,
+            # Every batched request would have been an invalidation of its own
+            "invalidations_saved": counters["batched_requests"] - counters["batches"],
+            "paths_saved": counters["batched_paths"] - counters["submitted_paths"],
+            "batch_size_min": min(batch_sizes, default=0),
+            "batch_size_max": max(batch_sizes, default=0),
+            "batch_size_mean": (
+                round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else 0.0
+            ),
+        }
+
+
+_invalidation_batcher = None
+_invalidation_batcher_lock = threading.Lock()
+
+
+def get_invalidation_batcher():
+    global _invalidation_batcher
+
+    if _invalidation_batcher is None:
+        with _invalidation_batcher_lock:
+            if _invalidation_batcher is None:
+                _invalidation_batcher = InvalidationBatcher(
+                    window=settings.CLOUDFRONT_INVALIDATION_WINDOW,
+                    min_wildcard_paths=settings.CLOUDFRONT_INVALIDATION_WILDCARD_MIN_PATHS,
+                    max_wildcards=settings.CLOUDFRONT_INVALIDATION_MAX_WILDCARDS,
+                )
+                # Paths still waiting for their window are sent before exiting
+                atexit.register(_invalidation_batcher.flush_all)
+    return _invalidation_batcher
+
+
+class CloudFrontDomainResolver:
+    """
+    Caches the domain of each distribution for `ttl` seconds. A cold lookup is
+    made by one thread while the others wait for it, an expired domain is still
+    returned while one thread refreshes it, and a failed lookup keeps the last
+    domain for `retry_after` seconds. The domain of the prebuilt templates
+    distribution is persisted in Template.cloudfront_domain, so a new process
+    starts without asking CloudFront.
+    """
+
+    def __init__(self, ttl, retry_after):
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self.client = None  # The shared cloudfront client is used unless one is set
+        self.entries = {}  # Distribution id -> (domain, expires_at)
+        self.inflight = {}  # Distribution id -> Event set once looked up
+        self.lock = threading.Lock()
+        self.counters = {
+            "hits": 0,
+            "stale_hits": 0,
+            "waits": 0,
+            "persisted_hits": 0,
+            "lookups": 0,
+            "failures": 0,
+        }
+
+    def get_client(self):
+        return self.client or cloudfront_config()
+
+    def is_persisted(self, distribution_id):
+        return distribution_id == os.environ.get(
+            "PREBUILT_TEMPLATES_CLOUDFRONT_DISTRIBUION_ID"
+        )
+
+    def read_persisted(self, distribution_id):
+        from portfolio.models import Template
+
+        if not self.is_persisted(distribution_id):
+            return None
+        return (
+            Template.objects.exclude(cloudfront_domain__isnull=True)
+            .order_by("-created_at")
+            .values_list("cloudfront_domain", flat=True)
+            .first()
+        )
+
+    def persist(self, distribution_id, domain):
+        from portfolio.models import Template
+
+        if self.is_persisted(distribution_id):
+            # Only the rows with an outdated domain are written
+            Template.objects.exclude(cloudfront_domain=domain).update(
+                cloudfront_domain=domain
+            )
+
+    def resolve(self, distribution_id):
+        if not distribution_id:
+            return None
+
+        with self.lock:
+            domain, expires_at = self.entries.get(distribution_id, (None, 0))
+            if time.time() < expires_at:
+                self.counters["hits"] += 1
+                return domain
+
+            event = self.inflight.get(distribution_id)
+            if event is None:
+                self.inflight[distribution_id] = threading.Event()
+            elif domain:
+                self.counters["stale_hits"] += 1
+                return domain
+            else:
+                self.counters["waits"] += 1
+
+        if event is not None:
+            event.wait(timeout=self.retry_after)
+            with self.lock:
+                return self.entries.get(distribution_id, (None, 0))[0]
+
+        try:
+            return self.load(distribution_id, domain)
+        finally:
+            with self.lock:
+                self.inflight.pop(distribution_id).set()
+
+    def load(self, distribution_id, cached):
+        if not cached:
+            try:
+                persisted = self.read_persisted(distribution_id)
+            except Exception as error:
+                print("Error occurred while reading the cloudfront domain -> ", error)
+                persisted = None
+            if persisted:
+                self.store(distribution_id, persisted, self.ttl, "persisted_hits")
+                return persisted
+
+        try:
+            domain = fetch_cloudfront_domain(distribution_id, client=self.get_client())
+        except Exception as error:
+            print("Error occurred while getting the cloudfront domain -> ", error)
+            # The last known domain is kept, the lookup is retried later
+            self.store(distribution_id, cached, self.retry_after, "failures")
+            return cached
+
+        self.store(distribution_id, domain, self.ttl, "lookups")
+        if domain != cached:
+            try:
+                self.persist(distribution_id, domain)
+            except Exception as error:
+                print("Error occurred while saving the cloudfront domain -> ", error)
+        return domain
+
+    def store(self, distribution_id, domain, ttl, counter):
+        with self.lock:
+            self.entries[distribution_id] = (domain, time.time() + ttl)
+            self.counters[counter] += 1
+
+    def forget(self, distribution_id=None):
+        with self.lock:
+            if distribution_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(distribution_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {**self.counters, "entries": len(self.entries)}
+
+
+_domain_resolver = None
+_domain_resolver_lock = threading.Lock()
+
+
+def get_domain_resolver():
+    global _domain_resolver
+
+    if _domain_resolver is None:
+        with _domain_resolver_lock:
+            if _domain_resolver is None:
+                _domain_resolver = CloudFrontDomainResolver(
+                    ttl=settings.CLOUDFRONT_DOMAIN_CACHE_TTL,
+                    retry_after=settings.CLOUDFRONT_DOMAIN_RETRY_AFTER,
+                )
+    return _domain_resolver
+
+
+def get_cloudfront_domain(distribution_id):
+    return get_domain_resolver().resolve(distribution_id)
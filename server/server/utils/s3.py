@@ -1,47 +1,34 @@
-import boto3
 import os
-from django.conf import settings
 import time
 from portfolio.constants import S3_ASSETS_FOLDER_NAME
 from portfolio.exceptions.exceptions import GeneralError
 import requests
-import threading
+import uuid
+from server.utils.aws import get_aws_client, get_aws_client_registry
 
 
-def s3_config():
+def s3_config(config=None):
     try:
-        s3 = boto3.client(
-            "s3",
-            aws_access_key_id=os.environ.get("S3_SECRET_ACCESS_KEY"),
-            aws_secret_access_key=os.environ.get("S3_KEY_ID"),
-            region_name=os.environ.get("S3_REGION_NAME"),
-        )
-        return s3
+        if config is None:
+            return get_aws_client("s3")
+        return get_aws_client_registry().create_client("s3", config)
     except Exception as error:
         print("Error occurred on s3 -> ", error)
         return None
 
 
 class S3CLientSingleton:
-    _instance = None  # Private class-level variable to hold the S3 client instance
-    _lock = threading.Lock()  # Lock to ensure thread safety
-
+    # Kept for its callers, the client comes from the shared registry
     @classmethod
     def get_instance(cls):
-        if cls._instance is None:
-            with cls._lock:
-                if cls.get_instance is None:
-                    cls._instance = s3_config()
-        return cls._instance
+        return s3_config()
 
 
 class AWS_S3_Operations:
-    s3_client = S3CLientSingleton.get_instance()
-
     @classmethod
     def copy_object_in_s3(cls, old_s3_asset_key, new_s3_asset_key, bucket_name):
         try:
-            cls.s3_client.copy_object(
+            s3_config().copy_object(
                 Bucket=bucket_name,
                 CopySource={
                     "Bucket": bucket_name,
@@ -57,7 +44,7 @@ class AWS_S3_Operations:
     @classmethod
     def delete_object_in_s3(cls, bucket_name, old_s3_asset_key):
         try:
-            cls.s3_client.delete_object(Bucket=bucket_name, Key=old_s3_asset_key)
+            s3_config().delete_object(Bucket=bucket_name, Key=old_s3_asset_key)
             return
         except Exception as error:
             print("Error occurred while deleting the object -> ", error)
@@ -68,39 +55,32 @@ def s3_name_format(name):
     return name.replace(" ", "-").lower()
 
 
-def get_cloudfront_domain(distribution_id):
-    try:
-        cloudfront_client = boto3.client(
-            "cloudfront",
-            aws_access_key_id=os.environ.get("S3_SECRET_ACCESS_KEY"),
-            aws_secret_access_key=os.environ.get("S3_KEY_ID"),
-            region_name=os.environ.get("S3_REGION_NAME"),
-        )
-        response = cloudfront_client.get_distribution(Id=distribution_id)
-        domain_name = response["Distribution"]["DomainName"]
-        return domain_name
-    except Exception as e:
-        print("Error occurred while getting the cloudfront domain -> ", e)
-        return None
+def fetch_cloudfront_domain(distribution_id, client=None):
+    # Resolved through server.utils.cloudfront.get_cloudfront_domain, which caches it
+    client = client or cloudfront_config()
+    response = client.get_distribution(Id=distribution_id)
+    return response["Distribution"]["DomainName"]
 
 
-def invalidate_cloudfront_cache(project_name, file_name):
-    client = boto3.client(
-        "cloudfront",
-        aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    )
+def cloudfront_config():
+    return get_aws_client("cloudfront")
 
-    distribution_id = os.environ.get("DEPLOYED_SITE_CLOUDFRONT_DISTRIBUION_ID")
+
+def invalidate_cloudfront_paths(paths, distribution_id=None, client=None):
+    # Deploys go through server.utils.cloudfront.get_invalidation_batcher instead
+    client = client or cloudfront_config()
+    distribution_id = distribution_id or os.environ.get(
+        "DEPLOYED_SITE_CLOUDFRONT_DISTRIBUION_ID"
+    )
     # Create invalidation for paths related to this version
     invalidation_response = client.create_invalidation(
         DistributionId=distribution_id,
         InvalidationBatch={
             "Paths": {
-                "Quantity": 1,
-                "Items": [f"/{project_name}/{S3_ASSETS_FOLDER_NAME}/{file_name}"],
+                "Quantity": len(paths),
+                "Items": list(paths),
             },
-            "CallerReference": str(time.time()).replace(".", ""),
+            "CallerReference": f"{time.time_ns()}-{uuid.uuid4().hex[:8]}",
         },
     )
     return invalidation_response